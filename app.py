@@ -4,26 +4,709 @@ import json
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 import sqlite3
+import atexit
+import base64
+import functools
 import hashlib
+import logging
+import mimetypes
 import os
-from typing import Dict, List, Tuple
+import queue
+import random
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import MappingProxyType
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("ferais")
+slow_query_logger = logging.getLogger("ferais.slow_sql")
+
+# 🔑 ЗАМЕНИТЕ НА ВАШ DEEPSEEK API КЛЮЧ (или задайте переменную окружения DEEPSEEK_API_KEY)
+DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+
+# 🖼️ Статика приложения: файлы из static/ раздает сам streamlit (server.enableStaticServing в .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "app/static"  # относительный адрес, работает и с server.baseUrlPath
+APP_LOGO_FILE = ""  # ПОЛОЖИТЕ ЛОГОТИП В static/ И УКАЖИТЕ ИМЯ ФАЙЛА, например "logo.png" (пусто - эмодзи)
+APP_STYLES_FILE = "app.css"
+
+# Показывать ответ репетитора по мере генерации (SSE) вместо ожидания полного ответа
+STREAM_RESPONSES = True
+
+# 🌐 Параметры HTTP-клиента DeepSeek
+DEEPSEEK_API_URL = os.environ.get("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+API_CONNECT_TIMEOUT = 5  # секунд на установку соединения
+API_READ_TIMEOUT = 60  # секунд ожидания данных (для потока - между фрагментами)
+API_MAX_RETRIES = 3  # повторов при 429/503 и сбоях соединения
+API_BACKOFF_BASE = 0.5  # базовая задержка экспоненциального отката, секунд
+API_BACKOFF_MAX = 10  # верхняя граница одной паузы, секунд
+HTTP_POOL_SIZE = 64  # keep-alive соединений на процесс (по числу одновременных запросов)
+# chat/completions не идемпотентен: повторяем только ответы, после которых запрос точно не выполнялся
+RETRYABLE_STATUSES = frozenset({429, 503})
+
+# 🧠 Контекст диалога
+CONTEXT_TOKEN_BUDGET = 4000  # токенов на весь промпт: система + резюме + история + сообщение
+SUMMARY_REFRESH_TOKENS = 1200  # резюме обновляется, когда вне окна накопилось столько токенов
+SUMMARY_MAX_TOKENS = 300  # длина резюме
+
+# ⚙️ Фоновое выполнение запросов к LLM
+LLM_MAX_WORKERS = 128  # потоков для ответов; в API одновременно уходит не больше LLM_MAX_CONCURRENT
+LLM_MAX_CONCURRENT = int(os.environ.get("FERAIS_LLM_MAX_CONCURRENT", "16"))  # одновременных запросов к API
+LLM_RATE_PER_S = float(os.environ.get("FERAIS_LLM_RATE_PER_S", "5"))  # запросов в секунду (token bucket); 0 - без лимита
+LLM_RATE_BURST = int(os.environ.get("FERAIS_LLM_RATE_BURST", "10"))  # запросов подряд сверх средней частоты
+LLM_POLL_INTERVAL_S = 0.3  # как часто страница проверяет готовность ответа
+LLM_JOB_TTL_S = 600  # сколько хранить готовый, но не показанный ответ
+
+# 🗃️ Кэш ответов на быстрые действия
+RESPONSE_CACHE_VARIANTS = 5  # вариантов ответа на один ключ, чтобы содержание чередовалось
+RESPONSE_CACHE_TTL_S = 7 * 24 * 3600
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+
+# ✍️ Отложенная запись сессий обучения
+WRITE_BATCH_SIZE = 200  # событий в одной транзакции
+WRITE_FLUSH_INTERVAL_S = 1.0  # максимальная задержка записи
+WRITE_MAX_ATTEMPTS = 3  # неудачных записей пачки, после которых она пишется по одной записи
+USAGE_REPORT_DAYS = 7  # окно сводок журнала использования API
+
+# Сессия, которую засчитывает обычный вопрос-ответ: (тип, минуты, упражнения, балл)
+CHAT_TURN_SESSION = ("conversation", 3, 1, 0)
+
+# 💬 История диалогов
+CONVERSATION_WINDOW = 40  # последних сообщений каждого языка, которые держатся в памяти сессии
+CHAT_DISPLAY_MESSAGES = 10  # сколько сообщений показывать сразу
+CHAT_PAGE_SIZE = 20  # сообщений в одной подгружаемой странице
+
+# 📊 Аналитика страницы статистики
+ANALYTICS_DAYS = 30  # дневной ряд, дней (включая сегодня)
+ANALYTICS_ROLLING_DAYS = 7  # окно скользящего среднего
+ANALYTICS_WEEKS = 12  # недельный тренд, недель
+ANALYTICS_CACHE_SIZE = 256  # результатов (пользователь, версия данных, день) в памяти процесса
+CHART_MAX_POINTS = 120  # точек на линию графика; более длинные ряды усредняются по интервалам
+
+# 🔁 Словарь с интервальными повторениями (SM-2)
+VOCAB_REVIEW_BATCH = 20  # карточек в одном повторении
+VOCAB_NEW_WORDS = 10  # новых слов за одно обращение к репетитору
+VOCAB_EXCLUDE_WORDS = 50  # последних изученных слов, которые репетитор не должен предлагать снова
+VOCAB_INITIAL_EASE = 2.5
+VOCAB_MIN_EASE = 1.3
+VOCAB_RELEARN_MINUTES = 10  # забытое слово возвращается в очередь через столько минут
+VOCAB_LIST_MARKER = "СЛОВАРЬ:"  # после этой строки репетитор перечисляет новые слова: слово | перевод | пример
+
+# 📝 Упражнения: один запрос JSON на набор, ответы проверяются локально
+EXERCISE_QUESTIONS = 5  # заданий в наборе
+EXERCISE_MAX_TOKENS = 2500  # набор с объяснением длиннее обычной реплики
+EXERCISE_CHECK_MAX_TOKENS = 200  # вердикт репетитора по свободному ответу
+EXERCISE_JSON_FORMAT = (
+    'Ответ - только JSON-объект: {"topic": "тема", "explanation": "объяснение темы в markdown или пустая строка", '
+    '"questions": [{"question": "задание", "options": ["варианты ответа или пустой список"], '
+    '"answers": ["все правильные ответы"], "explanation": "почему так", "free_text": false}]}. '
+    'free_text: true - только для заданий со свободным ответом (перевести или составить предложение), '
+    'где верных формулировок много; тогда answers - образцы'
+)
+# Запросы наборов по типу сессии
+EXERCISE_PROMPTS = {
+    "grammar": f"Выбери грамматическую тему, кратко объясни ее и дай {EXERCISE_QUESTIONS} практических "
+               f"упражнений. {EXERCISE_JSON_FORMAT}",
+    "test": f"Составь тест из {EXERCISE_QUESTIONS} вопросов на лексику и грамматику этого уровня; "
+            f"explanation оставь пустым. {EXERCISE_JSON_FORMAT}",
+}
 
-# 🔑 ЗАМЕНИТЕ НА ВАШ DEEPSEEK API КЛЮЧ
-DEEPSEEK_API_KEY = ""
+# 🗄️ Параметры базы данных
+DATABASE_PATH = os.environ.get("LANGUAGE_TUTOR_DB", "language_tutor.db")
+DB_READER_POOL_SIZE = 8  # соединений для чтения на процесс
+DB_BUSY_TIMEOUT_MS = 5000  # ожидание блокировки вместо "database is locked"
+
+# 📈 Метрики
+METRICS_PORT = int(os.environ.get("FERAIS_METRICS_PORT", "0"))  # Prometheus на 127.0.0.1:порт/metrics; 0 - выкл.
+METRIC_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SLOW_QUERY_MS = 100  # запросы дольше пишутся в журнал ferais.slow_sql
+# Пользователи, которым показывается разбивка времени перезапуска
+ADMIN_USERNAMES = frozenset(name for name in os.environ.get("FERAIS_ADMINS", "").split(",") if name)
+
+# 📚 Каталог: собирается один раз на процесс (get_catalog) и не меняется
+# Языки для изучения: (ключ, название, флаг, код ISO)
+TARGET_LANGUAGES = (
+    ("english", "Английский", "🇬🇧", "en"),
+    ("spanish", "Испанский", "🇪🇸", "es"),
+    ("french", "Французский", "🇫🇷", "fr"),
+    ("german", "Немецкий", "🇩🇪", "de"),
+    ("chinese", "Китайский", "🇨🇳", "zh"),
+    ("japanese", "Японский", "🇯🇵", "ja"),
+    ("russian", "Русский", "🇷🇺", "ru"),
+    ("korean", "Корейский", "🇰🇷", "ko"),
+    ("italian", "Итальянский", "🇮🇹", "it"),
+    ("arabic", "Арабский", "🇸🇦", "ar"),
+    ("portuguese", "Португальский", "🇵🇹", "pt"),
+    ("turkish", "Турецкий", "🇹🇷", "tr"),
+    ("hindi", "Хинди", "🇮🇳", "hi"),
+    ("dutch", "Нидерландский", "🇳🇱", "nl"),
+    ("swedish", "Шведский", "🇸🇪", "sv"),
+    ("norwegian", "Норвежский", "🇳🇴", "no"),
+    ("danish", "Датский", "🇩🇰", "da"),
+    ("finnish", "Финский", "🇫🇮", "fi"),
+    ("polish", "Польский", "🇵🇱", "pl"),
+    ("czech", "Чешский", "🇨🇿", "cs"),
+    ("hungarian", "Венгерский", "🇭🇺", "hu"),
+    ("greek", "Греческий", "🇬🇷", "el"),
+    ("hebrew", "Иврит", "🇮🇱", "he"),
+    ("thai", "Тайский", "🇹🇭", "th"),
+    ("vietnamese", "Вьетнамский", "🇻🇳", "vi"),
+    ("indonesian", "Индонезийский", "🇮🇩", "id"),
+    ("malay", "Малайский", "🇲🇾", "ms"),
+    ("filipino", "Филиппинский", "🇵🇭", "tl"),
+    ("ukrainian", "Украинский", "🇺🇦", "uk"),
+    ("belarusian", "Белорусский", "🇧🇾", "be"),
+    ("bulgarian", "Болгарский", "🇧🇬", "bg"),
+    ("romanian", "Румынский", "🇷🇴", "ro"),
+    ("serbian", "Сербский", "🇷🇸", "sr"),
+    ("croatian", "Хорватский", "🇭🇷", "hr"),
+    ("slovak", "Словацкий", "🇸🇰", "sk"),
+    ("slovenian", "Словенский", "🇸🇮", "sl"),
+    ("lithuanian", "Литовский", "🇱🇹", "lt"),
+    ("latvian", "Латышский", "🇱🇻", "lv"),
+    ("estonian", "Эстонский", "🇪🇪", "et"),
+    ("icelandic", "Исландский", "🇮🇸", "is"),
+    ("maltese", "Мальтийский", "🇲🇹", "mt"),
+    ("georgian", "Грузинский", "🇬🇪", "ka"),
+    ("armenian", "Армянский", "🇦🇲", "hy"),
+    ("azerbaijani", "Азербайджанский", "🇦🇿", "az"),
+    ("kazakh", "Казахский", "🇰🇿", "kk"),
+    ("uzbek", "Узбекский", "🇺🇿", "uz"),
+    ("kyrgyz", "Киргизский", "🇰🇬", "ky"),
+    ("turkmen", "Туркменский", "🇹🇲", "tk"),
+    ("tajik", "Таджикский", "🇹🇯", "tg"),
+    ("mongolian", "Монгольский", "🇲🇳", "mn"),
+    ("persian", "Персидский", "🇮🇷", "fa"),
+    ("urdu", "Урду", "🇵🇰", "ur"),
+    ("bengali", "Бенгальский", "🇧🇩", "bn"),
+    ("punjabi", "Панджаби", "🇮🇳", "pa"),
+    ("tamil", "Тамильский", "🇮🇳", "ta"),
+    ("telugu", "Телугу", "🇮🇳", "te"),
+    ("marathi", "Маратхи", "🇮🇳", "mr"),
+    ("gujarati", "Гуджарати", "🇮🇳", "gu"),
+    ("kannada", "Каннада", "🇮🇳", "kn"),
+    ("malayalam", "Малаялам", "🇮🇳", "ml"),
+    ("sinhala", "Сингальский", "🇱🇰", "si"),
+    ("nepali", "Непальский", "🇳🇵", "ne"),
+    ("burmese", "Бирманский", "🇲🇲", "my"),
+    ("khmer", "Кхмерский", "🇰🇭", "km"),
+    ("lao", "Лаосский", "🇱🇦", "lo"),
+    ("swahili", "Суахили", "🇰🇪", "sw"),
+    ("yoruba", "Йоруба", "🇳🇬", "yo"),
+    ("igbo", "Игбо", "🇳🇬", "ig"),
+    ("hausa", "Хауса", "🇳🇬", "ha"),
+    ("amharic", "Амхарский", "🇪🇹", "am"),
+    ("somali", "Сомали", "🇸🇴", "so"),
+    ("zulu", "Зулу", "🇿🇦", "zu"),
+    ("afrikaans", "Африкаанс", "🇿🇦", "af"),
+    ("albanian", "Албанский", "🇦🇱", "sq"),
+    ("basque", "Баскский", "🇪🇸", "eu"),
+    ("catalan", "Каталанский", "🇪🇸", "ca"),
+    ("galician", "Галисийский", "🇪🇸", "gl"),
+    ("welsh", "Валлийский", "🏴", "cy"),
+    ("irish", "Ирландский", "🇮🇪", "ga"),
+    ("scottish_gaelic", "Шотландский гэльский", "🏴", "gd"),
+    ("breton", "Бретонский", "🇫🇷", "br"),
+    ("esperanto", "Эсперанто", "🟢", "eo"),
+    ("latin", "Латинский", "🏛️", "la"),
+    ("ancient_greek", "Древнегреческий", "🏛️", "grc"),
+    ("sanskrit", "Санскрит", "🇮🇳", "sa"),
+)
+
+# Языки интерфейса: (ключ, название, эмодзи)
+INTERFACE_LANGUAGES = (
+    ("russian", "Русский", "🇷🇺"),
+    ("english", "English", "🇬🇧"),
+    ("spanish", "Español", "🇪🇸"),
+    ("french", "Français", "🇫🇷"),
+)
+
+# Уровни владения: (ключ, название, эмодзи)
+LEVELS = (
+    ("beginner", "Начинающий (A1)", ""),
+    ("elementary", "Элементарный (A2)", ""),
+    ("intermediate", "Средний (B1-B2)", ""),
+    ("advanced", "Продвинутый (C1-C2)", ""),
+)
+
+# Системные промпты: длинная общая часть идет первой и совпадает побайтно у всех
+# учеников и ходов, поэтому попадает в кэш префиксов DeepSeek; язык и уровень - в конце
+SYSTEM_PROMPT_TEMPLATES = {
+    "russian": """Ты - профессиональный репетитор иностранного языка.
 
-# 🖼️ ЗАМЕНИТЕ НА ССЫЛКУ ВАШЕГО ЛОГОТИПА (или оставьте пустым для эмодзи)
-APP_LOGO_URL = "https://ferlenguas.ru/wp-content/uploads/2025/11/logo.png"  # Например: "https://raw.githubusercontent.com/your-repo/logo.png"
+Твои обязанности:
+1. Объясняй грамматику простыми словами с примерами
+2. Приводи примеры использования слов и выражений
+3. Исправляй ошибки и подробно объясняй почему они ошибки
+4. Задавай практические вопросы для закрепления материала
+5. Будь терпеливым, поддерживающим и мотивирующим
+6. Используй смесь русского и изучаемого языка в зависимости от уровня студента
+7. Структурируй информацию четко и понятно
+8. Предлагай дополнительные упражнения для практики
+
+Отвечай на русском языке, но включай примеры и практические задания на изучаемом языке.
+
+Изучаемый язык: {language}.
+Уровень студента: {level}.""",
+
+    "english": """You are a professional foreign language tutor.
+
+Your responsibilities:
+1. Explain grammar in simple terms with examples
+2. Provide examples of word and expression usage
+3. Correct mistakes and explain why they are mistakes
+4. Ask practical questions to reinforce material
+5. Be patient, supportive and motivating
+6. Use a mix of English and the target language depending on student level
+7. Structure information clearly and understandably
+8. Suggest additional exercises for practice
+
+Respond in English, but include examples and practical exercises in the target language.
+
+Target language: {language}.
+Student level: {level}.""",
+}
+
+# Агрегаты, поддерживаемые триггерами при вставке в study_sessions:
+# таблица -> (столбцы, пересчет тех же столбцов из сырых данных)
+ROLLUP_TABLES = {
+    "user_totals": (
+        "user_id, sessions, total_time, exercises, score_sum, scored",
+        '''SELECT user_id, COUNT(*), COALESCE(SUM(duration_minutes), 0),
+                  COALESCE(SUM(exercises_completed), 0), COALESCE(SUM(score), 0), COUNT(score)
+           FROM study_sessions GROUP BY user_id'''
+    ),
+    "user_progress": (
+        "user_id, target_language, sessions, total_time, exercises, score_sum, scored, "
+        "vocabulary_learned, grammar_exercises, conversation_practice, last_studied",
+        '''SELECT user_id, target_language, COUNT(*), COALESCE(SUM(duration_minutes), 0),
+                  COALESCE(SUM(exercises_completed), 0), COALESCE(SUM(score), 0), COUNT(score),
+                  COALESCE(SUM(CASE WHEN session_type = 'vocabulary' THEN exercises_completed END), 0),
+                  COALESCE(SUM(CASE WHEN session_type = 'grammar' THEN exercises_completed END), 0),
+                  COALESCE(SUM(CASE WHEN session_type = 'conversation' THEN exercises_completed END), 0),
+                  MAX(created_at)
+           FROM study_sessions GROUP BY user_id, target_language'''
+    ),
+    "user_daily_progress": (
+        "user_id, study_date, sessions, total_time, exercises",
+        '''SELECT user_id, DATE(created_at), COUNT(*), COALESCE(SUM(duration_minutes), 0),
+                  COALESCE(SUM(exercises_completed), 0)
+           FROM study_sessions GROUP BY user_id, DATE(created_at)'''
+    ),
+    "user_session_types": (
+        "user_id, session_type, sessions",
+        "SELECT user_id, session_type, COUNT(*) FROM study_sessions GROUP BY user_id, session_type"
+    ),
+    # Серии: подряд идущие дни группируются по (день - порядковый номер дня)
+    "user_streaks": (
+        "user_id, current_streak, longest_streak, last_study_date",
+        '''WITH days AS (
+               SELECT DISTINCT user_id, DATE(created_at) AS study_date FROM study_sessions
+           ),
+           runs AS (
+               SELECT user_id, COUNT(*) AS length, MAX(study_date) AS last_date
+               FROM (SELECT user_id, study_date,
+                            JULIANDAY(study_date) - ROW_NUMBER() OVER (
+                                PARTITION BY user_id ORDER BY study_date) AS island
+                     FROM days)
+               GROUP BY user_id, island
+           )
+           SELECT user_id,
+                  (SELECT r.length FROM runs r WHERE r.user_id = runs.user_id
+                   ORDER BY r.last_date DESC LIMIT 1),
+                  MAX(length),
+                  MAX(last_date)
+           FROM runs GROUP BY user_id'''
+    ),
+}
+
+
+class Metrics:
+    """Счетчики и гистограммы процесса в формате Prometheus; замеры текущего перезапуска по потокам"""
+
+    def __init__(self, buckets: Tuple[float, ...] = METRIC_BUCKETS_S):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, List[float]]] = {}  # метки -> [бакеты..., сумма, количество]
+        self._gauges: Dict[str, Dict[Tuple, float]] = {}
+        self._local = threading.local()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def value(self, name: str, **labels) -> float:
+        """Текущее значение счетчика"""
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += seconds
+            counts[-1] += 1
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace.append((" ".join([name.replace("ferais_", "").replace("_seconds", "")] + list(labels.values())),
+                          seconds))
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        """Замеряет блок в гистограмму ferais_<name>_seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"ferais_{name}_seconds", time.perf_counter() - start, **labels)
+
+    def start_trace(self):
+        """Начинает сбор замеров текущего потока (перезапуска скрипта)"""
+        self._local.trace = []
+
+    def finish_trace(self) -> List[Tuple[str, float]]:
+        trace, self._local.trace = getattr(self._local, "trace", None) or [], None
+        return trace
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{format_labels(key)} {value:g}")
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                for key, value in series.items():
+                    lines.append(f"{name}{format_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, counts in series.items():
+                    for bound, count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{format_labels(key + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {counts[-1]}")
+                    lines.append(f"{name}_sum{format_labels(key)} {counts[-2]:.6f}")
+                    lines.append(f"{name}_count{format_labels(key)} {counts[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """Отдает метрики по HTTP на 127.0.0.1:port/metrics в фоновом потоке"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.render().encode("utf-8")
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+def format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+@functools.lru_cache(maxsize=1024)
+def sql_label(sql: str) -> str:
+    """Короткая метка запроса для метрик: глагол и первая таблица ("SELECT user_totals")"""
+    verb = sql.split(None, 1)[0].upper() if sql.strip() else "?"
+    match = re.search(r"\b(?:FROM|INTO|UPDATE|PRAGMA)\s+([A-Za-z_]\w*)", sql, re.IGNORECASE)
+    return f"{verb} {match.group(1)}" if match and verb != "PRAGMA" else verb
+
+
+def params_shape(params, many: bool = False) -> str:
+    """Форма параметров для журнала медленных запросов - без самих значений"""
+    if many:
+        if not isinstance(params, (list, tuple)):
+            return "executemany(iterable)"
+        return f"executemany[{len(params)}] {params_shape(params[0]) if params else '()'}"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий execute/executemany: через курсоры идут миграции, регистрация и pd.read_sql_query"""
+
+    def execute(self, sql: str, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self.connection.record_query(sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql: str, params):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            self.connection.record_query(sql, params, time.perf_counter() - start, many=True)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, замеряющее execute/executemany (до первой строки результата) - свои и своих курсоров"""
+
+    metrics: Optional[Metrics] = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    def execute(self, sql: str, params=()):
+        # Connection.execute не вызывает cursor.execute - замер нужен и здесь
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self.record_query(sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql: str, params):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            self.record_query(sql, params, time.perf_counter() - start, many=True)
+
+    def record_query(self, sql: str, params, seconds: float, many: bool = False):
+        if self.metrics is not None:
+            self.metrics.observe("ferais_db_query_seconds", seconds, query=sql_label(sql))
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            if self.metrics is not None:
+                self.metrics.inc("ferais_slow_queries_total", query=sql_label(sql))
+            slow_query_logger.warning("Медленный запрос %.1f мс: %s | параметры: %s",
+                                      seconds * 1000, " ".join(sql.split())[:500], params_shape(params, many))
+
+
+@st.cache_resource
+def get_metrics() -> Metrics:
+    """Метрики процесса; при заданном FERAIS_METRICS_PORT - с HTTP-экспортом"""
+    metrics = Metrics()
+    if METRICS_PORT:
+        try:
+            metrics.serve(METRICS_PORT)
+        except OSError as e:
+            logger.warning("Не удалось открыть порт метрик %s: %s", METRICS_PORT, e)
+    return metrics
 
 
 class DatabaseManager:
-    def __init__(self):
-        self.conn = sqlite3.connect('language_tutor.db', check_same_thread=False)
-        self.create_tables()
+    """Общий для процесса доступ к SQLite: пул читателей и один сериализованный писатель"""
+
+    def __init__(self, path: str = DATABASE_PATH, pool_size: int = DB_READER_POOL_SIZE,
+                 metrics: Optional[Metrics] = None):
+        self.path = path
+        self.pool_size = pool_size
+        self.metrics = metrics
+        self._write_lock = threading.Lock()
+        self._readers: queue.LifoQueue = queue.LifoQueue()
+        self._readers_created = 0
+        self._readers_lock = threading.Lock()
+        # Версии данных статистики по пользователям: растут при каждой записи сессии
+        self._data_versions: Dict[int, int] = {}
+        self._versions_lock = threading.Lock()
+
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self.migrate()
+
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        """Открывает соединение с настроенными PRAGMA"""
+        # isolation_level=None: транзакции открываются явно в write()
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            isolation_level=None,
+            factory=InstrumentedConnection
+        )
+        conn.metrics = self.metrics
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA mmap_size=134217728")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if self._readers_created < self.pool_size:
+                self._readers_created += 1
+                return self._connect(readonly=True)
+        return self._readers.get()
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        """Выдает соединение для чтения из пула"""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """Выполняет блок в транзакции единственного писателя"""
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            else:
+                self._writer.execute("COMMIT")
+
+    def close(self):
+        """Закрывает все соединения процесса"""
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def data_version(self, user_id: int) -> int:
+        """Версия данных пользователя для инвалидации кэшей статистики"""
+        return self._data_versions.get(user_id, 0)
+
+    def bump_data_version(self, user_id: int):
+        """Отмечает, что у пользователя появились новые данные"""
+        with self._versions_lock:
+            self._data_versions[user_id] = self._data_versions.get(user_id, 0) + 1
+
+    def add_study_sessions(self, events: List["StudyEvent"]):
+        """Записывает пачку сессий одной транзакцией (агрегаты обновляют триггеры)"""
+        with self.write() as conn:
+            conn.executemany('''
+                INSERT INTO study_sessions (user_id, target_language, session_type, duration_minutes,
+                                            exercises_completed, score, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(e.user_id, e.target_language, e.session_type, e.duration, e.exercises, e.score, e.created_at)
+                  for e in events])
+
+    def touch_response_cache(self, touches: List["CacheTouch"]):
+        """Учитывает пачку попаданий в кэш ответов (время последнего использования для LRU и счетчик)"""
+        grouped: Dict[Tuple[str, int], List[float]] = {}
+        for touch in touches:
+            grouped.setdefault((touch.cache_key, touch.variant), []).append(touch.used_at)
+        with self.write() as conn:
+            conn.executemany(
+                "UPDATE response_cache SET last_used_at = MAX(last_used_at, ?), hits = hits + ? "
+                "WHERE cache_key = ? AND variant = ?",
+                [(max(used), len(used), key, variant) for (key, variant), used in grouped.items()]
+            )
 
-    def create_tables(self):
-        cursor = self.conn.cursor()
+    def add_api_usage(self, records: List["UsageRecord"]):
+        """Записывает пачку строк журнала использования API одной транзакцией"""
+        with self.write() as conn:
+            conn.executemany('''
+                INSERT INTO api_usage (user_id, target_language, session_type, request_kind, turn,
+                                       prompt_tokens, completion_tokens, cached_tokens, latency_ms,
+                                       status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(r.user_id, r.target_language, r.session_type, r.request_kind, r.turn, r.prompt_tokens,
+                   r.completion_tokens, r.cached_tokens, r.latency_ms, r.status, r.created_at) for r in records])
+
+    def add_vocabulary(self, user_id: int, target_language: str, words: List["VocabularyWord"],
+                       created_at: str) -> int:
+        """Добавляет новые слова (сразу к повторению); уже известные пропускаются. Возвращает число добавленных"""
+        with self.write() as conn:
+            before = conn.total_changes
+            conn.executemany('''
+                INSERT OR IGNORE INTO vocabulary (user_id, target_language, word, translation, example,
+                                                  ease, due_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(user_id, target_language, w.word, w.translation, w.example, VOCAB_INITIAL_EASE,
+                   created_at, created_at) for w in words])
+            return conn.total_changes - before
+
+    def update_vocabulary_reviews(self, reviews: List["CardReview"]):
+        """Записывает пачку результатов повторения одной транзакцией"""
+        with self.write() as conn:
+            conn.executemany('''
+                UPDATE vocabulary
+                SET ease = ?, interval_days = ?, repetitions = ?, lapses = ?, due_at = ?, last_reviewed_at = ?
+                WHERE id = ?
+            ''', [(r.ease, r.interval_days, r.repetitions, r.lapses, r.due_at, r.reviewed_at, r.card_id)
+                  for r in reviews])
+
+    def schema_version(self) -> int:
+        """Текущая версия схемы (PRAGMA user_version)"""
+        with self.read() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrations(self) -> List[Tuple[str, Callable[[sqlite3.Connection], None]]]:
+        """Упорядоченный список миграций; версия = позиция в списке + 1"""
+        return [
+            ("Базовая схема", self._migration_initial_schema),
+            ("Индексы и уникальность языков пользователя", self._migration_indexes_and_unique_languages),
+            ("Агрегаты статистики", self._migration_rollups),
+            ("Инкрементальные серии дней", self._migration_streaks),
+            ("Кэш ответов", self._migration_response_cache),
+            ("История диалогов", self._migration_messages),
+            ("Журнал использования API", self._migration_api_usage),
+            ("Словарь интервальных повторений", self._migration_vocabulary),
+            ("Серии дней с сессиями задним числом", self._migration_backdated_streaks),
+        ]
+
+    def migrate(self):
+        """Применяет недостающие миграции, каждую в своей транзакции"""
+        for version, (name, migration) in enumerate(self.migrations(), start=1):
+            with self.write() as conn:
+                # Версию перечитываем под блокировкой писателя: другой процесс мог уже мигрировать
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if current >= version:
+                    continue
+                migration(conn)
+                conn.execute(f"PRAGMA user_version={version}")
+
+    def _migration_initial_schema(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
 
         # Таблица пользователей
         cursor.execute('''
@@ -81,168 +764,861 @@ class DatabaseManager:
             )
         ''')
 
-        self.conn.commit()
+    def _migration_indexes_and_unique_languages(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
 
+        # Удаляем дубликаты языков, оставляя самую раннюю запись
+        cursor.execute('''
+            DELETE FROM user_languages
+            WHERE id NOT IN (
+                SELECT MIN(id) FROM user_languages GROUP BY user_id, target_language
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_user_languages_user_language
+            ON user_languages (user_id, target_language)
+        ''')
 
-class LanguageTutor:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.base_url = "https://api.deepseek.com/v1/chat/completions"
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+        # Статистика всегда фильтрует сессии по пользователю и дате/языку
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_study_sessions_user_created
+            ON study_sessions (user_id, created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_study_sessions_user_language
+            ON study_sessions (user_id, target_language)
+        ''')
+        cursor.execute("ANALYZE")
 
-        # Языки для изучения
-        self.target_languages = {
-            "english": {"name": "Английский", "flag": "🇬🇧", "code": "en"},
-            "spanish": {"name": "Испанский", "flag": "🇪🇸", "code": "es"},
-            "french": {"name": "Французский", "flag": "🇫🇷", "code": "fr"},
-            "german": {"name": "Немецкий", "flag": "🇩🇪", "code": "de"},
-            "chinese": {"name": "Китайский", "flag": "🇨🇳", "code": "zh"},
-            "japanese": {"name": "Японский", "flag": "🇯🇵", "code": "ja"},
-            "russian": {"name": "Русский", "flag": "🇷🇺", "code": "ru"},
-            "korean": {"name": "Корейский", "flag": "🇰🇷", "code": "ko"},
-            "italian": {"name": "Итальянский", "flag": "🇮🇹", "code": "it"},
-            "arabic": {"name": "Арабский", "flag": "🇸🇦", "code": "ar"},
-            "portuguese": {"name": "Португальский", "flag": "🇵🇹", "code": "pt"},
-            "turkish": {"name": "Турецкий", "flag": "🇹🇷", "code": "tr"},
-            "hindi": {"name": "Хинди", "flag": "🇮🇳", "code": "hi"},
-            "dutch": {"name": "Нидерландский", "flag": "🇳🇱", "code": "nl"},
-            "swedish": {"name": "Шведский", "flag": "🇸🇪", "code": "sv"},
-            "norwegian": {"name": "Норвежский", "flag": "🇳🇴", "code": "no"},
-            "danish": {"name": "Датский", "flag": "🇩🇰", "code": "da"},
-            "finnish": {"name": "Финский", "flag": "🇫🇮", "code": "fi"},
-            "polish": {"name": "Польский", "flag": "🇵🇱", "code": "pl"},
-            "czech": {"name": "Чешский", "flag": "🇨🇿", "code": "cs"},
-            "hungarian": {"name": "Венгерский", "flag": "🇭🇺", "code": "hu"},
-            "greek": {"name": "Греческий", "flag": "🇬🇷", "code": "el"},
-            "hebrew": {"name": "Иврит", "flag": "🇮🇱", "code": "he"},
-            "thai": {"name": "Тайский", "flag": "🇹🇭", "code": "th"},
-            "vietnamese": {"name": "Вьетнамский", "flag": "🇻🇳", "code": "vi"},
-            "indonesian": {"name": "Индонезийский", "flag": "🇮🇩", "code": "id"},
-            "malay": {"name": "Малайский", "flag": "🇲🇾", "code": "ms"},
-            "filipino": {"name": "Филиппинский", "flag": "🇵🇭", "code": "tl"},
-            "ukrainian": {"name": "Украинский", "flag": "🇺🇦", "code": "uk"},
-            "belarusian": {"name": "Белорусский", "flag": "🇧🇾", "code": "be"},
-            "bulgarian": {"name": "Болгарский", "flag": "🇧🇬", "code": "bg"},
-            "romanian": {"name": "Румынский", "flag": "🇷🇴", "code": "ro"},
-            "serbian": {"name": "Сербский", "flag": "🇷🇸", "code": "sr"},
-            "croatian": {"name": "Хорватский", "flag": "🇭🇷", "code": "hr"},
-            "slovak": {"name": "Словацкий", "flag": "🇸🇰", "code": "sk"},
-            "slovenian": {"name": "Словенский", "flag": "🇸🇮", "code": "sl"},
-            "lithuanian": {"name": "Литовский", "flag": "🇱🇹", "code": "lt"},
-            "latvian": {"name": "Латышский", "flag": "🇱🇻", "code": "lv"},
-            "estonian": {"name": "Эстонский", "flag": "🇪🇪", "code": "et"},
-            "icelandic": {"name": "Исландский", "flag": "🇮🇸", "code": "is"},
-            "maltese": {"name": "Мальтийский", "flag": "🇲🇹", "code": "mt"},
-            "georgian": {"name": "Грузинский", "flag": "🇬🇪", "code": "ka"},
-            "armenian": {"name": "Армянский", "flag": "🇦🇲", "code": "hy"},
-            "azerbaijani": {"name": "Азербайджанский", "flag": "🇦🇿", "code": "az"},
-            "kazakh": {"name": "Казахский", "flag": "🇰🇿", "code": "kk"},
-            "uzbek": {"name": "Узбекский", "flag": "🇺🇿", "code": "uz"},
-            "kyrgyz": {"name": "Киргизский", "flag": "🇰🇬", "code": "ky"},
-            "turkmen": {"name": "Туркменский", "flag": "🇹🇲", "code": "tk"},
-            "tajik": {"name": "Таджикский", "flag": "🇹🇯", "code": "tg"},
-            "mongolian": {"name": "Монгольский", "flag": "🇲🇳", "code": "mn"},
-            "persian": {"name": "Персидский", "flag": "🇮🇷", "code": "fa"},
-            "urdu": {"name": "Урду", "flag": "🇵🇰", "code": "ur"},
-            "bengali": {"name": "Бенгальский", "flag": "🇧🇩", "code": "bn"},
-            "punjabi": {"name": "Панджаби", "flag": "🇮🇳", "code": "pa"},
-            "tamil": {"name": "Тамильский", "flag": "🇮🇳", "code": "ta"},
-            "telugu": {"name": "Телугу", "flag": "🇮🇳", "code": "te"},
-            "marathi": {"name": "Маратхи", "flag": "🇮🇳", "code": "mr"},
-            "gujarati": {"name": "Гуджарати", "flag": "🇮🇳", "code": "gu"},
-            "kannada": {"name": "Каннада", "flag": "🇮🇳", "code": "kn"},
-            "malayalam": {"name": "Малаялам", "flag": "🇮🇳", "code": "ml"},
-            "sinhala": {"name": "Сингальский", "flag": "🇱🇰", "code": "si"},
-            "nepali": {"name": "Непальский", "flag": "🇳🇵", "code": "ne"},
-            "burmese": {"name": "Бирманский", "flag": "🇲🇲", "code": "my"},
-            "khmer": {"name": "Кхмерский", "flag": "🇰🇭", "code": "km"},
-            "lao": {"name": "Лаосский", "flag": "🇱🇦", "code": "lo"},
-            "swahili": {"name": "Суахили", "flag": "🇰🇪", "code": "sw"},
-            "yoruba": {"name": "Йоруба", "flag": "🇳🇬", "code": "yo"},
-            "igbo": {"name": "Игбо", "flag": "🇳🇬", "code": "ig"},
-            "hausa": {"name": "Хауса", "flag": "🇳🇬", "code": "ha"},
-            "amharic": {"name": "Амхарский", "flag": "🇪🇹", "code": "am"},
-            "somali": {"name": "Сомали", "flag": "🇸🇴", "code": "so"},
-            "zulu": {"name": "Зулу", "flag": "🇿🇦", "code": "zu"},
-            "afrikaans": {"name": "Африкаанс", "flag": "🇿🇦", "code": "af"},
-            "albanian": {"name": "Албанский", "flag": "🇦🇱", "code": "sq"},
-            "basque": {"name": "Баскский", "flag": "🇪🇸", "code": "eu"},
-            "catalan": {"name": "Каталанский", "flag": "🇪🇸", "code": "ca"},
-            "galician": {"name": "Галисийский", "flag": "🇪🇸", "code": "gl"},
-            "welsh": {"name": "Валлийский", "flag": "🏴", "code": "cy"},
-            "irish": {"name": "Ирландский", "flag": "🇮🇪", "code": "ga"},
-            "scottish_gaelic": {"name": "Шотландский гэльский", "flag": "🏴", "code": "gd"},
-            "breton": {"name": "Бретонский", "flag": "🇫🇷", "code": "br"},
-            "esperanto": {"name": "Эсперанто", "flag": "🟢", "code": "eo"},
-            "latin": {"name": "Латинский", "flag": "🏛️", "code": "la"},
-            "ancient_greek": {"name": "Древнегреческий", "flag": "🏛️", "code": "grc"},
-            "sanskrit": {"name": "Санскрит", "flag": "🇮🇳", "code": "sa"}
-        }
+    def _migration_rollups(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
 
-        # Языки интерфейса
-        self.interface_languages = {
-            "russian": {"name": "Русский", "emoji": "🇷🇺"},
-            "english": {"name": "English", "emoji": "🇬🇧"},
-            "spanish": {"name": "Español", "emoji": "🇪🇸"},
-            "french": {"name": "Français", "emoji": "🇫🇷"}
-        }
+        # Итоги по пользователю
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_totals (
+                user_id INTEGER PRIMARY KEY,
+                sessions INTEGER NOT NULL DEFAULT 0,
+                total_time INTEGER NOT NULL DEFAULT 0,
+                exercises INTEGER NOT NULL DEFAULT 0,
+                score_sum INTEGER NOT NULL DEFAULT 0,
+                scored INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
 
-        # Уровни владения
-        self.levels = {
-            "beginner": {"name": "Начинающий (A1)", "emoji": ""},
-            "elementary": {"name": "Элементарный (A2)", "emoji": ""},
-            "intermediate": {"name": "Средний (B1-B2)", "emoji": ""},
-            "advanced": {"name": "Продвинутый (C1-C2)", "emoji": ""}
-        }
+        # Итоги по (пользователь, язык) - существующая таблица user_progress
+        for column in ("sessions", "exercises", "score_sum", "scored"):
+            cursor.execute(f"ALTER TABLE user_progress ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_user_progress_user_language
+            ON user_progress (user_id, target_language)
+        ''')
 
-    def get_system_prompt(self, target_language: str, interface_language: str, level: str) -> str:
-        """Создает системный промпт для репетитора"""
+        # Итоги по (пользователь, день)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_daily_progress (
+                user_id INTEGER NOT NULL,
+                study_date TEXT NOT NULL,
+                sessions INTEGER NOT NULL DEFAULT 0,
+                total_time INTEGER NOT NULL DEFAULT 0,
+                exercises INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, study_date)
+            ) WITHOUT ROWID
+        ''')
 
-        prompts = {
-            "russian": f"""Ты - профессиональный репетитор по {self.target_languages[target_language]['name']}. 
-Уровень студента: {self.levels[level]['name']}.
+        # Количество сессий по типам
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_session_types (
+                user_id INTEGER NOT NULL,
+                session_type TEXT NOT NULL,
+                sessions INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, session_type)
+            ) WITHOUT ROWID
+        ''')
 
-Твои обязанности:
-1. Объясняй грамматику простыми словами с примерами
-2. Приводи примеры использования слов и выражений
-3. Исправляй ошибки и подробно объясняй почему они ошибки
-4. Задавай практические вопросы для закрепления материала
-5. Будь терпеливым, поддерживающим и мотивирующим
-6. Используй смесь русского и {self.target_languages[target_language]['name']} языка в зависимости от уровня студента
-7. Структурируй информацию четко и понятно
-8. Предлагай дополнительные упражнения для практики
+        # Триггер обновляет агрегаты в той же транзакции, что и вставка сессии
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_study_sessions_rollups
+            AFTER INSERT ON study_sessions
+            BEGIN
+                INSERT INTO user_totals (user_id, sessions, total_time, exercises, score_sum, scored)
+                VALUES (NEW.user_id, 1, COALESCE(NEW.duration_minutes, 0), COALESCE(NEW.exercises_completed, 0),
+                        COALESCE(NEW.score, 0), NEW.score IS NOT NULL)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    sessions = sessions + 1,
+                    total_time = total_time + excluded.total_time,
+                    exercises = exercises + excluded.exercises,
+                    score_sum = score_sum + excluded.score_sum,
+                    scored = scored + excluded.scored;
+
+                INSERT INTO user_progress (user_id, target_language, sessions, total_time, exercises,
+                                           score_sum, scored, vocabulary_learned, grammar_exercises,
+                                           conversation_practice, last_studied)
+                VALUES (NEW.user_id, NEW.target_language, 1, COALESCE(NEW.duration_minutes, 0),
+                        COALESCE(NEW.exercises_completed, 0), COALESCE(NEW.score, 0), NEW.score IS NOT NULL,
+                        CASE WHEN NEW.session_type = 'vocabulary' THEN COALESCE(NEW.exercises_completed, 0) ELSE 0 END,
+                        CASE WHEN NEW.session_type = 'grammar' THEN COALESCE(NEW.exercises_completed, 0) ELSE 0 END,
+                        CASE WHEN NEW.session_type = 'conversation' THEN COALESCE(NEW.exercises_completed, 0) ELSE 0 END,
+                        NEW.created_at)
+                ON CONFLICT (user_id, target_language) DO UPDATE SET
+                    sessions = sessions + 1,
+                    total_time = total_time + excluded.total_time,
+                    exercises = exercises + excluded.exercises,
+                    score_sum = score_sum + excluded.score_sum,
+                    scored = scored + excluded.scored,
+                    vocabulary_learned = vocabulary_learned + excluded.vocabulary_learned,
+                    grammar_exercises = grammar_exercises + excluded.grammar_exercises,
+                    conversation_practice = conversation_practice + excluded.conversation_practice,
+                    last_studied = MAX(COALESCE(last_studied, excluded.last_studied), excluded.last_studied);
+
+                INSERT INTO user_daily_progress (user_id, study_date, sessions, total_time, exercises)
+                VALUES (NEW.user_id, DATE(NEW.created_at), 1, COALESCE(NEW.duration_minutes, 0),
+                        COALESCE(NEW.exercises_completed, 0))
+                ON CONFLICT (user_id, study_date) DO UPDATE SET
+                    sessions = sessions + 1,
+                    total_time = total_time + excluded.total_time,
+                    exercises = exercises + excluded.exercises;
+
+                INSERT INTO user_session_types (user_id, session_type, sessions)
+                VALUES (NEW.user_id, NEW.session_type, 1)
+                ON CONFLICT (user_id, session_type) DO UPDATE SET sessions = sessions + 1;
+            END
+        ''')
 
-Отвечай на русском языке, но включай примеры и практические задания на изучаемом языке.""",
+        self._rebuild_rollups(conn, ["user_totals", "user_progress", "user_daily_progress", "user_session_types"])
 
-            "english": f"""You are a professional {self.target_languages[target_language]['name']} tutor.
-Student level: {level}.
+    def _migration_streaks(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
 
-Your responsibilities:
-1. Explain grammar in simple terms with examples
-2. Provide examples of word and expression usage
-3. Correct mistakes and explain why they are mistakes
-4. Ask practical questions to reinforce material
-5. Be patient, supportive and motivating
-6. Use a mix of English and {self.target_languages[target_language]['name']} depending on student level
-7. Structure information clearly and understandably
-8. Suggest additional exercises for practice
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_streaks (
+                user_id INTEGER PRIMARY KEY,
+                current_streak INTEGER NOT NULL DEFAULT 0,
+                longest_streak INTEGER NOT NULL DEFAULT 0,
+                last_study_date TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
 
-Respond in English, but include examples and practical exercises in the target language."""
-        }
+        # Сессия в тот же день не меняет серию, на следующий день продлевает ее,
+        # после пропуска начинает новую. Сессии задним числом (день раньше
+        # last_study_date) учитывает триггер из _migration_backdated_streaks.
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_study_sessions_streak
+            AFTER INSERT ON study_sessions
+            BEGIN
+                INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_study_date)
+                VALUES (NEW.user_id, 1, 1, DATE(NEW.created_at))
+                ON CONFLICT (user_id) DO UPDATE SET
+                    current_streak = CASE
+                        WHEN JULIANDAY(excluded.last_study_date) - JULIANDAY(last_study_date) = 1
+                            THEN current_streak + 1
+                        WHEN excluded.last_study_date > last_study_date THEN 1
+                        ELSE current_streak
+                    END,
+                    longest_streak = MAX(longest_streak, CASE
+                        WHEN JULIANDAY(excluded.last_study_date) - JULIANDAY(last_study_date) = 1
+                            THEN current_streak + 1
+                        ELSE 1
+                    END),
+                    last_study_date = MAX(last_study_date, excluded.last_study_date);
+            END
+        ''')
 
-        return prompts.get(interface_language, prompts["russian"])
+        self._rebuild_rollups(conn, ["user_streaks"])
 
-    def send_message(self, message: str, target_language: str, interface_language: str,
-                     level: str, conversation_history: List[Dict]) -> str:
-        """Отправляет сообщение в DeepSeek API"""
+    def _migration_response_cache(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT NOT NULL,
+                variant INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (cache_key, variant)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_response_cache_last_used
+            ON response_cache (last_used_at)
+        ''')
+
+    def _migration_messages(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                target_language TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        # Keyset-пагинация: WHERE user_id = ? AND target_language = ? AND id < ? ORDER BY id DESC
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_user_language_id
+            ON messages (user_id, target_language, id)
+        ''')
+
+    def _migration_api_usage(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS api_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                target_language TEXT,
+                session_type TEXT,
+                request_kind TEXT NOT NULL,
+                turn INTEGER,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                cached_tokens INTEGER,
+                latency_ms REAL NOT NULL,
+                status TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        # Сводки всегда ограничены окном по времени
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_api_usage_created
+            ON api_usage (created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_api_usage_user_created
+            ON api_usage (user_id, created_at)
+        ''')
+
+    def _migration_vocabulary(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS vocabulary (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                target_language TEXT NOT NULL,
+                word TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                example TEXT,
+                ease REAL NOT NULL,
+                interval_days REAL NOT NULL DEFAULT 0,
+                repetitions INTEGER NOT NULL DEFAULT 0,
+                lapses INTEGER NOT NULL DEFAULT 0,
+                due_at TIMESTAMP NOT NULL,
+                last_reviewed_at TIMESTAMP,
+                created_at TIMESTAMP NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_vocabulary_user_language_word
+            ON vocabulary (user_id, target_language, word COLLATE NOCASE)
+        ''')
+        # Очередь повторения: WHERE user_id = ? AND target_language = ? AND due_at <= ? ORDER BY due_at
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_vocabulary_user_language_due
+            ON vocabulary (user_id, target_language, due_at)
+        ''')
+
+    def _migration_backdated_streaks(self, conn: sqlite3.Connection):
+        # Сессия задним числом (отложенная запись, два процесса около полуночи) может склеить
+        # серии: строку user_streaks этого ученика пересчитываем по его дням занятий.
+        # В триггерах SQLite нет WITH, поэтому серии - подзапросом во FROM
+        runs = '''
+            SELECT COUNT(*) AS length, MAX(study_date) AS last_date
+            FROM (SELECT study_date, JULIANDAY(study_date) - ROW_NUMBER() OVER (ORDER BY study_date) AS island
+                  FROM (SELECT DISTINCT DATE(created_at) AS study_date
+                        FROM study_sessions WHERE user_id = NEW.user_id))
+            GROUP BY island
+        '''
+        conn.execute("DROP TRIGGER IF EXISTS trg_study_sessions_streak")
+        conn.execute(f'''
+            CREATE TRIGGER trg_study_sessions_streak
+            AFTER INSERT ON study_sessions
+            BEGIN
+                INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_study_date)
+                VALUES (NEW.user_id, 1, 1, DATE(NEW.created_at))
+                ON CONFLICT (user_id) DO UPDATE SET
+                    current_streak = CASE
+                        WHEN JULIANDAY(excluded.last_study_date) - JULIANDAY(last_study_date) = 1
+                            THEN current_streak + 1
+                        WHEN excluded.last_study_date > last_study_date THEN 1
+                        ELSE current_streak
+                    END,
+                    longest_streak = MAX(longest_streak, CASE
+                        WHEN JULIANDAY(excluded.last_study_date) - JULIANDAY(last_study_date) = 1
+                            THEN current_streak + 1
+                        ELSE 1
+                    END),
+                    last_study_date = MAX(last_study_date, excluded.last_study_date);
+
+                UPDATE user_streaks SET
+                    current_streak = (SELECT length FROM ({runs}) ORDER BY last_date DESC LIMIT 1),
+                    longest_streak = (SELECT MAX(length) FROM ({runs}))
+                WHERE user_id = NEW.user_id AND last_study_date > DATE(NEW.created_at);
+            END
+        ''')
+        self._rebuild_rollups(conn, ["user_streaks"])
+
+    def _rebuild_rollups(self, conn: sqlite3.Connection, tables: List[str] = None):
+        for table in tables or ROLLUP_TABLES:
+            columns, aggregate = ROLLUP_TABLES[table]
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} ({columns}) {aggregate}")
+
+    def rebuild_rollups(self):
+        """Пересчитывает все агрегаты из study_sessions"""
+        with self.write() as conn:
+            self._rebuild_rollups(conn)
+        with self._versions_lock:
+            self._data_versions.clear()
+
+    def verify_rollups(self) -> Dict[str, int]:
+        """Сверяет агрегаты с сырыми данными; возвращает число расходящихся строк по таблицам"""
+        mismatches = {}
+        with self.read() as conn:
+            for table, (columns, aggregate) in ROLLUP_TABLES.items():
+                expected = f"SELECT * FROM ({aggregate})"
+                stored = f"SELECT {columns} FROM {table}"
+                diff = sum(
+                    conn.execute(f"SELECT COUNT(*) FROM ({left} EXCEPT {right})").fetchone()[0]
+                    for left, right in ((expected, stored), (stored, expected))
+                )
+                mismatches[table] = diff
+        return mismatches
+
+
+@st.cache_resource
+def get_database() -> DatabaseManager:
+    """Единый на процесс менеджер базы данных: схема создается один раз"""
+    return DatabaseManager(metrics=get_metrics())
+
+
+@dataclass(frozen=True)
+class StudyEvent:
+    """Сессия обучения, ожидающая записи в базу"""
+    user_id: int
+    target_language: str
+    session_type: str
+    duration: int
+    exercises: int
+    score: int
+    created_at: str  # UTC в формате CURRENT_TIMESTAMP: время события, а не записи
+
+
+class BatchWriter(ABC):
+    """Отложенная запись: записи копятся в памяти и пишутся пачками фоновым потоком.
+
+    Пачка уходит в базу (write_batch) при накоплении batch_size записей
+    или раз в flush_interval_s. Пачка, которая не записалась max_attempts раз
+    подряд, пишется по одной записи: записи, отвергнутые базой, попадают в
+    журнал и отбрасываются, чтобы не держать очередь вечно.
+    """
+
+    thread_name = "batch-writer"
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, flush_interval_s: float = WRITE_FLUSH_INTERVAL_S,
+                 max_attempts: int = WRITE_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_attempts = max_attempts
+        self.dropped = 0  # записей, отброшенных после разбора пачки
+        self._failures = 0  # неудачных записей подряд
+        self._pending: List = []
+        self._lock = threading.Lock()  # защищает _pending
+        self._flush_lock = threading.Lock()  # пачка в записи; берется и для согласованного чтения
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @abstractmethod
+    def write_batch(self, batch: List):
+        """Записывает пачку одной транзакцией; исключение оставляет пачку в очереди"""
+
+    def enqueue(self, item):
+        with self._lock:
+            self._pending.append(item)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def pending_for(self, user_id: int) -> List:
+        """Еще не записанные записи пользователя"""
+        with self._lock:
+            return [item for item in self._pending if item.user_id == user_id]
+
+    @contextmanager
+    def consistent_read(self) -> Iterator[None]:
+        """Чтение базы и очереди без пачки «в полете», чтобы не учесть записи дважды"""
+        with self._flush_lock:
+            yield
+
+    def flush(self) -> int:
+        """Записывает накопленное; возвращает число записей"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+            retained = []
+            try:
+                self.write_batch(batch)
+            except Exception:
+                self._failures += 1
+                if self._failures < self.max_attempts:
+                    raise
+                retained = self._write_each(batch)
+            self._failures = 0
+            # Записи удаляются из очереди только после фиксации транзакции
+            with self._lock:
+                self._pending[:len(batch)] = retained
+            return len(batch) - len(retained)
+
+    def _write_each(self, batch: List) -> List:
+        """Пишет пачку по одной записи; возвращает записи, которые стоит повторить позже"""
+        retained = []
+        for item in batch:
+            try:
+                self.write_batch([item])
+            except sqlite3.OperationalError:
+                retained.append(item)  # база занята или недоступна - запись тут ни при чем
+            except Exception:
+                self.dropped += 1
+                logger.exception("%s: запись отброшена после %d неудачных попыток записать пачку: %r",
+                                 self.thread_name, self.max_attempts, item)
+        return retained
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("%s: не удалось записать пачку, повтор при следующем сбросе", self.thread_name)
+
+    def close(self):
+        """Останавливает фоновый поток и дописывает очередь"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval_s * 5)
+        self.flush()
+
+
+class SessionWriter(BatchWriter):
+    """Отложенная запись сессий обучения.
+
+    Пока событие не записано, его видно через pending_for() - так статистика
+    сразу отражает только что завершенное занятие.
+    """
+
+    thread_name = "session-writer"
+
+    def __init__(self, db: DatabaseManager, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval_s: float = WRITE_FLUSH_INTERVAL_S):
+        self.db = db
+        super().__init__(batch_size, flush_interval_s)
+
+    def write_batch(self, batch: List[StudyEvent]):
+        self.db.add_study_sessions(batch)
+
+    def enqueue(self, event: StudyEvent):
+        super().enqueue(event)
+        self.db.bump_data_version(event.user_id)
+
+
+@st.cache_resource
+def get_session_writer() -> SessionWriter:
+    """Общий для процесса писатель сессий обучения"""
+    return SessionWriter(get_database())
 
+
+@dataclass(frozen=True)
+class UsageTag:
+    """Кому и в рамках чего сделан запрос к API - измерения журнала использования"""
+    user_id: int
+    target_language: str
+    session_type: str
+    turn: int  # номер реплики ученика в текущем окне диалога
+
+
+@dataclass(frozen=True)
+class UsageRecord:
+    """Строка журнала использования API: один запрос (с повторами) к chat/completions"""
+    user_id: Optional[int]
+    target_language: Optional[str]
+    session_type: Optional[str]
+    request_kind: str  # chat | summary | exercises | check
+    turn: Optional[int]
+    prompt_tokens: Optional[int]  # None, если ответа с usage не было
+    completion_tokens: Optional[int]
+    cached_tokens: Optional[int]
+    latency_ms: float  # от отправки до последнего фрагмента ответа
+    status: str  # HTTP-статус, error (сеть/разбор) или cancelled (поток не дочитан)
+    created_at: str
+
+
+class UsageLedger(BatchWriter):
+    """Журнал использования API (таблица api_usage), пишется пачками в фоне"""
+
+    thread_name = "usage-ledger"
+
+    def __init__(self, db: DatabaseManager, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval_s: float = WRITE_FLUSH_INTERVAL_S):
+        self.db = db
+        super().__init__(batch_size, flush_interval_s)
+
+    def write_batch(self, batch: List[UsageRecord]):
+        self.db.add_api_usage(batch)
+
+
+@st.cache_resource
+def get_usage_ledger() -> UsageLedger:
+    """Общий для процесса журнал использования API"""
+    return UsageLedger(get_database())
+
+
+class UsageReport:
+    """Сводки по журналу использования API за последние days дней"""
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+
+    @staticmethod
+    def _since(days: int) -> str:
+        return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def _query(self, sql: str, params: Tuple) -> pd.DataFrame:
+        with self.db.read() as conn:
+            cursor = conn.execute(sql, params)
+            return pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+
+    def heaviest_users(self, days: int = USAGE_REPORT_DAYS, limit: int = 20) -> pd.DataFrame:
+        """Пользователи с наибольшим расходом токенов"""
+        return self._query('''
+            SELECT u.username, a.user_id, COUNT(*) AS requests,
+                   SUM(a.prompt_tokens) AS prompt_tokens, SUM(a.completion_tokens) AS completion_tokens,
+                   SUM(a.cached_tokens) AS cached_tokens,
+                   SUM(COALESCE(a.prompt_tokens, 0) + COALESCE(a.completion_tokens, 0)) AS total_tokens
+            FROM api_usage a
+            LEFT JOIN users u ON u.id = a.user_id
+            WHERE a.created_at >= ?
+            GROUP BY a.user_id
+            ORDER BY total_tokens DESC
+            LIMIT ?
+        ''', (self._since(days), limit))
+
+    def tokens_by_turn(self, days: int = USAGE_REPORT_DAYS) -> pd.DataFrame:
+        """Средний размер промпта и ответа по номеру реплики: как растет контекст диалога"""
+        return self._query('''
+            SELECT turn, COUNT(*) AS requests, ROUND(AVG(prompt_tokens), 1) AS avg_prompt_tokens,
+                   ROUND(AVG(cached_tokens), 1) AS avg_cached_tokens,
+                   ROUND(AVG(completion_tokens), 1) AS avg_completion_tokens
+            FROM api_usage
+            WHERE created_at >= ? AND request_kind = 'chat' AND prompt_tokens IS NOT NULL
+            GROUP BY turn
+            ORDER BY turn
+        ''', (self._since(days),))
+
+    def latency_by_session_type(self, days: int = USAGE_REPORT_DAYS) -> pd.DataFrame:
+        """Число запросов, доля ошибок и p50/p95 задержки по типам сессий (ранговый перцентиль)"""
+        return self._query('''
+            WITH ranked AS (
+                SELECT session_type, request_kind, status, latency_ms,
+                       ROW_NUMBER() OVER (PARTITION BY session_type, request_kind ORDER BY latency_ms) AS rank,
+                       COUNT(*) OVER (PARTITION BY session_type, request_kind) AS n
+                FROM api_usage
+                WHERE created_at >= ?
+            )
+            SELECT session_type, request_kind, n AS requests,
+                   ROUND(AVG(status NOT IN ('200', 'cancelled')), 3) AS error_rate,
+                   MAX(CASE WHEN rank = (n * 50 + 99) / 100 THEN latency_ms END) AS p50_ms,
+                   MAX(CASE WHEN rank = (n * 95 + 99) / 100 THEN latency_ms END) AS p95_ms
+            FROM ranked
+            GROUP BY session_type, request_kind
+            ORDER BY p95_ms DESC
+        ''', (self._since(days),))
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Общая для процесса HTTP-сессия с пулом keep-alive соединений"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата)"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdmissionController:
+    """Допуск исходящих запросов к LLM на процесс.
+
+    Одновременно в API уходит не больше max_concurrent запросов, а их частота
+    ограничена token bucket (rate_per_s, запас burst). Ожидающие стоят в очередях
+    по пользователям, которые обслуживаются по кругу: сколько бы запросов ни
+    поставил один пользователь, остальные получают слот через одного.
+    """
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT, rate_per_s: float = LLM_RATE_PER_S,
+                 burst: int = LLM_RATE_BURST, metrics: Optional[Metrics] = None):
+        self.max_concurrent = max_concurrent
+        self.rate_per_s = rate_per_s
+        self.burst = max(1, burst)
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._queues: Dict[Optional[int], deque] = {}  # пользователь -> его ожидающие запросы
+        self._rotation: deque = deque()  # пользователи с ожидающими запросами, по кругу
+        self._active = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._hold_s = 5.0  # скользящее среднее времени запроса для оценки ожидания
+
+    @contextmanager
+    def admit(self, user_id: Optional[int]) -> Iterator[None]:
+        """Ждет своей очереди и свободного слота; слот занят до выхода из блока"""
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            if user_id not in self._queues:
+                self._queues[user_id] = deque()
+                self._rotation.append(user_id)
+            self._queues[user_id].append(ticket)
+            self._update_gauges()
+            while True:
+                if (self._rotation[0] == user_id and self._queues[user_id][0] is ticket
+                        and self._active < self.max_concurrent):
+                    delay = self._take_token()
+                    if delay == 0:
+                        break
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            self._queues[user_id].popleft()
+            self._rotation.popleft()
+            if self._queues[user_id]:
+                self._rotation.append(user_id)
+            else:
+                del self._queues[user_id]
+            self._active += 1
+            self._update_gauges()
+            self._cond.notify_all()
+        if self.metrics:
+            self.metrics.observe("ferais_llm_queue_wait_seconds", time.monotonic() - start)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._hold_s = 0.9 * self._hold_s + 0.1 * (time.monotonic() - started)
+                self._update_gauges()
+                self._cond.notify_all()
+
+    def throttle(self):
+        """Ждет токен частоты без очереди - для повторов уже допущенного запроса"""
+        with self._cond:
+            while True:
+                delay = self._take_token()
+                if delay == 0:
+                    return
+                self._cond.wait(delay)
+
+    def position(self, user_id: Optional[int]) -> Optional[int]:
+        """Место пользователя в очереди (1 - следующий), None - не ждет"""
+        with self._cond:
+            if user_id not in self._queues:
+                return None
+            return self._rotation.index(user_id) + 1
+
+    def estimated_wait_s(self, position: int) -> float:
+        """Оценка ожидания для места в очереди по среднему времени запроса и лимиту частоты"""
+        by_slots = position * self._hold_s / self.max_concurrent
+        by_rate = position / self.rate_per_s if self.rate_per_s > 0 else 0.0
+        return max(by_slots, by_rate)
+
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return sum(len(tickets) for tickets in self._queues.values())
+
+    def _take_token(self) -> float:
+        """Забирает токен частоты; если его нет - сколько секунд ждать следующего"""
+        if self.rate_per_s <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_s)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate_per_s
+
+    def _update_gauges(self):
+        if self.metrics:
+            self.metrics.set_gauge("ferais_llm_queue_depth", sum(len(tickets) for tickets in self._queues.values()))
+            self.metrics.set_gauge("ferais_llm_active_requests", self._active)
+
+
+@st.cache_resource
+def get_admission_controller() -> AdmissionController:
+    """Общий для процесса допуск запросов к LLM"""
+    return AdmissionController(metrics=get_metrics())
+
+
+@dataclass(frozen=True)
+class LanguageInfo:
+    key: str
+    name: str
+    flag: str
+    code: str
+
+
+@dataclass(frozen=True)
+class OptionInfo:
+    """Язык интерфейса или уровень: название и эмодзи"""
+    key: str
+    name: str
+    emoji: str
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """Неизменяемый справочник языков и уровней с готовыми подписями для выпадающих списков.
+
+    Подписи посчитаны заранее для каждого языка интерфейса (для испанского и
+    французского - русские, как и системный промпт), поэтому format_func
+    в selectbox - это поиск в словаре, а не сборка строки на каждом перезапуске.
+    """
+    target_languages: Mapping[str, LanguageInfo]
+    interface_languages: Mapping[str, OptionInfo]
+    levels: Mapping[str, OptionInfo]
+    language_names: Mapping[str, Mapping[str, str]]  # язык интерфейса -> ключ -> "Английский"
+    level_names: Mapping[str, Mapping[str, str]]
+    language_labels: Mapping[str, Mapping[str, str]]  # язык интерфейса -> ключ -> "🇬🇧 Английский"
+    level_labels: Mapping[str, Mapping[str, str]]
+    interface_labels: Mapping[str, str]
+
+    def language_name(self, key: str, interface_language: str = "russian") -> str:
+        return self.language_names.get(interface_language, self.language_names["russian"])[key]
+
+    def level_name(self, key: str, interface_language: str = "russian") -> str:
+        return self.level_names.get(interface_language, self.level_names["russian"])[key]
+
+    def language_label(self, key: str, interface_language: str = "russian") -> str:
+        return self.language_labels.get(interface_language, self.language_labels["russian"])[key]
+
+    def level_label(self, key: str, interface_language: str = "russian") -> str:
+        return self.level_labels.get(interface_language, self.level_labels["russian"])[key]
+
+    def interface_label(self, key: str) -> str:
+        return self.interface_labels[key]
+
+
+def build_catalog() -> Catalog:
+    target_languages = {key: LanguageInfo(key, name, flag, code) for key, name, flag, code in TARGET_LANGUAGES}
+    interface_languages = {key: OptionInfo(key, name, emoji) for key, name, emoji in INTERFACE_LANGUAGES}
+    levels = {key: OptionInfo(key, name, emoji) for key, name, emoji in LEVELS}
+    # Английские названия - из ключей ("scottish_gaelic" -> "Scottish Gaelic"), уровни - с тем же CEFR
+    language_names = {
+        "russian": {key: info.name for key, info in target_languages.items()},
+        "english": {key: key.replace("_", " ").title() for key in target_languages},
+    }
+    level_names = {
+        "russian": {key: info.name for key, info in levels.items()},
+        "english": {key: f"{key.title()} {info.name[info.name.find('('):]}" for key, info in levels.items()},
+    }
+
+    language_labels = {lang: {key: f"{target_languages[key].flag} {name}" for key, name in names.items()}
+                       for lang, names in language_names.items()}
+    level_labels = {lang: {key: f"{levels[key].emoji} {name}".strip() for key, name in names.items()}
+                    for lang, names in level_names.items()}
+
+    def freeze(nested: Dict[str, Dict[str, str]]) -> Mapping[str, Mapping[str, str]]:
+        return MappingProxyType({lang: MappingProxyType(values) for lang, values in nested.items()})
+
+    return Catalog(
+        target_languages=MappingProxyType(target_languages),
+        interface_languages=MappingProxyType(interface_languages),
+        levels=MappingProxyType(levels),
+        language_names=freeze(language_names),
+        level_names=freeze(level_names),
+        language_labels=freeze(language_labels),
+        level_labels=freeze(level_labels),
+        interface_labels=MappingProxyType({key: f"{info.emoji} {info.name}"
+                                           for key, info in interface_languages.items()}),
+    )
+
+
+@st.cache_resource
+def get_catalog() -> Catalog:
+    """Каталог процесса: скрипт streamlit исполняется заново на каждом перезапуске, а этот объект - нет"""
+    return build_catalog()
+
+
+class LanguageTutor:
+    """Клиент DeepSeek без состояния сессии: один экземпляр на процесс (get_tutor)"""
+
+    def __init__(self, api_key: str, base_url: str = DEEPSEEK_API_URL, session: requests.Session = None,
+                 connect_timeout: float = API_CONNECT_TIMEOUT, read_timeout: float = API_READ_TIMEOUT,
+                 max_retries: int = API_MAX_RETRIES, metrics: Optional[Metrics] = None,
+                 catalog: Catalog = None, ledger: Optional[UsageLedger] = None,
+                 admission: Optional[AdmissionController] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        self.session = session or get_http_session()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.catalog = catalog or get_catalog()
+        self.ledger = ledger
+        self.admission = admission
+        self._prompts: Dict[Tuple[str, str, str], str] = {}
+
+    def get_system_prompt(self, target_language: str, interface_language: str, level: str) -> str:
+        """Системный промпт; шаблон рендерится один раз на (язык, язык интерфейса, уровень)"""
+        key = (target_language, interface_language, level)
+        prompt = self._prompts.get(key)
+        if prompt is None:
+            template_language = interface_language if interface_language in SYSTEM_PROMPT_TEMPLATES else "russian"
+            prompt = self._prompts[key] = SYSTEM_PROMPT_TEMPLATES[template_language].format(
+                language=self.catalog.language_name(target_language, template_language),
+                level=self.catalog.level_name(level, template_language),
+            )
+        return prompt
+
+    def build_payload(self, message: str, target_language: str, interface_language: str,
+                      level: str, conversation_history: List[Dict], stream: bool = False) -> Dict:
+        """Собирает тело запроса к chat/completions"""
         system_prompt = self.get_system_prompt(target_language, interface_language, level)
 
         messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(conversation_history)
+        messages.extend({"role": msg["role"], "content": msg["content"]} for msg in conversation_history)
         messages.append({"role": "user", "content": message})
 
         payload = {
@@ -251,122 +1627,1390 @@ Respond in English, but include examples and practical exercises in the target l
             "temperature": 0.7,
             "max_tokens": 1500
         }
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}  # usage приходит последним фрагментом
+        return payload
+
+    def send_message(self, message: str, target_language: str, interface_language: str,
+                     level: str, conversation_history: List[Dict], tag: Optional[UsageTag] = None) -> str:
+        """Отправляет сообщение в DeepSeek API"""
+
+        payload = self.build_payload(message, target_language, interface_language, level, conversation_history)
 
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"]
+            with self._admit(tag), self._span("send_message"), self._usage_scope("chat", tag) as usage:
+                data = self._post(payload).json()
+                usage.update(data.get("usage") or {})
+            return data["choices"][0]["message"]["content"]
         except requests.exceptions.RequestException as e:
             return f"Ошибка при обращении к API: {str(e)}"
         except Exception as e:
             return f"Произошла ошибка: {str(e)}"
 
+    def _span(self, method: str):
+        return self.metrics.span("tutor_call", method=method) if self.metrics else nullcontext()
 
-class UserStatistics:
-    def __init__(self, db: DatabaseManager):
+    def _admit(self, tag: Optional[UsageTag]):
+        """Слот в общей очереди запросов к API (по пользователю из tag)"""
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.admit(tag.user_id if tag else None)
+
+    def _post(self, payload: Dict, stream: bool = False) -> requests.Response:
+        """POST с повторами при 429/503 и сбоях соединения: экспоненциальный откат с джиттером.
+
+        ReadTimeout не повторяется: запрос уже отправлен, повтор мог бы выполнить
+        (и оплатить) его дважды.
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.admission is not None:
+                self.admission.throttle()  # повтор тоже расходует лимит частоты
+            delay = random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.base_url, headers=self.headers, json=payload,
+                                             timeout=self.timeout, stream=stream)
+            except requests.exceptions.ReadTimeout:
+                self._observe_request(start, "timeout")
+                raise
+            except requests.exceptions.ConnectionError as e:  # в т.ч. ConnectTimeout
+                self._observe_request(start, "error")
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("Сбой соединения с API (%s), повтор через %.1f с", e, delay)
+            else:
+                self._observe_request(start, str(response.status_code))
+                if response.status_code not in RETRYABLE_STATUSES or attempt == self.max_retries:
+                    if not response.ok:
+                        response.close()
+                    response.raise_for_status()
+                    return response
+                retry_after = retry_after_seconds(response)
+                if retry_after is not None:
+                    delay = min(API_BACKOFF_MAX, retry_after) + random.uniform(0, API_BACKOFF_BASE)
+                logger.warning("API ответил %s, повтор через %.1f с", response.status_code, delay)
+                response.close()
+            if self.metrics:
+                self.metrics.inc("ferais_api_retries_total")
+            time.sleep(delay)
+
+    def _observe_request(self, start: float, status: str):
+        """Время HTTP-попытки до заголовков ответа (тело потока читается позже)"""
+        if self.metrics:
+            self.metrics.observe("ferais_api_request_seconds", time.perf_counter() - start, status=status)
+
+    def summarize(self, previous_summary: str, messages: List[Dict],
+                  tag: Optional[UsageTag] = None) -> Optional[str]:
+        """Сворачивает старые реплики в краткое резюме; None при ошибке API"""
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        payload = {
+            "model": "deepseek-chat",
+            "messages": [
+                {"role": "system", "content": "Кратко перескажи ход урока иностранного языка: темы, "
+                                              "изученные слова и правила, ошибки ученика, на чем остановились. "
+                                              "Не более 150 слов."},
+                {"role": "user", "content": f"Прежнее резюме:\n{previous_summary or '-'}\n\n"
+                                            f"Новые реплики:\n{transcript}"}
+            ],
+            "temperature": 0.3,
+            "max_tokens": SUMMARY_MAX_TOKENS
+        }
+        try:
+            with self._admit(tag), self._span("summarize"), self._usage_scope("summary", tag) as usage:
+                data = self._post(payload).json()
+                usage.update(data.get("usage") or {})
+            return data["choices"][0]["message"]["content"]
+        except Exception as e:
+            logger.warning("Не удалось обновить резюме диалога: %s", e)
+            return None
+
+    def generate_exercises(self, kind: str, target_language: str, interface_language: str, level: str,
+                           tag: Optional[UsageTag] = None) -> str:
+        """Набор упражнений одним запросом в режиме JSON (без истории диалога); возвращает JSON-текст"""
+        payload = self.build_payload(EXERCISE_PROMPTS[kind], target_language, interface_language, level, [])
+        payload["response_format"] = {"type": "json_object"}
+        payload["max_tokens"] = EXERCISE_MAX_TOKENS
+        with self._admit(tag), self._span("generate_exercises"), self._usage_scope("exercises", tag) as usage:
+            data = self._post(payload).json()
+            usage.update(data.get("usage") or {})
+        return data["choices"][0]["message"]["content"]
+
+    def check_answer(self, exercise: "Exercise", answer: str, target_language: str, interface_language: str,
+                     level: str, tag: Optional[UsageTag] = None) -> Optional[Tuple[bool, str]]:
+        """Вердикт по свободному ответу, который не совпал с образцами: (верно, пояснение); None при ошибке"""
+        message = (f"Задание: {exercise.question}\nОбразцы ответа: {'; '.join(exercise.answers)}\n"
+                   f"Ответ ученика: {answer}\nВерен ли ответ ученика по смыслу и грамматике? Ответ - только "
+                   'JSON-объект: {"correct": true или false, "comment": "короткое пояснение"}')
+        payload = self.build_payload(message, target_language, interface_language, level, [])
+        payload["response_format"] = {"type": "json_object"}
+        payload["max_tokens"] = EXERCISE_CHECK_MAX_TOKENS
+        try:
+            with self._admit(tag), self._span("check_answer"), self._usage_scope("check", tag) as usage:
+                data = self._post(payload).json()
+                usage.update(data.get("usage") or {})
+            verdict = json.loads(data["choices"][0]["message"]["content"])
+            return bool(verdict["correct"]), str(verdict.get("comment") or "")
+        except Exception as e:
+            logger.warning("Не удалось проверить ответ: %s", e)
+            return None
+
+    def stream_message(self, message: str, target_language: str, interface_language: str,
+                       level: str, conversation_history: List[Dict], stream: bool = True,
+                       tag: Optional[UsageTag] = None) -> "StreamingReply":
+        """Отправляет сообщение; при stream=True ответ читается по фрагментам SSE"""
+        payload = self.build_payload(message, target_language, interface_language, level,
+                                     conversation_history, stream=stream)
+        return StreamingReply(self._stream_chunks(payload, tag) if stream else self._complete_chunks(payload, tag))
+
+    def _stream_chunks(self, payload: Dict, tag: Optional[UsageTag] = None) -> Iterator[str]:
+        # Повторы возможны только до начала потока: прочитанные фрагменты уже показаны
+        with self._admit(tag), self._span("stream_message"), self._usage_scope("chat", tag) as usage, \
+                self._post(payload, stream=True) as response:
+            yield from iter_sse_content(response, usage)
+
+    def _complete_chunks(self, payload: Dict, tag: Optional[UsageTag] = None) -> Iterator[str]:
+        with self._admit(tag), self._span("send_message"), self._usage_scope("chat", tag) as usage:
+            data = self._post(payload).json()
+            usage.update(data.get("usage") or {})
+        yield data["choices"][0]["message"]["content"]
+
+    @contextmanager
+    def _usage_scope(self, request_kind: str, tag: Optional[UsageTag]) -> Iterator[Dict]:
+        """Собирает usage ответа в словарь; на выходе учитывает токены и пишет строку журнала"""
+        usage: Dict = {}
+        status = "200"
+        start = time.perf_counter()
+        try:
+            yield usage
+        except requests.exceptions.HTTPError as e:
+            status = str(e.response.status_code) if e.response is not None else "error"
+            raise
+        except GeneratorExit:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self._record_usage(usage)
+            if self.ledger is not None and tag is not None:
+                self.ledger.enqueue(usage_record(tag, request_kind, usage, time.perf_counter() - start, status))
+
+    def _record_usage(self, usage: Optional[Dict]):
+        """Учитывает токены ответа и попадания в кэш префиксов (prompt_cache_hit/miss_tokens)"""
+        if not usage:
+            return
+        hit, miss = usage.get("prompt_cache_hit_tokens"), usage.get("prompt_cache_miss_tokens")
+        if hit is not None and miss is not None:
+            logger.info("Кэш префикса: %d из %d токенов промпта", hit, hit + miss)
+        if not self.metrics:
+            return
+        self.metrics.inc("ferais_prompt_tokens_total", usage.get("prompt_tokens", 0))
+        self.metrics.inc("ferais_completion_tokens_total", usage.get("completion_tokens", 0))
+        if hit is not None and miss is not None:
+            self.metrics.inc("ferais_prompt_cache_hit_tokens_total", hit)
+            self.metrics.inc("ferais_prompt_cache_miss_tokens_total", miss)
+            hit_total = self.metrics.value("ferais_prompt_cache_hit_tokens_total")
+            seen_total = hit_total + self.metrics.value("ferais_prompt_cache_miss_tokens_total")
+            if seen_total:
+                self.metrics.set_gauge("ferais_prompt_cache_hit_ratio", hit_total / seen_total)
+
+
+@st.cache_resource
+def get_tutor() -> LanguageTutor:
+    return LanguageTutor(DEEPSEEK_API_KEY, metrics=get_metrics(), ledger=get_usage_ledger(),
+                         admission=get_admission_controller())
+
+
+def usage_record(tag: UsageTag, request_kind: str, usage: Dict, latency_s: float, status: str) -> UsageRecord:
+    """Строка журнала из usage ответа DeepSeek (cached_tokens - prompt_cache_hit_tokens)"""
+    return UsageRecord(
+        user_id=tag.user_id, target_language=tag.target_language, session_type=tag.session_type,
+        request_kind=request_kind, turn=tag.turn, prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"), cached_tokens=usage.get("prompt_cache_hit_tokens"),
+        latency_ms=round(latency_s * 1000, 1), status=status,
+        created_at=datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+
+def iter_sse_content(response: requests.Response, usage: Optional[Dict] = None) -> Iterator[str]:
+    """Разбирает поток server-sent events и выдает текстовые фрагменты ответа; usage копируется в словарь"""
+    for raw_line in response.iter_lines():
+        # Байты декодируем сами: у text/event-stream часто нет charset
+        line = raw_line.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            continue  # пустые строки-разделители и комментарии keep-alive
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        event = json.loads(data)
+        if usage is not None and event.get("usage"):
+            usage.update(event["usage"])
+        for choice in event.get("choices", []):
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield content
+
+
+class StreamingReply:
+    """Ответ, читаемый по мере генерации; замеряет время до первого токена и общее время"""
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._parts: List[str] = []
+        self.first_token_s: Optional[float] = None
+        self.total_s: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def answer(self) -> str:
+        """Только то, что прислала модель, без текста ошибки"""
+        return "".join(self._parts)
+
+    @property
+    def text(self) -> str:
+        """Для показа: ответ и, если запрос оборвался, ошибка"""
+        return "\n\n".join(part for part in (self.answer, self.error) if part)
+
+    def __iter__(self) -> Iterator[str]:
+        start = time.perf_counter()
+        try:
+            for chunk in self._chunks:
+                if self.first_token_s is None:
+                    self.first_token_s = time.perf_counter() - start
+                self._parts.append(chunk)
+                yield chunk
+        except requests.exceptions.RequestException as e:
+            self.error = f"Ошибка при обращении к API: {str(e)}"
+        except Exception as e:
+            self.error = f"Произошла ошибка: {str(e)}"
+        if self.error:
+            yield self.error
+        self.total_s = time.perf_counter() - start
+        logger.info("Ответ получен: первый токен %.2f с, всего %.2f с",
+                    self.first_token_s or self.total_s, self.total_s)
+
+
+@dataclass(frozen=True)
+class CacheTouch:
+    """Попадание в вариант кэша ответов, ожидающее записи"""
+    cache_key: str
+    variant: int
+    used_at: float
+
+
+class CacheTouchWriter(BatchWriter):
+    """Попадания в кэш ответов: время использования для LRU пишется пачками, а не транзакцией на чтение"""
+
+    thread_name = "cache-touch-writer"
+
+    def __init__(self, db: DatabaseManager, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval_s: float = WRITE_FLUSH_INTERVAL_S):
         self.db = db
+        super().__init__(batch_size, flush_interval_s)
 
-    def get_user_stats(self, user_id: int) -> Dict:
-        """Получает полную статистику пользователя"""
-        cursor = self.db.conn.cursor()
+    def write_batch(self, batch: List[CacheTouch]):
+        self.db.touch_response_cache(batch)
 
-        # Общая статистика
-        cursor.execute('''
-            SELECT COUNT(*) as total_sessions,
-                   SUM(duration_minutes) as total_time,
-                   SUM(exercises_completed) as total_exercises,
-                   AVG(score) as avg_score
-            FROM study_sessions 
-            WHERE user_id = ?
-        ''', (user_id,))
-        total_stats = cursor.fetchone()
-
-        # Статистика по языкам
-        cursor.execute('''
-            SELECT target_language, 
-                   COUNT(*) as sessions,
-                   SUM(duration_minutes) as time,
-                   SUM(exercises_completed) as exercises,
-                   AVG(score) as avg_score
-            FROM study_sessions 
-            WHERE user_id = ?
-            GROUP BY target_language
-            ORDER BY time DESC
-        ''', (user_id,))
-        language_stats = cursor.fetchall()
-
-        # Прогресс за последние 30 дней
-        cursor.execute('''
-            SELECT DATE(created_at) as date,
-                   SUM(duration_minutes) as daily_time,
-                   SUM(exercises_completed) as daily_exercises
-            FROM study_sessions 
-            WHERE user_id = ? AND created_at >= date('now', '-30 days')
-            GROUP BY DATE(created_at)
-            ORDER BY date
-        ''', (user_id,))
-        progress_data = cursor.fetchall()
-
-        # Типы сессий
-        cursor.execute('''
-            SELECT session_type, COUNT(*) as count
-            FROM study_sessions 
-            WHERE user_id = ?
-            GROUP BY session_type
-        ''', (user_id,))
-        session_types = cursor.fetchall()
 
+class ResponseCache:
+    """Кэш ответов на типовые запросы в SQLite: общий для процессов, с TTL и вытеснением LRU.
+
+    На каждый ключ хранится до variants вариантов ответа: пока пул не заполнен,
+    запрос считается промахом и новый ответ пополняет пул, затем варианты
+    выдаются случайно, чтобы содержание не повторялось слово в слово.
+    Чтение идет только через пул читателей: попадания копит touches и пишет пачками.
+    """
+
+    def __init__(self, db: DatabaseManager, touches: CacheTouchWriter, variants: int = RESPONSE_CACHE_VARIANTS,
+                 ttl_s: float = RESPONSE_CACHE_TTL_S, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 metrics: Optional[Metrics] = None):
+        self.db = db
+        self.touches = touches
+        self.metrics = metrics
+        self.variants = variants
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._counters_lock = threading.Lock()
+        if metrics is not None:
+            with db.read() as conn:
+                metrics.set_gauge("ferais_response_cache_entries",
+                                  conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0])
+
+    @staticmethod
+    def make_key(prompt: str, target_language: str, level: str, interface_language: str) -> str:
+        """Ключ: хэш шаблона запроса + параметры, от которых зависит ответ"""
+        template = hashlib.sha1(prompt.encode()).hexdigest()[:12]
+        return f"{template}:{target_language}:{level}:{interface_language}"
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.db.read() as conn:
+            rows = conn.execute(
+                "SELECT variant, content FROM response_cache WHERE cache_key = ? AND created_at >= ?",
+                (key, now - self.ttl_s)
+            ).fetchall()
+        if len(rows) < self.variants:
+            self._count(hit=False)
+            return None
+
+        variant, content = random.choice(rows)
+        self.touches.enqueue(CacheTouch(key, variant, now))
+        self._count(hit=True)
+        return content
+
+    def put(self, key: str, content: str):
+        now = time.time()
+        with self.db.write() as conn:
+            # Свободный или устаревший слот пула вариантов
+            taken = {row[0] for row in conn.execute(
+                "SELECT variant FROM response_cache WHERE cache_key = ? AND created_at >= ?",
+                (key, now - self.ttl_s)
+            )}
+            free = [slot for slot in range(self.variants) if slot not in taken]
+            if not free:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (cache_key, variant, content, created_at, last_used_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, free[0], content, now, now)
+            )
+            conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_s,))
+            conn.execute('''
+                DELETE FROM response_cache WHERE rowid IN (
+                    SELECT rowid FROM response_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            if self.metrics is not None:
+                entries = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+                self.metrics.set_gauge("ferais_response_cache_entries", entries)
+
+    def _count(self, hit: bool):
+        with self._counters_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if self.metrics is not None:
+            self.metrics.inc("ferais_response_cache_hits_total" if hit else "ferais_response_cache_misses_total")
+
+    def stats(self) -> Dict:
+        """Счетчики попаданий и промахов этого процесса и размер кэша"""
+        with self.db.read() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        lookups = self.hits + self.misses
         return {
-            "total_sessions": total_stats[0] or 0,
-            "total_time": total_stats[1] or 0,
-            "total_exercises": total_stats[2] or 0,
-            "avg_score": total_stats[3] or 0,
-            "language_stats": language_stats,
-            "progress_data": progress_data,
-            "session_types": session_types
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries
         }
 
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Общий для процесса кэш ответов на быстрые действия"""
+    return ResponseCache(get_database(), CacheTouchWriter(get_database()), metrics=get_metrics())
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая локальная оценка числа токенов без токенизатора"""
+    ascii_chars = cjk_chars = other_chars = 0
+    for char in text:
+        if char < "\x80":
+            ascii_chars += 1
+        elif "\u3040" <= char <= "\u9fff" or "\uac00" <= char <= "\ud7af":
+            cjk_chars += 1
+        else:
+            other_chars += 1
+    return int(ascii_chars / 4 + other_chars / 2.5 + cjk_chars * 0.7) + 1
+
+
+def message_tokens(message: Dict) -> int:
+    return estimate_tokens(message["content"]) + 4  # служебные токены роли
+
+
+class ConversationContext:
+    """Держит промпт в пределах бюджета токенов: свежие реплики целиком, старые - в резюме"""
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, refresh_tokens: int = SUMMARY_REFRESH_TOKENS):
+        self.budget = budget
+        self.refresh_tokens = refresh_tokens
+        self.summary = ""
+        self.summarized_id = 0  # id последнего сообщения, уже учтенного в резюме
+        self.pending: List[Dict] = []  # реплики, ушедшие из окна, но еще не вошедшие в резюме
+        self._lock = threading.Lock()  # evict - из скрипта, build_history - из пула потоков
+
+    def summary_message(self) -> List[Dict]:
+        if not self.summary:
+            return []
+        return [{"role": "system", "content": f"Краткое содержание предыдущей части урока:\n{self.summary}"}]
+
+    def build_history(self, tutor: LanguageTutor, conversation: List[Dict],
+                      system_prompt: str, message: str, tag: Optional[UsageTag] = None) -> List[Dict]:
+        """Возвращает историю для запроса, при необходимости обновляя резюме"""
+        fixed = estimate_tokens(system_prompt) + estimate_tokens(message) + 8
+        keep_from = self._window_start(conversation, fixed)
+
+        # Реплики вне окна копятся, пока их не наберется на обновление резюме
+        self._buffer(conversation[:keep_from])
+        with self._lock:
+            pending = list(self.pending)
+        if pending and sum(message_tokens(msg) for msg in pending) >= self.refresh_tokens:
+            summary = tutor.summarize(self.summary, pending, tag)
+            if summary is not None:
+                with self._lock:
+                    self.summary = summary
+                    self.summarized_id = pending[-1]["id"]
+                    del self.pending[:len(pending)]
+                keep_from = self._window_start(conversation, fixed)
+
+        history = self.summary_message() + conversation[keep_from:]
+        history_tokens = sum(message_tokens(msg) for msg in history)
+        logger.info("Промпт: ~%d токенов (система+сообщение %d, история %d из %d сообщений, резюме %s)",
+                    fixed + history_tokens, fixed, len(conversation) - keep_from, len(conversation),
+                    "есть" if self.summary else "нет")
+        return history
+
+    def evict(self, message: Dict):
+        """Реплика вытеснена из окна диалога в памяти: она дождется резюме здесь, а не пропадет"""
+        self._buffer([message])
+
+    def _buffer(self, messages: List[Dict]):
+        with self._lock:
+            last_id = self.pending[-1]["id"] if self.pending else self.summarized_id
+            self.pending.extend(msg for msg in messages if msg["id"] > last_id)
+
+    def _window_start(self, conversation: List[Dict], fixed_tokens: int) -> int:
+        """Индекс первой реплики, которая еще помещается в бюджет вместе с резюме"""
+        available = self.budget - fixed_tokens - sum(message_tokens(msg) for msg in self.summary_message())
+        start = len(conversation)
+        while start > 0 and conversation[start - 1]["id"] > self.summarized_id:
+            cost = message_tokens(conversation[start - 1])
+            if cost > available:
+                break
+            available -= cost
+            start -= 1
+        return start
+
+
+class ConversationStore:
+    """Постоянное хранилище сообщений по (пользователь, язык) с keyset-пагинацией"""
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+
+    def append(self, user_id: int, target_language: str, role: str, content: str) -> Dict:
+        with self.db.write() as conn:
+            cursor = conn.execute(
+                "INSERT INTO messages (user_id, target_language, role, content) VALUES (?, ?, ?, ?)",
+                (user_id, target_language, role, content)
+            )
+        return {"id": cursor.lastrowid, "role": role, "content": content}
+
+    def count_user_messages(self, user_id: int, target_language: str) -> int:
+        """Сколько реплик ученик написал в диалоге по языку - номер последнего хода"""
+        with self.db.read() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE user_id = ? AND target_language = ? AND role = 'user'",
+                (user_id, target_language)
+            ).fetchone()[0]
+
+    def load_page(self, user_id: int, target_language: str, before_id: Optional[int] = None,
+                  limit: int = CHAT_PAGE_SIZE) -> List[Dict]:
+        """Последние limit сообщений с id меньше before_id, в хронологическом порядке"""
+        with self.db.read() as conn:
+            rows = conn.execute('''
+                SELECT id, role, content
+                FROM messages
+                WHERE user_id = ? AND target_language = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (user_id, target_language, before_id if before_id is not None else 2 ** 63 - 1, limit)).fetchall()
+        return [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows)]
+
+
+@st.cache_resource
+def get_conversation_store() -> ConversationStore:
+    return ConversationStore(get_database())
+
+
+class ConversationHistory:
+    """Диалог по одному языку: в памяти только последние сообщения, ранние подгружаются по запросу"""
+
+    def __init__(self, store: ConversationStore, user_id: int, target_language: str,
+                 window: int = CONVERSATION_WINDOW):
+        self.store = store
+        self.user_id = user_id
+        self.target_language = target_language
+        recent = store.load_page(user_id, target_language, limit=window + 1)
+        self.has_more = len(recent) > window  # есть ли в базе сообщения раньше загруженных
+        self.messages: deque = deque(recent[-window:], maxlen=window)
+        self.turns = store.count_user_messages(user_id, target_language)  # окно ограничено, счетчик - нет
+        self.older: List[Dict] = []  # страницы, подгруженные для просмотра
+        self.display_limit = CHAT_DISPLAY_MESSAGES
+        self.context = ConversationContext()
+
+    def add(self, role: str, content: str) -> Dict:
+        """Сохраняет сообщение в базе и в окне"""
+        message = self.store.append(self.user_id, self.target_language, role, content)
+        self.turns += role == "user"
+        self.add_saved(message)
+        return message
+
+    def add_saved(self, message: Dict):
+        """Добавляет в окно уже сохраненное сообщение"""
+        if len(self.messages) == self.messages.maxlen:
+            self.context.evict(self.messages[0])
+            if self.older:
+                self.older.append(self.messages[0])  # подгруженная лента остается непрерывной
+            else:
+                self.has_more = True
+        self.messages.append(message)
+
+    def recent(self) -> List[Dict]:
+        return list(self.messages)
+
+    def visible(self) -> List[Dict]:
+        return (self.older + list(self.messages))[-self.display_limit:]
+
+    @property
+    def can_show_more(self) -> bool:
+        return self.display_limit < len(self.older) + len(self.messages) or self.has_more
+
+    def show_more(self):
+        """Показывает еще страницу, подгружая ее из базы, если в памяти не хватает"""
+        self.display_limit += CHAT_PAGE_SIZE
+        if self.display_limit > len(self.older) + len(self.messages) and self.has_more:
+            first_id = (self.older or self.messages)[0]["id"]
+            page = self.store.load_page(self.user_id, self.target_language, before_id=first_id,
+                                        limit=CHAT_PAGE_SIZE + 1)
+            self.has_more = len(page) > CHAT_PAGE_SIZE
+            self.older = page[-CHAT_PAGE_SIZE:] + self.older
+
+
+def get_conversation(target_language: str = None) -> ConversationHistory:
+    """История текущего пользователя по языку; загружается из базы при первом обращении"""
+    target_language = target_language or st.session_state.current_language
+    conversations = st.session_state.conversations
+    if target_language not in conversations:
+        conversations[target_language] = ConversationHistory(
+            get_conversation_store(), st.session_state.user["id"], target_language
+        )
+    return conversations[target_language]
+
+
+class PendingReply:
+    """Ответ репетитора, который готовится в фоновом потоке и переживает перезапуски скрипта"""
+
+    def __init__(self, user_id: int, message: str, target_language: str, interface_language: str,
+                 level: str, conversation: List[Dict], cache_key: Optional[str] = None,
+                 session: Tuple[str, int, int, int] = CHAT_TURN_SESSION, turn: int = 1):
+        self.user_id = user_id
+        self.message = message
+        self.target_language = target_language
+        self.interface_language = interface_language
+        self.level = level
+        self.conversation = conversation  # копия истории на момент отправки
+        self.cache_key = cache_key
+        self.session = session
+        self.turn = turn  # номер хода ученика в диалоге по языку, для журнала usage
+        self.reply: Optional[StreamingReply] = None
+        self.assistant_message: Optional[Dict] = None
+        self.future: Optional[Future] = None
+        self.created_at = time.time()
+
+    @property
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    @property
+    def text(self) -> str:
+        return self.reply.text if self.reply else ""
+
+    @property
+    def error(self) -> Optional[str]:
+        """Ошибка запроса для показа ученику; в диалог и историю для модели она не попадает"""
+        if self.done and self.future.exception() is not None:
+            return f"Произошла ошибка: {self.future.exception()}"
+        return self.reply.error if self.reply else None
+
+    def usage_tag(self, session_type: str) -> UsageTag:
+        return UsageTag(self.user_id, self.target_language, session_type, turn=self.turn)
+
+    def run(self, tutor: LanguageTutor, context: ConversationContext, writer: SessionWriter,
+            cache: ResponseCache, store: ConversationStore, vocabulary: Optional["VocabularyStore"] = None):
+        """Выполняется в пуле потоков: без вызовов Streamlit"""
+        tag = self.usage_tag(self.session[0])
+        history = context.build_history(
+            tutor, self.conversation,
+            tutor.get_system_prompt(self.target_language, self.interface_language, self.level),
+            self.message, tag
+        )
+        self.reply = tutor.stream_message(self.message, self.target_language, self.interface_language,
+                                          self.level, history, stream=STREAM_RESPONSES, tag=tag)
+        for _ in self.reply:
+            pass
+        if self.reply.answer:  # оборванный ответ сохраняется без текста ошибки
+            self.assistant_message = store.append(self.user_id, self.target_language, "assistant",
+                                                  self.reply.answer)
+        if self.cache_key and self.reply.error is None:
+            cache.put(self.cache_key, self.reply.answer)
+        if vocabulary is not None and self.session[0] == "vocabulary" and self.reply.error is None:
+            vocabulary.add_from_reply(self.user_id, self.target_language, self.reply.answer)
+        writer.enqueue(new_study_event(self.user_id, self.target_language, *self.session))
+
+
+class PendingExercises(PendingReply):
+    """Набор упражнений, который готовится в фоне: один запрос JSON, дальше ответы проверяются локально.
+
+    Сессия записывается не здесь, а по итогам упражнений - с настоящим баллом.
+    """
+
+    def __init__(self, kind: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.kind = kind
+        self.exercises: Optional["ExerciseSet"] = None
+
+    def run(self, tutor: LanguageTutor, context: ConversationContext, writer: SessionWriter,
+            cache: ResponseCache, store: ConversationStore, vocabulary: Optional["VocabularyStore"] = None):
+        """Выполняется в пуле потоков: без вызовов Streamlit"""
+        content = tutor.generate_exercises(self.kind, self.target_language, self.interface_language, self.level,
+                                           self.usage_tag(self.kind))
+        exercises = parse_exercises(self.kind, content)
+        if exercises is None:
+            raise ValueError("репетитор прислал упражнения в неверном формате, попробуйте еще раз")
+        if self.cache_key:
+            cache.put(self.cache_key, content)  # в кэш попадают только разобранные наборы
+        self.assistant_message = store.append(self.user_id, self.target_language, "assistant", exercises.intro)
+        self.exercises = exercises
+
+
+class PendingCheck(PendingReply):
+    """Проверка свободного ответа в упражнении репетитором: в фоне, чтобы скрипт не ждал очередь и повторы API"""
+
+    def __init__(self, exercise: "Exercise", kind: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exercise = exercise
+        self.kind = kind
+        self.verdict: Optional[Tuple[bool, str]] = None
+
+    def run(self, tutor: LanguageTutor):
+        """Выполняется в пуле потоков: без вызовов Streamlit"""
+        self.verdict = tutor.check_answer(self.exercise, self.message, self.target_language, self.interface_language,
+                                          self.level, self.usage_tag(self.kind))
+
+
+class LLMExecutor:
+    """Общий для процесса ограниченный пул потоков для запросов к LLM.
+
+    Запросы регистрируются по ключу сессии браузера: перезапуск скрипта
+    находит уже отправленный запрос, а не отправляет его повторно.
+    """
+
+    def __init__(self, max_workers: int = LLM_MAX_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._jobs: Dict[str, PendingReply] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_key: str, job: PendingReply, fn: Callable[[], None]) -> PendingReply:
+        with self._lock:
+            existing = self._jobs.get(session_key)
+            if existing is not None and not existing.done:
+                return existing
+            self._expire()
+            job.future = self._pool.submit(fn)
+            self._jobs[session_key] = job
+            return job
+
+    def get(self, session_key: str) -> Optional[PendingReply]:
+        return self._jobs.get(session_key)
+
+    def pop(self, session_key: str) -> Optional[PendingReply]:
+        with self._lock:
+            return self._jobs.pop(session_key, None)
+
+    def pending(self) -> int:
+        return sum(1 for job in list(self._jobs.values()) if not job.done)
+
+    def _expire(self):
+        # Готовые ответы закрытых вкладок, которые так и не забрали
+        deadline = time.time() - LLM_JOB_TTL_S
+        for key, job in list(self._jobs.items()):
+            if job.done and job.created_at < deadline:
+                del self._jobs[key]
+
+
+@st.cache_resource
+def get_llm_executor() -> LLMExecutor:
+    """Общий для процесса исполнитель запросов к LLM"""
+    return LLMExecutor()
+
+
+@dataclass(frozen=True)
+class StatsSnapshot:
+    """Неизменяемый снимок показателей панели и боковой колонки: итоги и серия дней.
+
+    Разбивки по языкам, дням и типам занятий считает только AnalyticsEngine.
+    """
+    user_id: int
+    data_version: int
+    day: str
+    total_sessions: int
+    total_time: int
+    total_exercises: int
+    streak: int
+    last_study_date: Optional[str]
+
+    def with_pending(self, events: List[StudyEvent]) -> "StatsSnapshot":
+        """Добавляет события, которые еще ждут записи в базу"""
+        if not events:
+            return self
+        streak, last_date = self.streak, self.last_study_date
+        for day in sorted({event.created_at[:10] for event in events}):
+            if last_date is None or day > last_date:
+                consecutive = last_date is not None and (
+                    datetime.fromisoformat(day) - datetime.fromisoformat(last_date)).days == 1
+                streak = streak + 1 if consecutive else 1
+                last_date = day
+        return replace(
+            self,
+            total_sessions=self.total_sessions + len(events),
+            total_time=self.total_time + sum(event.duration for event in events),
+            total_exercises=self.total_exercises + sum(event.exercises for event in events),
+            streak=streak,
+            last_study_date=last_date
+        )
+
+
+class UserStatistics:
+    """Чтение статистики без состояния сессии: один экземпляр на процесс (get_user_statistics)"""
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+
+    def get_totals(self, user_id: int) -> Tuple[int, int, int]:
+        """(сессий, минут, упражнений) из агрегата user_totals, который ведут триггеры"""
+        with self.db.read() as conn:
+            row = conn.execute('''
+                SELECT sessions, total_time, exercises FROM user_totals WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+        return tuple(row) if row else (0, 0, 0)
+
     def get_streak(self, user_id: int) -> int:
-        """Вычисляет текущую серию дней обучения"""
-        cursor = self.db.conn.cursor()
-        cursor.execute('''
-            WITH dates AS (
-                SELECT DISTINCT DATE(created_at) as study_date
-                FROM study_sessions 
+        """Текущая серия дней обучения: обрывается, если вчера и сегодня занятий не было"""
+        return self.get_streak_state(user_id)[0]
+
+    def get_streak_state(self, user_id: int) -> Tuple[int, Optional[str]]:
+        """Текущая серия и дата последнего занятия"""
+        with self.db.read() as conn:
+            result = conn.execute('''
+                SELECT CASE WHEN last_study_date >= DATE('now', '-1 day') THEN current_streak ELSE 0 END,
+                       last_study_date
+                FROM user_streaks
                 WHERE user_id = ?
-                ORDER BY study_date DESC
-            ),
-            streaks AS (
-                SELECT study_date,
-                       JULIANDAY(study_date) - JULIANDAY(LAG(study_date, 1, study_date) OVER (ORDER BY study_date DESC)) as diff
-                FROM dates
-            )
-            SELECT COUNT(*) as streak
-            FROM streaks
-            WHERE diff = 1
-            ORDER BY study_date DESC
-            LIMIT 1
-        ''', (user_id,))
-        result = cursor.fetchone()
-        return result[0] if result else 0
+            ''', (user_id,)).fetchone()
+        return (result[0], result[1]) if result else (0, None)
+
+    def get_snapshot(self, user_id: int, data_version: int) -> StatsSnapshot:
+        """Строит снимок статистики фиксированным набором запросов"""
+        total_sessions, total_time, total_exercises = self.get_totals(user_id)
+        streak, last_study_date = self.get_streak_state(user_id)
+        return StatsSnapshot(
+            user_id=user_id,
+            data_version=data_version,
+            day=datetime.now(timezone.utc).date().isoformat(),
+            total_sessions=total_sessions,
+            total_time=total_time,
+            total_exercises=total_exercises,
+            streak=streak,
+            last_study_date=last_study_date
+        )
+
+
+@st.cache_resource
+def get_user_statistics() -> UserStatistics:
+    return UserStatistics(get_database())
+
+
+def get_stats_snapshot() -> StatsSnapshot:
+    """Снимок статистики текущего пользователя: пересчитывается только после записи новых сессий"""
+    user_id = st.session_state.user["id"]
+    version = get_database().data_version(user_id)
+    today = datetime.now(timezone.utc).date().isoformat()
+    snapshot = st.session_state.get("stats_snapshot")
+    if (snapshot is None or snapshot.user_id != user_id
+            or snapshot.data_version != version or snapshot.day != today):
+        writer = get_session_writer()
+        with writer.consistent_read():
+            snapshot = get_user_statistics().get_snapshot(user_id, version)
+            snapshot = snapshot.with_pending(writer.pending_for(user_id))
+        st.session_state.stats_snapshot = snapshot
+    return snapshot
+
+
+@dataclass(frozen=True)
+class StudyAnalytics:
+    """Показатели страницы статистики пользователя"""
+    total_sessions: int
+    total_time: int
+    total_exercises: int
+    avg_score: float
+    by_language: pd.DataFrame  # target_language, sessions, time, exercises, avg_score
+    daily: pd.DataFrame  # индекс - дата, без пропусков: sessions, minutes, exercises, rolling_minutes
+    session_mix: pd.DataFrame  # session_type, sessions, share
+    weekly: pd.DataFrame  # индекс - понедельник недели: sessions, minutes, exercises, minutes_change
+
+
+# Колонки агрегатов в том виде, в каком их считает compute_analytics
+LANGUAGE_FRAME_DTYPES = {"target_language": "object", "sessions": "int64", "time": "int64",
+                         "exercises": "int64", "score_sum": "int64", "scored": "int64"}
+DAILY_FRAME_DTYPES = {"study_date": "object", "sessions": "int64", "minutes": "int64", "exercises": "int64"}
+SESSION_TYPE_FRAME_DTYPES = {"session_type": "object", "sessions": "int64"}
+
+
+def pending_rollups(events: List[StudyEvent]) -> Dict[str, pd.DataFrame]:
+    """Агрегаты по событиям, которые еще ждут записи в базу - в тех же колонках, что и в базе"""
+    frame = pd.DataFrame(
+        [(e.target_language, e.session_type, e.duration, e.exercises, e.score, e.created_at[:10]) for e in events],
+        columns=["target_language", "session_type", "duration", "exercises", "score", "study_date"]
+    )
+    frame["scored"] = 1
+    languages = (frame.groupby("target_language")
+                 .agg(sessions=("duration", "size"), time=("duration", "sum"), exercises=("exercises", "sum"),
+                      score_sum=("score", "sum"), scored=("scored", "sum"))
+                 .reset_index())
+    daily = (frame.groupby("study_date")
+             .agg(sessions=("duration", "size"), minutes=("duration", "sum"), exercises=("exercises", "sum"))
+             .reset_index())
+    types = frame.groupby("session_type").size().rename("sessions").reset_index()
+    return {"languages": languages.astype(LANGUAGE_FRAME_DTYPES), "daily": daily.astype(DAILY_FRAME_DTYPES),
+            "types": types.astype(SESSION_TYPE_FRAME_DTYPES)}
+
+
+def merge_rollups(stored: Dict[str, pd.DataFrame], extra: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Складывает два набора агрегатов по ключевой колонке каждой таблицы"""
+    return {name: pd.concat([frame, extra[name]]).groupby(frame.columns[0], as_index=False).sum()
+            for name, frame in stored.items()}
+
+
+def compute_analytics(rollups: Dict[str, pd.DataFrame], today: date, days: int = ANALYTICS_DAYS,
+                      rolling_days: int = ANALYTICS_ROLLING_DAYS, weeks: int = ANALYTICS_WEEKS) -> StudyAnalytics:
+    """Все показатели векторными операциями pandas над агрегатами пользователя"""
+    languages, types = rollups["languages"], rollups["types"]
+    today = pd.Timestamp(today)
+
+    by_language = languages.assign(
+        avg_score=languages["score_sum"] / languages["scored"].where(languages["scored"] > 0)
+    ).sort_values("time", ascending=False)[["target_language", "sessions", "time", "exercises", "avg_score"]]
+
+    # Дни без занятий - нули; ряд берется с запасом на окно скользящего среднего и недельный тренд
+    first_week = today - pd.Timedelta(days=today.dayofweek + 7 * (weeks - 1))
+    first_day = min(first_week, today - pd.Timedelta(days=days + rolling_days - 2))
+    daily = (rollups["daily"]
+             .set_index(pd.to_datetime(rollups["daily"]["study_date"]))
+             .drop(columns="study_date")
+             .reindex(pd.date_range(first_day, today, freq="D"), fill_value=0))
+    daily["rolling_minutes"] = daily["minutes"].rolling(rolling_days, min_periods=1).mean()
+
+    weekly = (daily.loc[first_week:, ["sessions", "minutes", "exercises"]]
+              .resample("7D", origin=first_week).sum())
+    weekly["minutes_change"] = weekly["minutes"].diff().fillna(0)
+
+    mix = types[types["sessions"] > 0].sort_values("sessions", ascending=False)
+    total_sessions = int(languages["sessions"].sum())
+    scored = int(languages["scored"].sum())
+    return StudyAnalytics(
+        total_sessions=total_sessions,
+        total_time=int(languages["time"].sum()),
+        total_exercises=int(languages["exercises"].sum()),
+        avg_score=float(languages["score_sum"].sum() / scored) if scored else 0.0,
+        by_language=by_language.reset_index(drop=True),
+        daily=daily.iloc[-days:],
+        session_mix=mix.assign(share=mix["sessions"] / max(total_sessions, 1)).reset_index(drop=True),
+        weekly=weekly,
+    )
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш в памяти процесса"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build: Callable[[], object]):
+        """Значение по ключу; при промахе строится вне блокировки"""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        value = build()
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return value
+
+
+class AnalyticsEngine:
+    """Аналитика страницы статистики: колоночные выборки агрегатов пользователя и расчет в pandas.
+
+    Агрегаты (user_progress, user_daily_progress, user_session_types) ведут
+    триггеры, поэтому объем чтения зависит от числа дней и языков, а не сессий.
+    Результат кэшируется в памяти процесса по (пользователь, версия данных, день):
+    повторные открытия страницы и соседние вкладки не читают базу.
+    """
+
+    def __init__(self, db: DatabaseManager, writer: Optional[SessionWriter] = None,
+                 cache_size: int = ANALYTICS_CACHE_SIZE, metrics: Optional[Metrics] = None):
+        self.db = db
+        self.writer = writer
+        self.cache_size = cache_size
+        self.metrics = metrics
+        self._cache = LRUCache(cache_size)
+
+    def load_rollups(self, user_id: int, since: str) -> Dict[str, pd.DataFrame]:
+        """Агрегаты пользователя с типизированными колонками; дневные - начиная с since"""
+        with self.db.read() as conn:
+            return {
+                "languages": pd.read_sql_query('''
+                    SELECT target_language, sessions, total_time AS time, exercises, score_sum, scored
+                    FROM user_progress WHERE user_id = ?
+                ''', conn, params=(user_id,), dtype=LANGUAGE_FRAME_DTYPES),
+                "daily": pd.read_sql_query('''
+                    SELECT study_date, sessions, total_time AS minutes, exercises
+                    FROM user_daily_progress WHERE user_id = ? AND study_date >= ?
+                ''', conn, params=(user_id, since), dtype=DAILY_FRAME_DTYPES),
+                "types": pd.read_sql_query('''
+                    SELECT session_type, sessions FROM user_session_types WHERE user_id = ?
+                ''', conn, params=(user_id,), dtype=SESSION_TYPE_FRAME_DTYPES),
+            }
+
+    def cache_key(self, user_id: int) -> Tuple[int, int, str]:
+        """(пользователь, версия данных, день UTC) - меняется только с новыми сессиями или датой"""
+        return user_id, self.db.data_version(user_id), datetime.now(timezone.utc).date().isoformat()
+
+    def get(self, user_id: int) -> Tuple[Tuple[int, int, str], StudyAnalytics]:
+        """(ключ, показатели) пользователя; пересчет только после новых сессий или смены дня.
+
+        Ключ - тот, под которым показатели посчитаны: по нему кэшируется все, что из них построено.
+        """
+        key = self.cache_key(user_id)
+        return key, self._cache.get_or_build(key, lambda: self._compute(user_id, date.fromisoformat(key[2])))
+
+    def _compute(self, user_id: int, today: date) -> StudyAnalytics:
+        since = (today - timedelta(days=max(ANALYTICS_DAYS + ANALYTICS_ROLLING_DAYS, 7 * ANALYTICS_WEEKS))).isoformat()
+        with self.metrics.span("analytics") if self.metrics else nullcontext():
+            with self.writer.consistent_read() if self.writer else nullcontext():
+                rollups = self.load_rollups(user_id, since)
+                pending = self.writer.pending_for(user_id) if self.writer else []
+            if pending:
+                rollups = merge_rollups(rollups, pending_rollups(pending))
+            return compute_analytics(rollups, today)
+
+
+@st.cache_resource
+def get_analytics_engine() -> AnalyticsEngine:
+    """Общий для процесса движок аналитики"""
+    return AnalyticsEngine(get_database(), get_session_writer(), metrics=get_metrics())
+
+
+def downsample(frame: pd.DataFrame, max_points: int = CHART_MAX_POINTS) -> pd.DataFrame:
+    """Ряд с индексом-датой не длиннее max_points: соседние точки усредняются по равным интервалам"""
+    if len(frame) <= max_points:
+        return frame
+    step = -(-len(frame) // max_points)
+    buckets = pd.RangeIndex(len(frame)) // step
+    averaged = frame.groupby(buckets).mean()
+    averaged.index = frame.index[::step]  # подпись интервала - его первая дата
+    return averaged
+
+
+def build_statistics_figures(stats: StudyAnalytics) -> Dict[str, go.Figure]:
+    """Графики страницы статистики"""
+    figures = {}
+    if stats.daily["sessions"].any():
+        daily = downsample(stats.daily[["minutes", "rolling_minutes"]])
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=daily.index, y=daily["minutes"], fill='tozeroy', name='Время обучения (мин)'))
+        fig.add_trace(go.Scatter(x=daily.index, y=daily["rolling_minutes"],
+                                 name=f'Среднее за {ANALYTICS_ROLLING_DAYS} дней'))
+        fig.update_layout(title="Ежедневное время обучения", height=300)
+        figures["daily"] = fig
+    if stats.total_sessions:
+        fig = px.pie(stats.session_mix, names="session_type", values="sessions", hole=0.4)
+        fig.update_layout(height=300, margin=dict(t=20, b=20))
+        figures["session_mix"] = fig
+        weekly = downsample(stats.weekly[["minutes"]])
+        fig = go.Figure(go.Bar(x=weekly.index, y=weekly["minutes"], name='Минут за неделю'))
+        fig.update_layout(height=300, margin=dict(t=20, b=20))
+        figures["weekly"] = fig
+    return figures
+
+
+@st.cache_resource
+def get_figure_cache() -> LRUCache:
+    """Готовые графики статистики по (пользователь, версия данных, день)"""
+    return LRUCache(ANALYTICS_CACHE_SIZE)
+
+
+def get_statistics_figures(key: Tuple[int, int, str], stats: StudyAnalytics) -> Dict[str, go.Figure]:
+    """Графики строятся заново только после новых сессий: между ними тот же объект и тот же JSON,
+    так что повторная отправка в браузер отсекается кэшем сообщений Streamlit.
+
+    key - ключ AnalyticsEngine.get, под которым посчитаны stats: новая версия данных,
+    записанная между расчетом и этим вызовом, не получит графики по старым показателям"""
+    return get_figure_cache().get_or_build(key, lambda: build_statistics_figures(stats))
+
+
+@dataclass(frozen=True)
+class VocabularyWord:
+    """Новое слово из ответа репетитора"""
+    word: str
+    translation: str
+    example: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class VocabularyCard:
+    """Карточка словаря с состоянием планировщика SM-2"""
+    id: int
+    user_id: int
+    word: str
+    translation: str
+    example: Optional[str]
+    ease: float
+    interval_days: float
+    repetitions: int
+    lapses: int
+    due_at: str
+
+
+@dataclass(frozen=True)
+class CardReview:
+    """Результат повторения карточки, ожидающий записи в базу"""
+    card_id: int
+    user_id: int
+    quality: int  # 0-5 по SM-2: меньше 3 - слово забыто
+    ease: float
+    interval_days: float
+    repetitions: int
+    lapses: int
+    due_at: str
+    reviewed_at: str
+
+
+# Оценки ученика при повторении: ключ -> (подпись кнопки, качество ответа SM-2)
+REVIEW_GRADES = {
+    "again": ("🔁 Не помню", 1),
+    "hard": ("😓 Трудно", 3),
+    "good": ("🙂 Помню", 4),
+    "easy": ("😎 Легко", 5),
+}
+
+VOCAB_LINE_RE = re.compile(r"^(?:[-*•]|\d+[.)])?\s*(?P<word>[^|]+?)\s*\|\s*(?P<translation>[^|]+?)\s*"
+                           r"(?:\|\s*(?P<example>[^|]*?)\s*)?$")
+
+
+def schedule_review(card: VocabularyCard, quality: int, now: datetime) -> CardReview:
+    """SM-2: новый коэффициент легкости и интервал; забытое слово возвращается через VOCAB_RELEARN_MINUTES"""
+    ease = max(VOCAB_MIN_EASE, card.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        repetitions, lapses, interval = 0, card.lapses + 1, 0.0
+        due = now + timedelta(minutes=VOCAB_RELEARN_MINUTES)
+    else:
+        repetitions, lapses = card.repetitions + 1, card.lapses
+        interval = 1.0 if repetitions == 1 else 6.0 if repetitions == 2 else round(card.interval_days * ease, 2)
+        due = now + timedelta(days=interval)
+    return CardReview(card.id, card.user_id, quality, round(ease, 3), interval, repetitions, lapses,
+                      due.strftime("%Y-%m-%d %H:%M:%S"), now.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def parse_vocabulary(text: str) -> List[VocabularyWord]:
+    """Слова из блока после VOCAB_LIST_MARKER: строки «слово | перевод | пример» (списком или таблицей)"""
+    _, marker, tail = text.rpartition(VOCAB_LIST_MARKER)
+    words = []
+    for line in tail.splitlines() if marker else ():
+        match = VOCAB_LINE_RE.match(line.replace("**", "").replace("`", "").strip().strip("|").strip())
+        if match is None or not match["word"].strip("-: ") or match["word"].lower() in ("слово", "word"):
+            continue  # заголовок и разделитель markdown-таблицы
+        words.append(VocabularyWord(match["word"], match["translation"], match["example"] or None))
+    return words
+
+
+def vocabulary_prompt(known_words: List[str]) -> str:
+    """Запрос новых слов; уже изученные перечисляются, чтобы репетитор их не повторял"""
+    prompt = (f"Представь {VOCAB_NEW_WORDS} новых слов с переводами, примерами использования и упражнениями "
+              f"для запоминания. В конце ответа напиши строку «{VOCAB_LIST_MARKER}» и под ней эти слова, "
+              f"по одному в строке, в формате: слово | перевод | короткий пример")
+    if known_words:
+        prompt += ". Не предлагай слова, которые я уже изучаю: " + ", ".join(known_words)
+    return prompt
+
+
+class ReviewWriter(BatchWriter):
+    """Результаты повторения слов: копятся в памяти и записываются пачками (update_vocabulary_reviews)"""
+
+    thread_name = "review-writer"
+
+    def __init__(self, db: DatabaseManager, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval_s: float = WRITE_FLUSH_INTERVAL_S):
+        self.db = db
+        super().__init__(batch_size, flush_interval_s)
+
+    def write_batch(self, batch: List[CardReview]):
+        self.db.update_vocabulary_reviews(batch)
+
+
+class VocabularyStore:
+    """Словарь учеников с очередью повторения.
+
+    Слова к повторению - диапазон индекса (user_id, target_language, due_at),
+    без обращений к API. Карточки с еще не записанными оценками (ReviewWriter)
+    в очередь не попадают.
+    """
+
+    def __init__(self, db: DatabaseManager, writer: ReviewWriter):
+        self.db = db
+        self.writer = writer
+
+    def due(self, user_id: int, target_language: str, now: datetime,
+            limit: int = VOCAB_REVIEW_BATCH) -> List[VocabularyCard]:
+        """Карточки, срок повторения которых наступил, начиная с самых просроченных"""
+        where, params = self._due_filter(user_id, target_language, now)
+        with self.writer.consistent_read(), self.db.read() as conn:
+            rows = conn.execute(f'''
+                SELECT id, user_id, word, translation, example, ease, interval_days, repetitions, lapses, due_at
+                FROM vocabulary WHERE {where}
+                ORDER BY due_at LIMIT ?
+            ''', (*params, limit)).fetchall()
+        return [VocabularyCard(*row) for row in rows]
+
+    def due_count(self, user_id: int, target_language: str, now: datetime) -> int:
+        where, params = self._due_filter(user_id, target_language, now)
+        with self.writer.consistent_read(), self.db.read() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM vocabulary WHERE {where}", params).fetchone()[0]
+
+    def _due_filter(self, user_id: int, target_language: str, now: datetime) -> Tuple[str, tuple]:
+        pending = tuple({review.card_id for review in self.writer.pending_for(user_id)})
+        where = "user_id = ? AND target_language = ? AND due_at <= ?"
+        if pending:
+            where += f" AND id NOT IN ({', '.join('?' * len(pending))})"
+        return where, (user_id, target_language, now.strftime("%Y-%m-%d %H:%M:%S"), *pending)
+
+    def recent_words(self, user_id: int, target_language: str, limit: int = VOCAB_EXCLUDE_WORDS) -> List[str]:
+        """Последние добавленные слова - чтобы репетитор не предлагал их снова"""
+        with self.db.read() as conn:
+            rows = conn.execute('''
+                SELECT word FROM vocabulary WHERE user_id = ? AND target_language = ?
+                ORDER BY id DESC LIMIT ?
+            ''', (user_id, target_language, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def add_from_reply(self, user_id: int, target_language: str, text: str) -> int:
+        """Заносит в словарь слова из ответа репетитора; возвращает число новых"""
+        words = parse_vocabulary(text)
+        if not words:
+            return 0
+        created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        return self.db.add_vocabulary(user_id, target_language, words, created_at)
+
+    def review(self, card: VocabularyCard, quality: int, now: Optional[datetime] = None) -> CardReview:
+        """Планирует следующее повторение; запись уходит в базу пачкой"""
+        review = schedule_review(card, quality, now or datetime.now(timezone.utc))
+        self.writer.enqueue(review)
+        return review
+
+
+@st.cache_resource
+def get_vocabulary() -> VocabularyStore:
+    """Общий для процесса словарь с отложенной записью оценок"""
+    return VocabularyStore(get_database(), ReviewWriter(get_database()))
+
+
+class VocabularyReview:
+    """Повторение слов в сессии браузера: карточки выбраны один раз, оценки уходят в VocabularyStore"""
+
+    def __init__(self, target_language: str, cards: List[VocabularyCard]):
+        self.target_language = target_language
+        self.cards = cards
+        self.index = 0
+        self.revealed = False
+        self.qualities: List[int] = []
+        self.started_at = time.time()
+
+    @property
+    def card(self) -> Optional[VocabularyCard]:
+        return self.cards[self.index] if self.index < len(self.cards) else None
+
+    def reveal(self):
+        self.revealed = True
+
+    def grade(self, vocabulary: VocabularyStore, quality: int):
+        vocabulary.review(self.card, quality)
+        self.qualities.append(quality)
+        self.index += 1
+        self.revealed = False
+
+    def stop(self):
+        self.cards = self.cards[:self.index]
+
+    @property
+    def score(self) -> int:
+        """Доля вспомненных слов, %"""
+        return round(100 * sum(q >= 3 for q in self.qualities) / len(self.qualities)) if self.qualities else 0
+
+
+@dataclass(frozen=True)
+class Exercise:
+    """Задание набора: принятые ответы известны заранее, поэтому проверка локальная"""
+    question: str
+    answers: Tuple[str, ...]
+    explanation: str = ""
+    options: Tuple[str, ...] = ()  # варианты для выбора; пусто - ответ вводится
+    free_text: bool = False  # ответ своими словами: несовпадение с образцами решает репетитор
+
+
+@dataclass(frozen=True)
+class ExerciseSet:
+    """Набор упражнений из JSON-ответа репетитора"""
+    kind: str  # тип сессии: grammar | test
+    topic: str
+    explanation: str
+    exercises: Tuple[Exercise, ...]
+
+    @property
+    def intro(self) -> str:
+        """Сообщение в чат: тема, объяснение и число заданий"""
+        parts = [f"**{self.topic}**" if self.topic else "", self.explanation,
+                 f"_Заданий: {len(self.exercises)}. Ответы проверяются сразу, в панели над чатом._"]
+        return "\n\n".join(part for part in parts if part)
+
+
+def parse_exercises(kind: str, text: str) -> Optional[ExerciseSet]:
+    """Разбирает JSON набора; задания без текста или без принятых ответов пропускаются. None - формат не тот"""
+    try:
+        data = json.loads(text[text.find("{"):text.rfind("}") + 1])  # на случай обертки ```json
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    exercises = []
+    for item in data.get("questions") or []:
+        if not isinstance(item, dict):
+            continue
+        question = str(item.get("question") or "").strip()
+        answers = tuple(str(answer).strip() for answer in item.get("answers") or []
+                        if answer is not None and str(answer).strip())
+        options = tuple(str(option).strip() for option in item.get("options") or []
+                        if option is not None and str(option).strip())
+        if question and answers:
+            exercises.append(Exercise(question, answers, str(item.get("explanation") or ""), options,
+                                      bool(item.get("free_text")) and not options))
+    if not exercises:
+        return None
+    return ExerciseSet(kind, str(data.get("topic") or ""), str(data.get("explanation") or ""), tuple(exercises))
+
+
+def normalize_answer(text: str, strip_accents: bool = True) -> str:
+    """Ответ для сравнения: без регистра, пунктуации и лишних пробелов. strip_accents убирает диакритику
+    латиницы, греческого и кириллицы; у остальных письменностей (например, дакутэн каны) знаки значимы"""
+    chars, base = [], ""
+    for char in unicodedata.normalize("NFD", text.casefold()):
+        category = unicodedata.category(char)
+        if category == "Mn":
+            if strip_accents and base < "\u0530":
+                continue
+        elif category.startswith("P"):
+            char = " "
+        else:
+            base = char
+        chars.append(char)
+    return unicodedata.normalize("NFC", " ".join("".join(chars).split()))
+
+
+def check_answer_locally(exercise: Exercise, answer: str) -> Optional[Tuple[bool, str]]:
+    """(верно, пояснение) или None, если свободный ответ не совпал с образцами и решать должен репетитор"""
+    strict, loose = normalize_answer(answer, strip_accents=False), normalize_answer(answer)
+    for accepted in exercise.answers:
+        if normalize_answer(accepted, strip_accents=False) == strict:
+            return True, exercise.explanation
+        if normalize_answer(accepted) == loose:
+            return True, f"Обратите внимание на диакритику: {accepted}. {exercise.explanation}".strip()
+    if exercise.free_text:
+        return None
+    return False, f"Правильный ответ: {exercise.answers[0]}. {exercise.explanation}".strip()
+
+
+class ExerciseRun:
+    """Прохождение набора упражнений в сессии браузера"""
+
+    def __init__(self, exercises: ExerciseSet, target_language: str):
+        self.exercises = exercises
+        self.target_language = target_language
+        self.index = 0
+        self.log: List[Tuple[Exercise, str, bool, str]] = []  # (задание, ответ, верно, пояснение)
+        self.unchecked: Optional[str] = None  # свободный ответ, который ждет вердикта репетитора
+        self.started_at = time.time()
+
+    @property
+    def exercise(self) -> Optional[Exercise]:
+        return self.exercises.exercises[self.index] if self.index < len(self.exercises.exercises) else None
+
+    @property
+    def feedback(self) -> Optional[Tuple[bool, str]]:
+        """Результат последнего ответа"""
+        return self.log[-1][2:] if self.log else None
+
+    def answer(self, text: str):
+        verdict = check_answer_locally(self.exercise, text)
+        if verdict is None:
+            self.unchecked = text
+        else:
+            self.record(text, *verdict)
+
+    def record(self, text: str, correct: bool, comment: str):
+        self.log.append((self.exercise, text, correct, comment))
+        self.unchecked = None
+        self.index += 1
+
+    def stop(self):
+        self.exercises = replace(self.exercises, exercises=self.exercises.exercises[:self.index])
+
+    @property
+    def score(self) -> int:
+        """Доля верных ответов, %"""
+        return round(100 * sum(correct for _, _, correct, _ in self.log) / len(self.log)) if self.log else 0
+
+    def summary(self) -> str:
+        """Итоги для чата: верные и неверные ответы с правильным вариантом"""
+        correct = sum(correct for _, _, correct, _ in self.log)
+        lines = [f"**Результат: {correct} из {len(self.log)} ({self.score}%)**", ""]
+        for number, (exercise, text, ok, _) in enumerate(self.log, start=1):
+            lines.append(f"{number}. {'✅' if ok else '❌'} {exercise.question} — {text}"
+                         + ("" if ok else f" (верно: {exercise.answers[0]})"))
+        return "\n".join(lines)
 
 
 def init_session_state():
     """Инициализация состояния сессии"""
+    if "session_key" not in st.session_state:
+        st.session_state.session_key = uuid.uuid4().hex
     if "user" not in st.session_state:
         st.session_state.user = None
-    if "conversation" not in st.session_state:
-        st.session_state.conversation = []
-    if "db" not in st.session_state:
-        st.session_state.db = DatabaseManager()
-    if "tutor" not in st.session_state:
-        st.session_state.tutor = LanguageTutor(DEEPSEEK_API_KEY)
-    if "stats" not in st.session_state:
-        st.session_state.stats = UserStatistics(st.session_state.db)
+    if "conversations" not in st.session_state:
+        st.session_state.conversations = {}  # язык -> ConversationHistory
     if "current_language" not in st.session_state:
         st.session_state.current_language = "english"
     if "current_level" not in st.session_state:
         st.session_state.current_level = "beginner"
+    if "active_page" not in st.session_state:
+        st.session_state.active_page = "learning"
 
 
 def hash_password(password: str) -> str:
@@ -384,30 +3028,30 @@ def validate_email(email: str) -> bool:
 def register_user(username: str, email: str, password: str, native_language: str, interface_language: str) -> bool:
     """Регистрация нового пользователя"""
     try:
-        cursor = st.session_state.db.conn.cursor()
-
-        # Проверяем, существует ли пользователь
-        cursor.execute("SELECT id FROM users WHERE username = ? OR email = ?", (username, email))
-        if cursor.fetchone():
-            return False
-
-        # Создаем пользователя
-        cursor.execute(
-            "INSERT INTO users (username, email, password_hash, native_language, interface_language) VALUES (?, ?, ?, ?, ?)",
-            (username, email, hash_password(password), native_language, interface_language)
-        )
+        with get_database().write() as conn:
+            cursor = conn.cursor()
 
-        user_id = cursor.lastrowid
+            # Проверяем, существует ли пользователь
+            cursor.execute("SELECT id FROM users WHERE username = ? OR email = ?", (username, email))
+            if cursor.fetchone():
+                return False
 
-        # Добавляем языки по умолчанию
-        default_languages = ["english", "spanish", "french"]
-        for lang in default_languages:
+            # Создаем пользователя
             cursor.execute(
-                "INSERT INTO user_languages (user_id, target_language) VALUES (?, ?)",
-                (user_id, lang)
+                "INSERT INTO users (username, email, password_hash, native_language, interface_language) VALUES (?, ?, ?, ?, ?)",
+                (username, email, hash_password(password), native_language, interface_language)
             )
 
-        st.session_state.db.conn.commit()
+            user_id = cursor.lastrowid
+
+            # Добавляем языки по умолчанию
+            default_languages = ["english", "spanish", "french"]
+            for lang in default_languages:
+                cursor.execute(
+                    "INSERT INTO user_languages (user_id, target_language) VALUES (?, ?)",
+                    (user_id, lang)
+                )
+
         return True
     except Exception as e:
         st.error(f"Ошибка при регистрации: {str(e)}")
@@ -417,12 +3061,11 @@ def register_user(username: str, email: str, password: str, native_language: str
 def login_user(username: str, password: str) -> bool:
     """Авторизация пользователя"""
     try:
-        cursor = st.session_state.db.conn.cursor()
-        cursor.execute(
-            "SELECT id, username, interface_language FROM users WHERE username = ? AND password_hash = ?",
-            (username, hash_password(password))
-        )
-        user = cursor.fetchone()
+        with get_database().read() as conn:
+            user = conn.execute(
+                "SELECT id, username, interface_language FROM users WHERE username = ? AND password_hash = ?",
+                (username, hash_password(password))
+            ).fetchone()
 
         if user:
             st.session_state.user = {
@@ -439,48 +3082,118 @@ def login_user(username: str, password: str) -> bool:
 
 def get_user_languages(user_id: int) -> List[str]:
     """Получает языки пользователя"""
-    cursor = st.session_state.db.conn.cursor()
-    cursor.execute(
-        "SELECT target_language FROM user_languages WHERE user_id = ? AND is_active = TRUE",
-        (user_id,)
-    )
-    return [row[0] for row in cursor.fetchall()]
+    with get_database().read() as conn:
+        rows = conn.execute(
+            "SELECT target_language FROM user_languages WHERE user_id = ? AND is_active = TRUE",
+            (user_id,)
+        ).fetchall()
+    return [row[0] for row in rows]
 
 
 def add_user_language(user_id: int, language: str):
     """Добавляет язык для изучения"""
     try:
-        cursor = st.session_state.db.conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO user_languages (user_id, target_language) VALUES (?, ?)",
-            (user_id, language)
-        )
-        st.session_state.db.conn.commit()
+        with get_database().write() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO user_languages (user_id, target_language) VALUES (?, ?)",
+                (user_id, language)
+            )
     except Exception as e:
         st.error(f"Ошибка при добавлении языка: {str(e)}")
 
 
+def new_study_event(user_id: int, target_language: str, session_type: str,
+                    duration: int, exercises: int, score: int = 0) -> StudyEvent:
+    """Событие сессии обучения с текущим временем"""
+    created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return StudyEvent(user_id, target_language, session_type, duration, exercises, score, created_at)
+
+
 def record_study_session(user_id: int, target_language: str, session_type: str,
                          duration: int, exercises: int, score: int = 0):
-    """Записывает сессию обучения"""
-    try:
-        cursor = st.session_state.db.conn.cursor()
-        cursor.execute('''
-            INSERT INTO study_sessions (user_id, target_language, session_type, duration_minutes, exercises_completed, score)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, target_language, session_type, duration, exercises, score))
-        st.session_state.db.conn.commit()
-    except Exception as e:
-        st.error(f"Ошибка при записи сессии: {str(e)}")
+    """Записывает сессию обучения (в фоне, пачками)"""
+    get_session_writer().enqueue(new_study_event(user_id, target_language, session_type, duration, exercises, score))
+
+
+def timed_page(func: Callable) -> Callable:
+    """Замеряет отрисовку части страницы (ferais_page_render_seconds{page=...}).
+
+    Прогоны, прерванные st.rerun() (ожидание ответа репетитора), не учитываются.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        get_metrics().observe("ferais_page_render_seconds", time.perf_counter() - start, page=func.__name__)
+        return result
+    return wrapper
+
+
+def render_rerun_timings(trace: List[Tuple[str, float]], total_s: float):
+    """Разбивка времени перезапуска для администраторов"""
+    breakdown: Dict[str, List[float]] = {}
+    for name, seconds in trace:
+        breakdown.setdefault(name, []).append(seconds)
+    rows = sorted(((name, len(values), sum(values) * 1000) for name, values in breakdown.items()),
+                  key=lambda row: row[2], reverse=True)
+    metrics = get_metrics()
+    hit_tokens = metrics.value("ferais_prompt_cache_hit_tokens_total")
+    prompt_tokens = hit_tokens + metrics.value("ferais_prompt_cache_miss_tokens_total")
+    with st.sidebar.expander(f"⏱️ Перезапуск: {total_s * 1000:.0f} мс"):
+        st.dataframe(pd.DataFrame(rows, columns=["Операция", "Вызовов", "мс"]).round(1),
+                     hide_index=True, width="stretch")
+        if prompt_tokens:
+            st.caption(f"Кэш префиксов DeepSeek: {hit_tokens / prompt_tokens:.0%} из {prompt_tokens:,.0f} "
+                       f"токенов промпта")
+        cache = get_response_cache().stats()
+        st.caption(f"Кэш ответов: {cache['hit_rate']:.0%} попаданий ({cache['hits']} из "
+                   f"{cache['hits'] + cache['misses']}), записей: {cache['entries']}")
+
+
+@dataclass(frozen=True)
+class StaticAssets:
+    """Готовый HTML стилей и логотипа; собирается один раз на процесс (get_static_assets)"""
+    styles_html: str
+    logo_html: str
+
+
+def static_url(name: str, content: bytes) -> str:
+    """Адрес файла из static/ с хэшем содержимого: новая версия файла - новый адрес, старую браузер может кэшировать"""
+    return f"{STATIC_URL}/{name}?v={hashlib.sha256(content).hexdigest()[:12]}"
+
+
+def build_static_assets(static_dir: str = STATIC_DIR, serving: bool = False) -> StaticAssets:
+    """Стили - ссылкой на static/app.css, логотип - локальным файлом; без раздачи статики - встраиваются в страницу"""
+    with open(os.path.join(static_dir, APP_STYLES_FILE), "rb") as f:
+        styles = f.read()
+    if serving:
+        styles_html = f'<style>@import url("{static_url(APP_STYLES_FILE, styles)}");</style>'
+    else:
+        styles_html = f"<style>\n{styles.decode('utf-8')}</style>"
+
+    logo_src = None
+    logo_path = os.path.join(static_dir, APP_LOGO_FILE) if APP_LOGO_FILE else None
+    if logo_path and os.path.isfile(logo_path):
+        with open(logo_path, "rb") as f:
+            logo = f.read()
+        logo_src = (static_url(APP_LOGO_FILE, logo) if serving
+                    else f"data:{mimetypes.guess_type(logo_path)[0]};base64,{base64.b64encode(logo).decode('ascii')}")
+    return StaticAssets(styles_html=styles_html, logo_html=get_logo_html(logo_src))
+
 
+@st.cache_resource
+def get_static_assets() -> StaticAssets:
+    """Статика процесса: файлы читаются и хэшируются один раз, а не на каждом перезапуске"""
+    return build_static_assets(serving=bool(st.get_option("server.enableStaticServing")))
 
-def get_logo_html():
+
+def get_logo_html(logo_src: Optional[str] = None):
     """Генерирует HTML для отображения логотипа"""
-    if APP_LOGO_URL:
+    if logo_src:
         return f"""
         <div class="sidebar-header">
             <div class="sidebar-logo-container">
-                <img src="{APP_LOGO_URL}" 
+                <img src="{logo_src}" 
                      class="sidebar-logo-img" 
                      alt="Логотип Языковой Репетитор"
                      onerror="this.style.display='none'; this.nextElementSibling.style.display='block';">
@@ -502,12 +3215,12 @@ def get_logo_html():
         """
 
 
+@timed_page
 def render_sidebar():
     """Боковая панель с настройками"""
     with st.sidebar:
         # Логотип и название приложения
-        logo_html = get_logo_html()
-        st.markdown(logo_html, unsafe_allow_html=True)
+        st.markdown(get_static_assets().logo_html, unsafe_allow_html=True)
 
         # Информация о пользователе
         st.markdown(f"""
@@ -519,30 +3232,31 @@ def render_sidebar():
 
         st.header("⚙️ Настройки обучения")
 
+        catalog = get_catalog()
+        language_labels = catalog.language_labels.get(st.session_state.user["interface_language"],
+                                                      catalog.language_labels["russian"])
+
         # Выбор языка для изучения
         user_languages = get_user_languages(st.session_state.user["id"])
         target_language = st.selectbox(
             "Язык для изучения",
             options=user_languages,
-            format_func=lambda
-                x: f"{st.session_state.tutor.target_languages[x]['flag']} {st.session_state.tutor.target_languages[x]['name']}",
+            format_func=language_labels.__getitem__,
             key="language_selector"
         )
 
         # Добавление нового языка
         with st.expander("➕ Добавить язык"):
-            available_languages = [lang for lang in st.session_state.tutor.target_languages.keys() if
-                                   lang not in user_languages]
+            available_languages = [lang for lang in catalog.target_languages if lang not in user_languages]
             if available_languages:
                 new_lang = st.selectbox(
                     "Выберите язык",
                     options=available_languages,
-                    format_func=lambda
-                        x: f"{st.session_state.tutor.target_languages[x]['flag']} {st.session_state.tutor.target_languages[x]['name']}"
+                    format_func=language_labels.__getitem__
                 )
                 if st.button("Добавить язык", key="add_lang_btn"):
                     add_user_language(st.session_state.user["id"], new_lang)
-                    st.success(f"Язык {st.session_state.tutor.target_languages[new_lang]['name']} добавлен!")
+                    st.success(f"Язык {catalog.target_languages[new_lang].name} добавлен!")
                     st.rerun()
             else:
                 st.info("Вы изучаете все доступные языки!")
@@ -550,9 +3264,9 @@ def render_sidebar():
         # Уровень владения
         level = st.selectbox(
             "Ваш уровень",
-            options=list(st.session_state.tutor.levels.keys()),
-            format_func=lambda
-                x: f"{st.session_state.tutor.levels[x]['emoji']} {st.session_state.tutor.levels[x]['name']}",
+            options=list(catalog.levels),
+            format_func=catalog.level_labels.get(st.session_state.user["interface_language"],
+                                                 catalog.level_labels["russian"]).__getitem__,
             key="level_selector"
         )
 
@@ -567,56 +3281,93 @@ def render_sidebar():
         col1, col2 = st.columns(2)
         with col1:
             st.markdown('<div class="grammar-btn">', unsafe_allow_html=True)
-            if st.button("Грамматика", use_container_width=True, key="grammar_btn"):
+            if st.button("Грамматика", width="stretch", key="grammar_btn"):
                 start_grammar_session(target_language, level)
             st.markdown('</div>', unsafe_allow_html=True)
 
             st.markdown('<div class="vocab-btn">', unsafe_allow_html=True)
-            if st.button("Словарь", use_container_width=True, key="vocab_btn"):
+            due = get_vocabulary().due_count(st.session_state.user["id"], target_language, datetime.now(timezone.utc))
+            if st.button(f"Словарь ({due})" if due else "Словарь", width="stretch", key="vocab_btn",
+                         help="Слова к повторению - без обращения к репетитору" if due else None):
                 start_vocabulary_session(target_language, level)
             st.markdown('</div>', unsafe_allow_html=True)
 
         with col2:
             st.markdown('<div class="dialogue-btn">', unsafe_allow_html=True)
-            if st.button("Диалог", use_container_width=True, key="dialogue_btn"):
+            if st.button("Диалог", width="stretch", key="dialogue_btn"):
                 start_conversation_session(target_language, level)
             st.markdown('</div>', unsafe_allow_html=True)
 
             st.markdown('<div class="test-btn">', unsafe_allow_html=True)
-            if st.button("Тест", use_container_width=True, key="test_btn"):
+            if st.button("Тест", width="stretch", key="test_btn"):
                 start_test_session(target_language, level)
             st.markdown('</div>', unsafe_allow_html=True)
 
         st.divider()
 
         # Текущий прогресс
-        stats = st.session_state.stats.get_user_stats(st.session_state.user["id"])
-        streak = st.session_state.stats.get_streak(st.session_state.user["id"])
+        stats = get_stats_snapshot()
 
         st.markdown(f"""
         <div class="progress-card">
             <div class="progress-title">📈 Текущий прогресс</div>
-            <div class="progress-stats">{stats['total_time']} мин • {streak} дн</div>
+            <div class="progress-stats">{stats.total_time} мин • {stats.streak} дн</div>
         </div>
         """, unsafe_allow_html=True)
 
         st.markdown('<div class="logout-btn">', unsafe_allow_html=True)
-        if st.button("Выйти", use_container_width=True, key="logout_btn"):
+        if st.button("Выйти", width="stretch", key="logout_btn"):
             st.session_state.user = None
-            st.session_state.conversation = []
+            st.session_state.conversations = {}
+            st.session_state.pop("vocab_review", None)
+            st.session_state.pop("exercise_run", None)
+            get_llm_executor().pop(st.session_state.session_key)
+            get_llm_executor().pop(answer_check_key())
+            st.session_state.stats_snapshot = None
             st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
 
+@timed_page
 def render_learning_interface():
     """Основной интерфейс обучения"""
-    st.header(f"{st.session_state.tutor.target_languages[st.session_state.current_language]['flag']} "
-              f"Обучение {st.session_state.tutor.target_languages[st.session_state.current_language]['name']}")
-
-    # Чат с репетитором
+    language = get_catalog().target_languages[st.session_state.current_language]
+    st.header(f"{language.flag} Обучение {language.name}")
+    render_exercises()
+    render_vocabulary_review()
+    render_chat_panel()
+
+
+@st.fragment
+def render_chat_panel():
+    """Лента сообщений и ввод. Отправка сообщения перезапускает только эту панель:
+    сообщение обрабатывается до отрисовки ленты, поэтому отдельный перезапуск не нужен"""
+    executor = get_llm_executor()
+    conversation = get_conversation()
     chat_container = st.container()
+
+    # Ввод сообщения; быстрые действия из боковой панели ставят свой запрос в очередь
+    pending = executor.get(st.session_state.session_key)
+    prompt = st.chat_input("Задайте вопрос репетитору...", disabled=pending is not None)
+    queued = st.session_state.pop("queued_message", None)
+    if pending is not None and (prompt or queued):
+        st.toast("Дождитесь ответа репетитора на предыдущий вопрос")
+    elif prompt or queued:
+        pending = handle_user_message(
+            prompt or queued["message"],
+            st.session_state.current_language,
+            st.session_state.user["interface_language"],
+            st.session_state.current_level,
+            cacheable=not prompt and queued["cacheable"],
+            session=CHAT_TURN_SESSION if prompt else queued["session"],
+            exercise_kind=None if prompt else queued["exercise_kind"]
+        )
+
     with chat_container:
-        for msg in st.session_state.conversation[-10:]:  # Показываем последние 10 сообщений
+        if conversation.can_show_more and st.button("⬆️ Показать более ранние сообщения", key="show_older_btn"):
+            conversation.show_more()
+
+        for msg in conversation.visible():
             if msg["role"] == "user":
                 with st.chat_message("user"):
                     st.markdown(msg["content"])
@@ -624,84 +3375,277 @@ def render_learning_interface():
                 with st.chat_message("assistant"):
                     st.markdown(msg["content"])
 
-    # Ввод сообщения
-    if prompt := st.chat_input("Задайте вопрос репетитору..."):
-        handle_user_message(
-            prompt,
-            st.session_state.current_language,
-            st.session_state.user["interface_language"],
-            st.session_state.current_level
-        )
+        if pending is not None:
+            render_pending_reply(pending, conversation.target_language)
 
+        reply_error = st.session_state.get("reply_error")
+        if reply_error and reply_error[0] == conversation.target_language and pending is None:
+            st.error(reply_error[1])
 
-def handle_user_message(message: str, target_language: str, interface_language: str, level: str):
-    """Обработка сообщения пользователя"""
-    st.session_state.conversation.append({"role": "user", "content": message})
+        timing = st.session_state.get("last_reply_timing")
+        if timing and conversation.messages and pending is None:
+            first_token_s, total_s = timing
+            st.caption(f"⏱️ Первый токен: {first_token_s:.1f} с • весь ответ: {total_s:.1f} с")
 
-    with st.spinner("Репетитор думает..."):
-        response = st.session_state.tutor.send_message(
-            message, target_language, interface_language, level,
-            st.session_state.conversation[:-1]
-        )
-        st.session_state.conversation.append({"role": "assistant", "content": response})
-
-    # Записываем сессию
-    record_study_session(
-        st.session_state.user["id"],
-        target_language,
-        "conversation",
-        3,  # предполагаемая длительность
-        1  # одно упражнение (вопрос-ответ)
-    )
 
+@st.fragment(run_every=LLM_POLL_INTERVAL_S)
+def render_pending_reply(job: PendingReply, target_language: str):
+    """Ответ, который готовится в фоне; фрагмент опрашивает его сам по себе, без перезапуска страницы"""
+    if job.done:
+        finish_pending_reply(job)
+    if job.target_language == target_language:
+        with st.chat_message("assistant"):
+            st.markdown(job.text + "▌" if job.text else pending_reply_status(st.session_state.user["id"]))
+
+
+@st.fragment
+def render_exercises():
+    """Текущее задание набора. Ответ проверяется локально в колбэке и перезапускает только эту панель;
+    свободный ответ, не совпавший с образцами, проверяет репетитор в фоне"""
+    run = st.session_state.get("exercise_run")
+    if run is None or run.target_language != st.session_state.current_language:
+        return
+    exercise = run.exercise
+    if exercise is None:
+        finish_exercises(run)
+    check = submit_answer_check(run) if run.unchecked is not None else None
+
+    if run.feedback is not None:
+        correct, comment = run.feedback
+        (st.success if correct else st.error)(("✅ Верно. " if correct else "❌ Неверно. ") + comment)
+    st.markdown(f"**📝 {run.exercises.topic or 'Упражнения'}: задание {run.index + 1} "
+                f"из {len(run.exercises.exercises)}**")
+    st.markdown(exercise.question)
+    key = f"exercise_answer_{run.index}"
+    with st.form("exercise_form", clear_on_submit=True):
+        if exercise.options:
+            st.radio("Ответ", exercise.options, key=key)
+        else:
+            st.text_input("Ответ", key=key)
+        st.form_submit_button("Ответить", on_click=submit_exercise_answer, args=(key,), disabled=check is not None)
+    if check is not None:
+        render_answer_check(check, run)
+    st.button("Закончить упражнения", key="exercise_stop_btn", on_click=run.stop)
+    st.divider()
+
+
+def answer_check_key() -> str:
+    """Ключ проверки ответа в исполнителе: отдельно от ответа в чате, который может готовиться параллельно"""
+    return f"{st.session_state.session_key}:check"
+
+
+def submit_answer_check(run: ExerciseRun) -> PendingCheck:
+    """Фоновая проверка свободного ответа; перезапуск скрипта находит уже отправленную"""
+    executor = get_llm_executor()
+    job = executor.get(answer_check_key())
+    if job is not None and job.exercise is run.exercise and job.message == run.unchecked:
+        return job
+    job = PendingCheck(run.exercise, run.exercises.kind, st.session_state.user["id"], run.unchecked,
+                       run.target_language, st.session_state.user["interface_language"],
+                       st.session_state.current_level, [], turn=get_conversation(run.target_language).turns)
+    tutor = get_tutor()
+    executor.pop(answer_check_key())
+    return executor.submit(answer_check_key(), job, lambda: job.run(tutor))
+
+
+@st.fragment(run_every=LLM_POLL_INTERVAL_S)
+def render_answer_check(job: PendingCheck, run: ExerciseRun):
+    """Ждет вердикта репетитора, не блокируя скрипт; готовый вердикт засчитывается и панель перерисовывается"""
+    if not job.done:
+        st.caption(pending_reply_status(st.session_state.user["id"], "Репетитор проверяет ответ..."))
+        return
+    get_llm_executor().pop(answer_check_key())
+    verdict = job.verdict if job.future.exception() is None else None
+    if verdict is None:
+        verdict = False, f"Не удалось проверить ответ. Образец: {job.exercise.answers[0]}"
+    if run.unchecked == job.message and run.exercise is job.exercise:
+        run.record(job.message, *verdict)
+    st.rerun()
+
+
+def submit_exercise_answer(key: str):
+    answer = st.session_state.get(key) or ""
+    if answer.strip():
+        st.session_state.exercise_run.answer(answer)
+
+
+def finish_exercises(run: ExerciseRun):
+    """Итоги в чат, сессия с настоящим баллом - и перезапуск всей страницы: показатели изменились"""
+    del st.session_state.exercise_run
+    get_llm_executor().pop(answer_check_key())
+    if run.log:
+        get_conversation(run.target_language).add("assistant", run.summary())
+        minutes = max(1, round((time.time() - run.started_at) / 60))
+        record_study_session(st.session_state.user["id"], run.target_language, run.exercises.kind,
+                             minutes, len(run.log), run.score)
+    st.rerun()
+
+
+@st.fragment
+def render_vocabulary_review():
+    """Карточка повторения слов. Оценки обрабатываются в колбэках без API и перезапускают только карточку;
+    после последней карточки сессия записывается и страница перезапускается целиком"""
+    review = st.session_state.get("vocab_review")
+    if review is None or review.target_language != st.session_state.current_language:
+        return
+    card = review.card
+    if card is None:
+        finish_vocabulary_review(review)
+
+    st.markdown(f"**🔁 Повторение слов: {review.index + 1} из {len(review.cards)}**")
+    st.subheader(card.word)
+    if not review.revealed:
+        st.button("Показать перевод", key="vocab_reveal_btn", on_click=review.reveal)
+    else:
+        st.markdown(f"**{card.translation}**" + (f"  \n_{card.example}_" if card.example else ""))
+        columns = st.columns(len(REVIEW_GRADES))
+        for column, (key, (label, quality)) in zip(columns, REVIEW_GRADES.items()):
+            with column:
+                st.button(label, key=f"vocab_grade_{key}", on_click=grade_vocabulary_card, args=(quality,))
+    st.button("Закончить повторение", key="vocab_stop_btn", on_click=review.stop)
+    st.divider()
+
+
+def grade_vocabulary_card(quality: int):
+    st.session_state.vocab_review.grade(get_vocabulary(), quality)
+
+
+def finish_vocabulary_review(review: VocabularyReview):
+    """Засчитывает повторение как сессию по словарю и перезапускает страницу: показатели изменились"""
+    del st.session_state.vocab_review
+    if review.qualities:
+        minutes = max(1, round((time.time() - review.started_at) / 60))
+        record_study_session(st.session_state.user["id"], review.target_language, "vocabulary",
+                             minutes, len(review.qualities), review.score)
+    st.rerun()
+
+
+def pending_reply_status(user_id: int, idle: str = "Репетитор думает...") -> str:
+    """Текст на месте ответа, пока он не начал поступать: место в очереди или «думает»"""
+    admission = get_admission_controller()
+    position = admission.position(user_id)
+    if position is None:
+        return idle
+    return (f"⏳ Много желающих: вы {position}-й в очереди, "
+            f"ожидание ~{max(1, round(admission.estimated_wait_s(position)))} с")
+
+
+def queue_user_message(message: str, cacheable: bool = False,
+                       session: Tuple[str, int, int, int] = CHAT_TURN_SESSION, exercise_kind: Optional[str] = None):
+    """Передает сообщение чату: оно будет отправлено в этом же прогоне скрипта.
+    С exercise_kind вместо ответа запрашивается набор упражнений этого типа"""
+    st.session_state.queued_message = {"message": message, "cacheable": cacheable, "session": session,
+                                       "exercise_kind": exercise_kind}
+
+
+def handle_user_message(message: str, target_language: str, interface_language: str, level: str,
+                        cacheable: bool = False, session: Tuple[str, int, int, int] = CHAT_TURN_SESSION,
+                        exercise_kind: Optional[str] = None) -> Optional[PendingReply]:
+    """Обработка сообщения пользователя: ответ готовится в фоне, страница только опрашивает его.
+
+    Возвращает фоновый запрос; ответ из кэша сразу записывает сессию (или открывает
+    упражнения) и перезапускает страницу.
+    """
+    conversation = get_conversation(target_language)
+    history = conversation.recent()
+    conversation.add("user", message)
+    st.session_state.reply_error = None
+
+    # Ответ на типовой запрос быстрого действия не зависит от истории диалога
+    cache = get_response_cache()
+    cache_key = ResponseCache.make_key(message, target_language, level, interface_language) if cacheable else None
+    response = cache.get(cache_key) if cache_key else None
+
+    if response is not None:
+        st.session_state.last_reply_timing = None
+        exercises = parse_exercises(exercise_kind, response) if exercise_kind else None
+        if exercises is not None:
+            conversation.add("assistant", exercises.intro)
+            st.session_state.exercise_run = ExerciseRun(exercises, target_language)
+            st.rerun()
+        conversation.add("assistant", response)
+        if session[0] == "vocabulary":
+            get_vocabulary().add_from_reply(st.session_state.user["id"], target_language, response)
+        record_study_session(st.session_state.user["id"], target_language, *session)
+        st.rerun()  # новая сессия: обновить и показатели страницы
+
+    args = (st.session_state.user["id"], message, target_language, interface_language, level, history, cache_key,
+            session, conversation.turns)
+    job = PendingExercises(exercise_kind, *args) if exercise_kind else PendingReply(*args)
+    tutor, context, writer, store, vocabulary = (get_tutor(), conversation.context, get_session_writer(),
+                                                 get_conversation_store(), get_vocabulary())
+    return get_llm_executor().submit(st.session_state.session_key, job,
+                                     lambda: job.run(tutor, context, writer, cache, store, vocabulary))
+
+
+def finish_pending_reply(job: PendingReply):
+    """Переносит готовый фоновый ответ в диалог и перезапускает всю страницу: сессия записана"""
+    get_llm_executor().pop(st.session_state.session_key)
+    error = job.future.exception()
+    if error is not None:
+        logger.error("Фоновый запрос к репетитору завершился ошибкой: %s", error)
+    conversation = get_conversation(job.target_language)
+    if job.assistant_message is not None:
+        conversation.add_saved(job.assistant_message)
+    st.session_state.reply_error = (job.target_language, job.error) if job.error else None
+    if job.reply and job.reply.total_s is not None:
+        st.session_state.last_reply_timing = (job.reply.first_token_s or job.reply.total_s, job.reply.total_s)
+    # Не isinstance: скрипт исполняется заново на каждом перезапуске, и классы в нем - новые объекты
+    exercises = getattr(job, "exercises", None)
+    if exercises is not None:
+        st.session_state.exercise_run = ExerciseRun(exercises, job.target_language)
     st.rerun()
 
 
 def start_grammar_session(target_language: str, level: str):
-    """Начинает сессию по грамматике"""
-    prompt = "Объясни грамматическую тему и дай 3-5 практических упражнений с ответами"
-    handle_user_message(prompt, target_language, st.session_state.user["interface_language"], level)
-    record_study_session(st.session_state.user["id"], target_language, "grammar", 10, 5, 85)
+    """Начинает сессию по грамматике: объяснение и упражнения одним набором JSON"""
+    prompt = "Объясни грамматическую тему и дай практические упражнения"
+    queue_user_message(prompt, cacheable=True, exercise_kind="grammar")
 
 
 def start_conversation_session(target_language: str, level: str):
     """Начинает сессию разговорной практики"""
     prompt = "Начни диалог для практики разговорной речи. Задавай вопросы и жди моих ответов"
-    handle_user_message(prompt, target_language, st.session_state.user["interface_language"], level)
-    record_study_session(st.session_state.user["id"], target_language, "conversation", 15, 8, 90)
+    queue_user_message(prompt, cacheable=True, session=("conversation", 15, 8, 90))
 
 
 def start_vocabulary_session(target_language: str, level: str):
-    """Начинает сессию по изучению слов"""
-    prompt = "Представь 10 новых слов с переводами, примерами использования и упражнениями для запоминания"
-    handle_user_message(prompt, target_language, st.session_state.user["interface_language"], level)
-    record_study_session(st.session_state.user["id"], target_language, "vocabulary", 12, 10, 88)
+    """Начинает сессию по изучению слов: сначала повторение из словаря, новые слова - когда повторять нечего"""
+    user_id = st.session_state.user["id"]
+    vocabulary = get_vocabulary()
+    cards = vocabulary.due(user_id, target_language, datetime.now(timezone.utc))
+    if cards:
+        st.session_state.vocab_review = VocabularyReview(target_language, cards)
+        return
+    known_words = vocabulary.recent_words(user_id, target_language)
+    # Запрос со списком слов ученика уникален: в кэш идет только общий шаблон для пустого словаря
+    queue_user_message(vocabulary_prompt(known_words), cacheable=not known_words,
+                       session=("vocabulary", 12, VOCAB_NEW_WORDS, 88))
 
 
 def start_test_session(target_language: str, level: str):
-    """Начинает тестовую сессию"""
-    prompt = "Проведи небольшой тест из 5 вопросов по пройденному материалу. Задавай вопросы по одному и проверяй ответы"
-    handle_user_message(prompt, target_language, st.session_state.user["interface_language"], level)
-    record_study_session(st.session_state.user["id"], target_language, "test", 8, 5, 0)
+    """Начинает тестовую сессию: вопросы приходят одним набором, ответы проверяются локально"""
+    prompt = f"Проведи небольшой тест из {EXERCISE_QUESTIONS} вопросов"
+    queue_user_message(prompt, cacheable=True, exercise_kind="test")
 
 
+@timed_page
 def dashboard_page():
     """Главная панель управления"""
     st.title(f"Добро пожаловать, {st.session_state.user['username']}!")
 
     # Быстрая статистика
-    stats = st.session_state.stats.get_user_stats(st.session_state.user["id"])
-    streak = st.session_state.stats.get_streak(st.session_state.user["id"])
+    stats = get_stats_snapshot()
 
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Всего сессий", stats["total_sessions"])
+        st.metric("Всего сессий", stats.total_sessions)
     with col2:
-        st.metric("Время обучения", f"{stats['total_time']} мин")
+        st.metric("Время обучения", f"{stats.total_time} мин")
     with col3:
-        st.metric("Упражнения", stats["total_exercises"])
+        st.metric("Упражнения", stats.total_exercises)
     with col4:
-        st.metric("Дней подряд", streak)
+        st.metric("Дней подряд", stats.streak)
 
     # Основной интерфейс
     col_main, col_side = st.columns([2, 1])
@@ -713,46 +3657,64 @@ def dashboard_page():
         render_learning_interface()
 
 
+@timed_page
 def statistics_page():
     """Страница статистики"""
     st.title("📊 Ваша статистика")
 
-    stats = st.session_state.stats.get_user_stats(st.session_state.user["id"])
+    user_id = st.session_state.user["id"]
+    key, stats = get_analytics_engine().get(user_id)
+    figures = get_statistics_figures(key, stats)
 
     # Основные метрики
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader("Общая статистика")
-        st.metric("Всего времени", f"{stats['total_time']} минут")
-        st.metric("Сессий обучения", stats['total_sessions'])
-        st.metric("Упражнений выполнено", stats['total_exercises'])
-        st.metric("Средний балл", f"{stats['avg_score']:.1f}")
+        st.metric("Всего времени", f"{stats.total_time} минут")
+        st.metric("Сессий обучения", stats.total_sessions)
+        st.metric("Упражнений выполнено", stats.total_exercises)
+        st.metric("Средний балл", f"{stats.avg_score:.1f}")
 
     with col2:
         st.subheader("Прогресс по языкам")
-        for lang, sessions, time, exercises, score in stats['language_stats']:
-            st.write(f"{st.session_state.tutor.target_languages[lang]['flag']} "
-                     f"{st.session_state.tutor.target_languages[lang]['name']}: "
-                     f"{time} мин, {exercises} упр.")
+        language_labels = get_catalog().language_labels["russian"]
+        for row in stats.by_language.itertuples(index=False):
+            st.write(f"{language_labels[row.target_language]}: {row.time} мин, {row.exercises} упр.")
 
     # Графики
-    if stats['progress_data']:
-        st.subheader("Прогресс за 30 дней")
-        dates = [item[0] for item in stats['progress_data']]
-        times = [item[1] for item in stats['progress_data']]
+    if "daily" in figures:
+        st.subheader(f"Прогресс за {ANALYTICS_DAYS} дней")
+        st.plotly_chart(figures["daily"], width="stretch")
+
+    if "session_mix" in figures:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.subheader("Типы занятий")
+            st.plotly_chart(figures["session_mix"], width="stretch")
+        with col2:
+            st.subheader("По неделям")
+            st.plotly_chart(figures["weekly"], width="stretch")
+
+
+# Разделы для авторизованных пользователей: ключ -> (подпись, страница)
+PAGES = {
+    "learning": ("🎓 Обучение", dashboard_page),
+    "statistics": ("📊 Статистика", statistics_page),
+}
 
-        fig = go.Figure()
-        fig.add_trace(go.Scatter(x=dates, y=times, fill='tozeroy', name='Время обучения (мин)'))
-        fig.update_layout(title="Ежедневное время обучения", height=300)
-        st.plotly_chart(fig, use_container_width=True)
+
+def render_active_page():
+    """Переключатель разделов; в отличие от st.tabs выполняется только выбранная страница"""
+    page = st.radio("Раздел", list(PAGES), format_func=lambda key: PAGES[key][0], horizontal=True,
+                    key="active_page", label_visibility="collapsed")
+    PAGES[page][1]()
 
 
 def login_register_page():
     """Страница входа и регистрации"""
     # Логотип на странице входа
-    logo_html = get_logo_html()
-    st.markdown(logo_html, unsafe_allow_html=True)
+    st.markdown(get_static_assets().logo_html, unsafe_allow_html=True)
 
     st.markdown("### Изучайте языки с искусственным интеллектом как ваш личный репетитор!")
 
@@ -775,6 +3737,7 @@ def login_register_page():
                     st.error("Неверное имя пользователя или пароль")
 
     with tab2:
+        catalog = get_catalog()
         with st.form("register_form"):
             st.subheader("Регистрация")
             col1, col2 = st.columns(2)
@@ -784,9 +3747,8 @@ def login_register_page():
                 new_email = st.text_input("Email*")
                 native_language = st.selectbox(
                     "Родной язык*",
-                    options=list(st.session_state.tutor.target_languages.keys()),
-                    format_func=lambda
-                        x: f"{st.session_state.tutor.target_languages[x]['flag']} {st.session_state.tutor.target_languages[x]['name']}"
+                    options=list(catalog.target_languages),
+                    format_func=catalog.language_labels["russian"].__getitem__
                 )
 
             with col2:
@@ -794,9 +3756,8 @@ def login_register_page():
                 confirm_password = st.text_input("Подтвердите пароль*", type="password")
                 interface_language = st.selectbox(
                     "Язык интерфейса*",
-                    options=list(st.session_state.tutor.interface_languages.keys()),
-                    format_func=lambda
-                        x: f"{st.session_state.tutor.interface_languages[x]['emoji']} {st.session_state.tutor.interface_languages[x]['name']}"
+                    options=list(catalog.interface_languages),
+                    format_func=catalog.interface_label
                 )
 
             submitted = st.form_submit_button("Зарегистрироваться")
@@ -826,164 +3787,13 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    metrics = get_metrics()
+    metrics.inc("ferais_reruns_total")
+    metrics.start_trace()
+    rerun_start = time.perf_counter()
 
-    # CSS стили для всего приложения
-    st.markdown("""
-    <style>
-    /* Основные стили для кнопок */
-    .stButton button {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-        color: white !important;
-        border: none !important;
-        border-radius: 10px !important;
-        padding: 12px 24px !important;
-        font-weight: 600 !important;
-        transition: all 0.3s ease !important;
-        margin: 4px 0 !important;
-        width: 100% !important;
-    }
-
-    .stButton button:hover {
-        transform: translateY(-2px) !important;
-        box-shadow: 0 6px 20px rgba(102, 126, 234, 0.4) !important;
-    }
-
-
-
-    /* Стили для кнопок в формах */
-    .stForm button {
-        background: linear-gradient(135deg, #00b894 0%, #00a085 100%) !important;
-        color: white !important;
-        border-radius: 8px !important;
-        border: none !important;
-        padding: 14px 28px !important;
-        font-weight: bold !important;
-        font-size: 16px !important;
-    }
-
-    .stForm button:hover {
-        background: linear-gradient(135deg, #00a085 0%, #00b894 100%) !important;
-        transform: translateY(-2px) !important;
-        box-shadow: 0 4px 12px rgba(0, 184, 148, 0.4) !important;
-    }
-
-    /* Адаптивность для мобильных устройств */
-    @media (max-width: 768px) {
-        .stButton button {
-            padding: 14px 16px !important;
-            font-size: 14px !important;
-        }
-        .block-container {
-            padding-top: 1rem !important;
-            padding-bottom: 1rem !important;
-        }
-    }
-
-        /* Стили для карточки пользователя */
-    .user-card {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 1rem;
-        border-radius: 10px;
-        margin-bottom: 1.5rem;
-        color: white;
-        text-align: center;
-    }
-
-    .user-name {
-        font-size: 1.2rem;
-        font-weight: bold;
-    }
-
-    .user-status {
-        font-size: 0.8rem;
-        opacity: 0.9;
-    }
-
-
-    /* Стили для карточки прогресса */
-    .progress-card {
-        background: linear-gradient(135deg, #a8e6cf 0%, #dcedc1 100%);
-        padding: 1rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-        color: #2d3436;
-        text-align: center;
-        border: 1px solid var(--border-color);
-    }
-
-    .progress-title {
-        font-size: 0.9rem;
-        font-weight: bold;
-    }
-
-    .progress-stats {
-        font-size: 0.8rem;
-    }
-
-    /* Стили для логотипа и заголовка */
-    .sidebar-header {
-        text-align: center;
-        padding: 1rem 0;
-        border-bottom: 1px solid var(--border-color);
-        margin-bottom: 1.5rem;
-    }
-
-    .sidebar-logo-container {
-        margin-bottom: 0.5rem;
-        position: relative;
-    }
-
-    .sidebar-logo-img {
-        width: 80px;
-        height: 80px;
-        border-radius: 50%;
-        object-fit: cover;
-        border: 3px solid var(--accent-color);
-        box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-    }
-
-    .sidebar-logo-emoji {
-        font-size: 3rem;
-        margin-bottom: 0.5rem;
-    }
-
-    .sidebar-logo-fallback {
-        font-size: 3rem;
-        margin-bottom: 0.5rem;
-        display: none;
-    }
-
-    .sidebar-title {
-        font-size: 1.5rem;
-        font-weight: bold;
-        margin: 0;
-        color: var(--text-primary);
-    }
-
-    .sidebar-subtitle {
-        font-size: 0.9rem;
-        margin: 0.2rem 0 0 0;
-        color: var(--text-secondary);
-    }
-
-    /* Стили для метрик и карточек */
-    .stMetric {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-        color: white !important;
-        border-radius: 10px !important;
-        padding: 15px !important;
-    }
-
-    /* Стили для метрик - всегда белый текст */
-[data-testid="metric-container"] {
-    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-    border-radius: 10px !important;
-    padding: 15px !important;
-}
-
-
-    </style>
-    """, unsafe_allow_html=True)
+    # Стили приложения - ссылка на static/app.css, сам файл браузер берет из кэша
+    st.markdown(get_static_assets().styles_html, unsafe_allow_html=True)
 
     # Инициализация
     init_session_state()
@@ -998,14 +3808,11 @@ def main():
     if st.session_state.user is None:
         login_register_page()
     else:
-        # Вкладки для авторизованных пользователей
-        tab1, tab2 = st.tabs(["🎓 Обучение", "📊 Статистика"])
-
-        with tab1:
-            dashboard_page()
+        render_active_page()
 
-        with tab2:
-            statistics_page()
+    trace = metrics.finish_trace()
+    if st.session_state.user is not None and st.session_state.user["username"] in ADMIN_USERNAMES:
+        render_rerun_timings(trace, time.perf_counter() - rerun_start)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+"""Бенчмарк аналитики страницы статистики на пользователях с большой историей.
+
+Для каждого размера истории создает временную базу с одним пользователем
+(через seed_db, с теми же триггерами агрегатов, что и в приложении) и
+сравнивает AnalyticsEngine (колоночные выборки агрегатов + pandas) с тем же
+расчетом циклом Python по всем сессиям пользователя. Отдельно показано время
+выборки, расчета и повторного обращения из кэша версии данных; результаты
+обоих вариантов сверяются.
+
+    python benchmarks/bench_analytics.py [--sizes 1000,10000,100000,300000] [--days 730]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import ANALYTICS_DAYS, ANALYTICS_WEEKS, AnalyticsEngine, DatabaseManager, compute_analytics  # noqa: E402
+from seed_db import seed_sessions, seed_users  # noqa: E402
+
+
+def python_analytics(db: DatabaseManager, user_id: int, today) -> dict:
+    """Те же показатели построчным циклом - точка отсчета"""
+    with db.read() as conn:
+        rows = conn.execute('''
+            SELECT created_at, target_language, session_type, duration_minutes, exercises_completed, score
+            FROM study_sessions WHERE user_id = ?
+        ''', (user_id,)).fetchall()
+    first_day = today - timedelta(days=ANALYTICS_DAYS - 1)
+    languages = defaultdict(lambda: [0, 0, 0, 0.0, 0])
+    daily = defaultdict(int)
+    mix = Counter()
+    score_sum = scored = 0
+    for created_at, language, session_type, duration, exercises, score in rows:
+        lang = languages[language]
+        lang[0] += 1
+        lang[1] += duration
+        lang[2] += exercises
+        if score is not None:
+            lang[3] += score
+            lang[4] += 1
+            score_sum += score
+            scored += 1
+        day = datetime.strptime(created_at[:10], "%Y-%m-%d").date()
+        if day >= first_day:
+            daily[day] += duration
+        mix[session_type] += 1
+    series = [daily.get(first_day + timedelta(days=i), 0) for i in range(ANALYTICS_DAYS)]
+    return {"sessions": len(rows), "time": sum(lang[1] for lang in languages.values()),
+            "avg_score": score_sum / scored if scored else 0.0, "languages": dict(languages),
+            "daily": series, "mix": mix}
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000,300000", help="сессий у пользователя")
+    parser.add_argument("--days", type=int, default=730, help="за сколько дней история")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    logging.getLogger("ferais.slow_sql").disabled = True  # пачки seed_db заведомо медленные
+
+    print(f"{'сессий':>8}{'выборка':>10}{'расчет':>10}{'движок':>10}{'кэш':>10}{'цикл Python':>13}  мс")
+    for size in (int(value) for value in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseManager(os.path.join(tmp, "bench.db"), pool_size=1)
+            rng = random.Random(size)
+            languages = seed_users(db, 1, "bench", rng)
+            seed_sessions(db, languages, size, args.days, rng)
+            user_id = next(iter(languages))
+            today = datetime.now(timezone.utc).date()
+
+            engine = AnalyticsEngine(db)
+            since = (today - timedelta(days=7 * ANALYTICS_WEEKS)).isoformat()
+            rollups = engine.load_rollups(user_id, since)
+            fetch_ms = best_of(lambda: engine.load_rollups(user_id, since), args.repeat)
+            compute_ms = best_of(lambda: compute_analytics(rollups, today), args.repeat)
+
+            def cold():
+                db.bump_data_version(user_id)
+                return engine.get(user_id)[1]
+
+            engine_ms = best_of(cold, args.repeat)
+            cached_ms = best_of(lambda: engine.get(user_id)[1], args.repeat * 100)
+            python_ms = best_of(lambda: python_analytics(db, user_id, today), args.repeat)
+
+            # Результаты обоих вариантов должны совпадать
+            result, expected = engine.get(user_id)[1], python_analytics(db, user_id, today)
+            assert result.total_sessions == expected["sessions"] and result.total_time == expected["time"]
+            assert abs(result.avg_score - expected["avg_score"]) < 1e-6
+            assert result.daily["minutes"].tolist() == expected["daily"]
+            assert dict(zip(result.session_mix["session_type"], result.session_mix["sessions"])) == expected["mix"]
+            for row in result.by_language.itertuples(index=False):
+                assert expected["languages"][row.target_language][:3] == [row.sessions, row.time, row.exercises]
+            db.close()
+
+        print(f"{size:>8}{fetch_ms:>10.1f}{compute_ms:>10.1f}{engine_ms:>10.1f}{cached_ms:>10.3f}{python_ms:>13.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Бенчмарк перезапуска скрипта: обе вкладки st.tabs против только выбранного раздела.
+
+Раньше main() раскладывал страницы по st.tabs, и каждый перезапуск - в том
+числе каждое сообщение в чат - выполнял и статистику с ее SQL и графиками.
+Теперь выполняется только раздел из st.session_state.active_page. Бенчмарк
+гоняет через AppTest оба варианта раскладки над одной базой (seed_db, один
+ученик с длинной историей) в двух режимах:
+
+    без новых данных - обычный перезапуск раздела обучения;
+    после занятия    - перед каждым перезапуском записывается сессия (как после
+                       ответа репетитора), и кэши статистики устаревают.
+
+    python benchmarks/bench_page_rerun.py [--sessions 20000] [--reruns 30]
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+import streamlit as st
+import app
+
+app.init_session_state()
+{layout}
+"""
+LAYOUTS = {
+    "st.tabs (обе страницы)": """
+tab1, tab2 = st.tabs(["🎓 Обучение", "📊 Статистика"])
+with tab1:
+    app.dashboard_page()
+with tab2:
+    app.statistics_page()
+""",
+    "активный раздел": "app.render_active_page()",
+}
+
+
+def measure(at, reruns: int, before_rerun=None) -> list:
+    timings = []
+    for _ in range(reruns):
+        if before_rerun:
+            before_rerun()
+        start = time.perf_counter()
+        at.run()
+        timings.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return timings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20000, help="сессий в истории ученика")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--reruns", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    os.environ["LANGUAGE_TUTOR_DB"] = os.path.join(tmp, "bench.db")  # до импорта app
+    sys.path.insert(0, ROOT_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    from streamlit.testing.v1 import AppTest
+
+    import app
+    from seed_db import seed_sessions, seed_users
+
+    logging.getLogger("ferais.slow_sql").disabled = True
+    db = app.get_database()
+    rng = random.Random(1)
+    languages = seed_users(db, 1, "bench", rng)
+    seed_sessions(db, languages, args.sessions, args.days, rng)
+    user_id = next(iter(languages))
+    user = {"id": user_id, "username": "learner0", "interface_language": "russian"}
+
+    def record_session():
+        app.get_session_writer().enqueue(app.new_study_event(user_id, languages[user_id][0], *app.CHAT_TURN_SESSION))
+
+    print(f"{args.sessions} сессий в истории, {args.reruns} перезапусков раздела обучения")
+    print(f"{'раскладка':<26}{'режим':<20}{'p50, мс':>10}{'p95, мс':>10}")
+    for layout, code in LAYOUTS.items():
+        at = AppTest.from_string(SCRIPT.format(root=ROOT_DIR, layout=code), default_timeout=120)
+        at.session_state["user"] = user
+        measure(at, 3)  # прогрев: импорт, соединения, первый расчет статистики
+        for mode, hook in (("без новых данных", None), ("после занятия", record_session)):
+            timings = measure(at, args.reruns, hook)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            print(f"{layout:<26}{mode:<20}{statistics.median(timings):>10.1f}{p95:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
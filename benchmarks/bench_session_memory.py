@@ -0,0 +1,99 @@
+"""Бенчмарк памяти на сессию: свой LanguageTutor/UserStatistics в каждой сессии против общих объектов процесса.
+
+Раньше init_session_state клал в st.session_state новый LanguageTutor (со своими
+словарями ~85 языков, языков интерфейса и уровней) и UserStatistics. Теперь
+справочник - неизменяемый Catalog, а репетитор и статистика - одни на процесс.
+Бенчмарк создает N состояний сессий обоих видов и через tracemalloc считает
+байты на сессию, а также время подписей выпадающего списка языков за перезапуск.
+
+    python benchmarks/bench_session_memory.py [--sessions 2000] [--repeat 2000]
+"""
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+import uuid
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import (INTERFACE_LANGUAGES, LEVELS, TARGET_LANGUAGES, DatabaseManager, LanguageTutor,  # noqa: E402
+                 UserStatistics, build_catalog)
+
+
+class LegacyTutor(LanguageTutor):
+    """LanguageTutor в прежнем виде: справочники собираются в каждом экземпляре"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.target_languages = {key: {"name": name, "flag": flag, "code": code}
+                                 for key, name, flag, code in TARGET_LANGUAGES}
+        self.interface_languages = {key: {"name": name, "emoji": emoji} for key, name, emoji in INTERFACE_LANGUAGES}
+        self.levels = {key: {"name": name, "emoji": emoji} for key, name, emoji in LEVELS}
+
+
+def base_state() -> dict:
+    """То, что init_session_state хранит в любой сессии"""
+    return {"session_key": uuid.uuid4().hex, "user": None, "conversations": {},
+            "current_language": "english", "current_level": "beginner"}
+
+
+def bytes_per_session(make_state, sessions: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = [make_state() for _ in range(sessions)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del states
+    return (after - before) / sessions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=2000, help="перезапусков для замера подписей")
+    args = parser.parse_args(argv)
+
+    catalog = build_catalog()
+    db = DatabaseManager(":memory:", pool_size=1)
+    http = requests.Session()
+
+    def legacy_state():
+        state = base_state()
+        state["tutor"] = LegacyTutor("", session=http, catalog=catalog)
+        state["stats"] = UserStatistics(db)
+        return state
+
+    legacy = bytes_per_session(legacy_state, args.sessions)
+    shared = bytes_per_session(base_state, args.sessions)
+    print(f"{'вариант':<36}{'байт на сессию':>16}")
+    print(f"{'свой LanguageTutor + UserStatistics':<36}{legacy:>16,.0f}")
+    print(f"{'общие объекты процесса':<36}{shared:>16,.0f}")
+    print(f"Экономия: {legacy - shared:,.0f} байт на сессию, "
+          f"{(legacy - shared) * 10000 / 2 ** 20:,.1f} МБ на 10 000 сессий")
+
+    # Подписи всех языков в выпадающем списке: прежний format_func против готового словаря
+    tutor = LegacyTutor("", session=http, catalog=catalog)
+    keys = list(catalog.target_languages)
+
+    def legacy_labels():
+        return [f"{tutor.target_languages[x]['flag']} {tutor.target_languages[x]['name']}" for x in keys]
+
+    labels = catalog.language_labels["russian"]
+
+    def catalog_labels():
+        return [labels[x] for x in keys]
+
+    assert legacy_labels() == catalog_labels()
+    for name, func in (("format_func со сборкой строк", legacy_labels), ("готовые подписи Catalog", catalog_labels)):
+        seconds = min(timeit.repeat(func, number=args.repeat, repeat=5)) / args.repeat
+        print(f"{name:<36}{seconds * 1e6:>12.1f} мкс на перезапуск")
+
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
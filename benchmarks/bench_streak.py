@@ -0,0 +1,92 @@
+"""Бенчмарк чтения серии дней: UserStatistics.get_streak против прежнего запроса с LAG.
+
+Для каждого размера истории создается пользователь с N сессиями (по несколько
+в день, с пропусками), после чего замеряется медиана времени чтения серии.
+
+    python benchmarks/bench_streak.py [--sizes 10,100,1000,10000,100000] [--repeat 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import DatabaseManager, UserStatistics  # noqa: E402
+
+# Запрос get_streak до перехода на user_streaks - для сравнения
+LEGACY_STREAK_SQL = '''
+    WITH dates AS (
+        SELECT DISTINCT DATE(created_at) as study_date
+        FROM study_sessions
+        WHERE user_id = ?
+        ORDER BY study_date DESC
+    ),
+    streaks AS (
+        SELECT study_date,
+               JULIANDAY(study_date) - JULIANDAY(LAG(study_date, 1, study_date) OVER (ORDER BY study_date DESC)) as diff
+        FROM dates
+    )
+    SELECT COUNT(*) as streak
+    FROM streaks
+    WHERE diff = 1
+    ORDER BY study_date DESC
+    LIMIT 1
+'''
+
+
+def seed_user(db: DatabaseManager, user_id: int, sessions: int):
+    """Вставляет sessions сессий, ~5 в день, заканчивая сегодняшним днем"""
+    rng = random.Random(user_id)
+    days = max(1, sessions // 5)
+    rows = []
+    for _ in range(sessions):
+        day = rng.randint(0, days - 1)
+        rows.append((user_id, "english", "conversation", 3, 1, 0, f"-{day} days"))
+    rows.sort(key=lambda row: -int(row[-1][1:].split()[0]))  # в хронологическом порядке, как в проде
+    with db.write() as conn:
+        conn.executemany(
+            "INSERT INTO study_sessions (user_id, target_language, session_type, duration_minutes, "
+            "exercises_completed, score, created_at) VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))",
+            rows
+        )
+
+
+def median_us(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"))
+        stats = UserStatistics(db)
+        print(f"{'сессий':>8} {'get_streak, мкс':>16} {'LAG-запрос, мкс':>16}")
+        for user_id, size in enumerate(sizes, start=1):
+            seed_user(db, user_id, size)
+
+            def legacy():
+                with db.read() as conn:
+                    conn.execute(LEGACY_STREAK_SQL, (user_id,)).fetchone()
+
+            current = median_us(lambda: stats.get_streak(user_id), args.repeat)
+            old = median_us(legacy, max(1, args.repeat // 10))
+            print(f"{size:>8} {current:>16.1f} {old:>16.1f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Бенчмарк словаря с интервальными повторениями.
+
+Создает временную базу с users учениками (через seed_db) и cards карточками
+словаря на каждого, со сроками повторения в пределах ±60 дней от сегодня.
+Сравнивает выборку слов к повторению через VocabularyStore.due (диапазон
+индекса (user_id, target_language, due_at)) с тем же запросом без индекса и
+запись оценок пачкой (ReviewWriter, одна транзакция) с транзакцией на каждую
+оценку.
+
+    python benchmarks/bench_vocabulary.py [--users 200] [--cards 2000] [--queries 500]
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import (VOCAB_INITIAL_EASE, VOCAB_REVIEW_BATCH, DatabaseManager, ReviewWriter,  # noqa: E402
+                 VocabularyStore)
+from seed_db import seed_users  # noqa: E402
+
+
+def seed_vocabulary(db: DatabaseManager, languages: dict, cards: int, rng: random.Random):
+    """cards карточек на ученика, распределенных по его языкам"""
+    now = datetime.now(timezone.utc)
+    rows = []
+    for user_id, langs in languages.items():
+        for i in range(cards):
+            due_at = (now + timedelta(minutes=rng.randint(-60 * 24 * 60, 60 * 24 * 60))).strftime("%Y-%m-%d %H:%M:%S")
+            rows.append((user_id, langs[i % len(langs)], f"word{i}", f"слово{i}", VOCAB_INITIAL_EASE,
+                         rng.choice([1.0, 6.0, 15.0, 40.0]), due_at, due_at))
+    with db.write() as conn:
+        conn.executemany('''
+            INSERT INTO vocabulary (user_id, target_language, word, translation, ease, interval_days, due_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.execute("ANALYZE")
+
+
+def timings_ms(func, calls) -> list:
+    timings = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: list):
+    p95 = statistics.quantiles(timings, n=20)[-1]
+    print(f"{name:<40}{statistics.median(timings):>10.3f}{p95:>10.3f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--cards", type=int, default=2000, help="карточек на ученика")
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args(argv)
+    logging.getLogger("ferais.slow_sql").disabled = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"), pool_size=1)
+        writer = ReviewWriter(db, flush_interval_s=3600)  # сбрасывается только явно
+        store = VocabularyStore(db, writer)
+        rng = random.Random(1)
+        languages = seed_users(db, args.users, "bench", rng)
+        seed_vocabulary(db, languages, args.cards, rng)
+        now = datetime.now(timezone.utc)
+        calls = [(user_id, rng.choice(languages[user_id]), now)
+                 for user_id in rng.choices(list(languages), k=args.queries)]
+
+        def due_not_indexed(user_id: int, target_language: str, moment: datetime):
+            with db.read() as conn:
+                return conn.execute('''
+                    SELECT id, user_id, word, translation, example, ease, interval_days, repetitions, lapses, due_at
+                    FROM vocabulary NOT INDEXED
+                    WHERE user_id = ? AND target_language = ? AND due_at <= ?
+                    ORDER BY due_at LIMIT ?
+                ''', (user_id, target_language, moment.strftime("%Y-%m-%d %H:%M:%S"), VOCAB_REVIEW_BATCH)).fetchall()
+
+        print(f"{args.users * args.cards} карточек, {args.queries} выборок по {VOCAB_REVIEW_BATCH} слов")
+        print(f"{'операция':<40}{'p50, мс':>10}{'p95, мс':>10}")
+        report("due: индекс (user, язык, due_at)", timings_ms(store.due, calls))
+        report("due: без индекса", timings_ms(due_not_indexed, calls))
+        report("due_count", timings_ms(store.due_count, calls))
+
+        # Оценки одного повторения каждого ученика
+        batches = []
+        for user_id, target_language, _ in calls[:50]:
+            cards = store.due(user_id, target_language, now)
+            batches.append([store.review(card, rng.choice([1, 3, 4, 5]), now) for card in cards])
+            writer.flush()
+
+        def write_each(batch):
+            for review in batch:
+                db.update_vocabulary_reviews([review])
+
+        report("оценки повторения: пачкой", timings_ms(db.update_vocabulary_reviews, [(b,) for b in batches]))
+        report("оценки повторения: по одной", timings_ms(write_each, [(b,) for b in batches]))
+        writer.close()
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
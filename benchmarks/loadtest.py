@@ -0,0 +1,386 @@
+"""Нагрузочный прогон: много одновременных учеников против настоящего сервера streamlit.
+
+Драйвер запускает `streamlit run benchmarks/loadtest_app.py` (app.py с замерами
+loadtest_probe) и заглушку API (benchmarks/stub_server.py), затем открывает
+по websocket-сессии на каждого ученика и говорит с сервером на протоколе
+браузера: вход, затем случайная последовательность действий - вопрос в чат,
+быстрое действие, переход в раздел статистики. Перед чатом и быстрым действием
+ученик при необходимости возвращается в раздел обучения (действие nav).
+
+Замеряются:
+    rerun_ms             - каждый прогон скрипта (от начала до script_finished)
+    action_ms.<действие> - действие целиком, включая перезапуски (для чата - до готового ответа)
+    db_query_ms          - каждый запрос sqlite внутри сервера
+    api_first_token_ms   - ожидание первого токена от API
+    api_wait_ms          - полное ожидание ответа API
+
+База готовится benchmarks/seed_db.py. Результат - JSON с p50/p95/p99;
+с --baseline прогон сравнивается с прошлым и завершается с кодом 1 при росте p95.
+
+    python benchmarks/seed_db.py --db /tmp/load.db --users 1000 --sessions 1000000
+    python benchmarks/loadtest.py --db /tmp/load.db --users 500 --actions 10 --output result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from urllib.request import Request, urlopen
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.asyncio.client import connect as websocket_connect
+from websockets.exceptions import ConnectionClosed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest_probe import Recorder  # noqa: E402
+from stub_server import add_stub_arguments, start_stub_server, stub_config_from_args  # noqa: E402
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+QUICK_ACTION_KEYS = ["grammar_btn", "vocab_btn", "dialogue_btn", "test_btn"]
+LEARNING_PAGE, STATISTICS_PAGE = 0, 1  # порядок вариантов переключателя active_page
+CHAT_MESSAGES = [
+    "Как сказать «я люблю путешествовать»?",
+    "Объясни разницу между прошедшими временами",
+    "Проверь предложение: I have went to school",
+    "Дай пять новых слов по теме еда",
+    "Как вежливо попросить счет в ресторане?",
+]
+FINAL_STATUSES = {ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+                  getattr(ForwardMsg, "FINISHED_FRAGMENT_RUN_SUCCESSFULLY", ForwardMsg.FINISHED_SUCCESSFULLY)}
+
+
+class BrowserSession:
+    """Минимальный клиент протокола streamlit: отправляет перезапуски, собирает виджеты последнего прогона.
+
+    Как и браузер, перезапускает только фрагмент, которому принадлежат измененные
+    виджеты, и сам перезапускает фрагменты с run_every, пока сервер их не снимет.
+    """
+
+    def __init__(self, url: str, recorder: Recorder, timeout: float):
+        self.url = url
+        self.recorder = recorder
+        self.timeout = timeout
+        self.ws = None
+        self.widgets: List[tuple] = []  # (тип, proto) виджетов последнего прогона
+        self.fragment_ids: Dict[str, str] = {}  # id виджета -> id фрагмента, в котором он нарисован
+        self.auto_reruns: Dict[str, float] = {}  # id фрагмента -> интервал run_every, секунд
+        self.exceptions: List[str] = []
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, max_size=64 * 1024 * 1024)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def rerun(self, action: str, states: List[WidgetState] = ()):
+        """Перезапуск с заданными состояниями виджетов; ждет, пока сервер не закончит все прогоны"""
+        fragments = {self.fragment_ids.get(state.id, "") for state in states}
+        start = time.perf_counter()
+        await self._send(states, fragments.pop() if len(fragments) == 1 else "")
+        await asyncio.wait_for(self._settle(), self.timeout)
+        self.recorder.add(f"action_ms.{action}", (time.perf_counter() - start) * 1000)
+        if self.exceptions:
+            raise RuntimeError(f"{action}: {self.exceptions[0]}")
+
+    async def _send(self, states: List[WidgetState], fragment_id: str = "", auto: bool = False):
+        msg = BackMsg()
+        msg.rerun_script.widget_states.widgets.extend(states)
+        if fragment_id:
+            msg.rerun_script.fragment_id = fragment_id
+            msg.rerun_script.is_auto_rerun = auto
+        await self.ws.send(msg.SerializeToString())
+
+    async def _settle(self):
+        await self._read_until_finished()
+        while self.auto_reruns:
+            fragment_id, interval = min(self.auto_reruns.items(), key=lambda item: item[1])
+            await asyncio.sleep(interval)
+            await self._send((), fragment_id, auto=True)
+            await self._read_until_finished()
+
+    async def _read_until_finished(self):
+        run_start = time.perf_counter()
+        while True:
+            try:
+                data = await self.ws.recv()
+            except ConnectionClosed as e:
+                raise ConnectionError("сервер закрыл соединение") from e
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                run_start = time.perf_counter()
+                if not getattr(msg.new_session, "fragment_ids_this_run", None):  # прогон всего скрипта
+                    self.widgets, self.exceptions, self.auto_reruns = [], [], {}
+            elif kind == "auto_rerun":
+                self.auto_reruns[msg.auto_rerun.fragment_id] = msg.auto_rerun.interval
+            elif kind == "stop_auto_rerun":
+                for fragment_id in msg.stop_auto_rerun.fragment_ids:
+                    self.auto_reruns.pop(fragment_id, None)
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type == "exception":
+                    self.exceptions.append(element.exception.message)
+                elif element_type:
+                    proto = getattr(element, element_type)
+                    self.widgets.append((element_type, proto))
+                    if getattr(proto, "id", None):
+                        self.fragment_ids[proto.id] = getattr(msg.delta, "fragment_id", "")
+            elif kind == "script_finished":
+                self.recorder.add("rerun_ms", (time.perf_counter() - run_start) * 1000)
+                if msg.script_finished in FINAL_STATUSES:
+                    return
+
+    def widget(self, element_type: str, label: str = None, key: str = None):
+        for kind, proto in reversed(self.widgets):  # прогоны фрагментов дописывают свежие копии
+            if kind != element_type:
+                continue
+            if label is not None and getattr(proto, "label", None) != label:
+                continue
+            if key is not None and not proto.id.endswith(f"-{key}"):
+                continue
+            return proto
+        raise LookupError(f"нет виджета {element_type} {label or key or ''}")
+
+    def has_widget(self, element_type: str, label: str = None, key: str = None) -> bool:
+        try:
+            self.widget(element_type, label, key)
+        except LookupError:
+            return False
+        return True
+
+
+def text_state(widget_id: str, value: str) -> WidgetState:
+    return WidgetState(id=widget_id, string_value=value)
+
+
+def trigger_state(widget_id: str) -> WidgetState:
+    return WidgetState(id=widget_id, trigger_value=True)
+
+
+def page_state(radio, index: int) -> WidgetState:
+    if "raw_value" in radio.DESCRIPTOR.fields_by_name:  # streamlit >= 1.50: подпись варианта
+        return WidgetState(id=radio.id, string_value=radio.options[index])
+    return WidgetState(id=radio.id, int_value=index)
+
+
+def chat_state(widget_id: str, text: str) -> WidgetState:
+    state = WidgetState(id=widget_id)
+    if "chat_input_value" in WidgetState.DESCRIPTOR.fields_by_name:
+        state.chat_input_value.data = text
+    else:  # streamlit < 1.44
+        state.string_trigger_value.data = text
+    return state
+
+
+async def simulate_user(username: str, args, url: str, recorder: Recorder, rng: random.Random):
+    session = BrowserSession(url, recorder, args.timeout)
+    await session.connect()
+    try:
+        await session.rerun("open")
+        await session.rerun("login", [
+            text_state(session.widget("text_input", label="Имя пользователя").id, username),
+            text_state(session.widget("text_input", label="Пароль").id, args.password),
+            trigger_state(session.widget("button", label="Войти").id),
+        ])
+        session.widget("button", key="logout_btn")  # вход удался
+
+        actions, weights = zip(*args.mix.items())
+        for _ in range(args.actions):
+            await asyncio.sleep(rng.uniform(0, args.think_ms / 1000))
+            action = rng.choices(actions, weights=weights)[0]
+            if action in ("chat", "quick") and not session.has_widget("chat_input"):
+                await session.rerun("nav", [page_state(session.widget("radio", key="active_page"), LEARNING_PAGE)])
+            if action == "chat":
+                states = [chat_state(session.widget("chat_input").id, rng.choice(CHAT_MESSAGES))]
+            elif action == "quick":
+                states = [trigger_state(session.widget("button", key=rng.choice(QUICK_ACTION_KEYS)).id)]
+            else:
+                states = [page_state(session.widget("radio", key="active_page"), STATISTICS_PAGE)]
+            await session.rerun(action, states)
+    finally:
+        await session.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app_server(args, api_url: str, port: int, probe_port: int) -> subprocess.Popen:
+    env = dict(os.environ, DEEPSEEK_API_URL=api_url, LANGUAGE_TUTOR_DB=os.path.abspath(args.db),
+               LOADTEST_PROBE_PORT=str(probe_port))
+    env.setdefault("DEEPSEEK_API_KEY", "loadtest")
+    return subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(BENCHMARKS_DIR, "loadtest_app.py"),
+         "--server.port", str(port), "--server.headless", "true", "--server.fileWatcherType", "none",
+         "--browser.gatherUsageStats", "false", "--logger.level", "error"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE if args.quiet else None
+    )
+
+
+def wait_for_server(port: int, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Сервер streamlit завершился с кодом {process.returncode}")
+        try:
+            with urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit("Сервер streamlit не поднялся")
+
+
+def probe_request(port: int, method: str = "GET") -> Dict[str, dict]:
+    with urlopen(Request(f"http://127.0.0.1:{port}/", method=method), timeout=10) as response:
+        return json.load(response)
+
+
+def load_usernames(db_path: str, count: int) -> List[str]:
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT username FROM users WHERE username LIKE 'learner%' ORDER BY id LIMIT ?",
+                            (count,)).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise SystemExit(f"В {db_path} нет пользователей learner*: подготовьте базу benchmarks/seed_db.py")
+    return [row[0] for row in rows]
+
+
+def compare(summary: dict, baseline_path: str, max_regression: float) -> List[str]:
+    """Метрики, у которых p95 вырос больше чем на max_regression относительно базового прогона"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["summary"]
+    regressions = []
+    for metric, stats in summary.items():
+        before = baseline.get(metric, {}).get("p95")
+        if before and stats["p95"] > before * (1 + max_regression):
+            regressions.append(f"{metric}: p95 {before:.1f} -> {stats['p95']:.1f} мс")
+    return regressions
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("chat", "quick", "stats"):
+            raise argparse.ArgumentTypeError(f"неизвестное действие: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run_users(args, url: str, usernames: List[str], recorder: Recorder) -> List[str]:
+    errors = []
+
+    async def user(index: int):
+        rng = random.Random(args.seed * 100003 + index)
+        await asyncio.sleep(args.ramp_s * index / max(args.users, 1))
+        username = usernames[index % len(usernames)]
+        try:
+            await simulate_user(username, args, url, recorder, rng)
+        except Exception as e:
+            errors.append(f"{username}: {type(e).__name__}: {e}")
+
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    return errors
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="база, подготовленная seed_db.py")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--users", type=int, default=50, help="одновременных учеников")
+    parser.add_argument("--actions", type=int, default=10, help="действий на ученика после входа")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=5,quick=2,stats=3"),
+                        help="веса действий, например chat=5,quick=2,stats=3")
+    parser.add_argument("--think-ms", type=float, default=1000, help="верхняя граница паузы между действиями")
+    parser.add_argument("--ramp-s", type=float, default=10, help="за сколько секунд подключаются все ученики")
+    parser.add_argument("--timeout", type=float, default=300, help="предел одного действия, секунд")
+    parser.add_argument("--api-url", help="внешний API вместо встроенной заглушки")
+    parser.add_argument("--app-url", help="уже запущенный loadtest_app.py (host:port) вместо нового сервера")
+    parser.add_argument("--probe-port", type=int, help="порт loadtest_probe уже запущенного сервера")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда записать JSON с результатом")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустимый рост p95 (доля)")
+    parser.add_argument("--quiet", action="store_true", help="не показывать вывод сервера")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    usernames = load_usernames(args.db, args.users)
+    stub = start_stub_server(stub_config_from_args(args)) if args.api_url is None and args.app_url is None else None
+    server: Optional[subprocess.Popen] = None
+    if args.app_url:
+        app_address, probe_port = args.app_url, args.probe_port
+    else:
+        port, probe_port = free_port(), free_port()
+        server = start_app_server(args, args.api_url or stub.url, port, probe_port)
+        app_address = f"127.0.0.1:{port}"
+
+    recorder = Recorder()
+    try:
+        if server is not None:
+            wait_for_server(port, server)
+        started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        start = time.perf_counter()
+        errors = asyncio.run(run_users(args, f"ws://{app_address}/_stcore/stream", usernames, recorder))
+        elapsed = time.perf_counter() - start
+        summary = recorder.summary()
+        if probe_port:
+            summary.update(probe_request(probe_port))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if stub is not None:
+            stub.shutdown()
+
+    actions = sum(stats["count"] for metric, stats in summary.items() if metric.startswith("action_ms."))
+    result = {
+        "started_at": started_at,
+        "config": {"users": args.users, "actions": args.actions, "mix": args.mix, "think_ms": args.think_ms,
+                   "api": args.api_url or ("stub" if stub else "external"), "db": args.db},
+        "elapsed_s": round(elapsed, 3),
+        "actions_per_s": round(actions / elapsed, 3) if elapsed else 0.0,
+        "summary": summary,
+        "errors": errors,
+        "stub": stub.stats.as_dict() if stub else None,
+    }
+
+    print(f"{args.users} учеников, {actions} действий за {elapsed:.1f} с, ошибок: {len(errors)}")
+    print(f"{'метрика':<28}{'n':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for metric, stats in summary.items():
+        print(f"{metric:<28}{stats['count']:>8}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}")
+    for message in errors[:10]:
+        print("Ошибка:", message)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        regressions = compare(summary, args.baseline, args.max_regression)
+        for line in regressions:
+            print("Регрессия:", line)
+        if regressions:
+            return 1
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""Точка входа streamlit для нагрузочного прогона: app.py с замерами loadtest_probe.
+
+    LOADTEST_PROBE_PORT=8766 streamlit run benchmarks/loadtest_app.py
+"""
+import os
+import runpy
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import loadtest_probe  # noqa: E402,F401 - модуль кэшируется, замеры ставятся один раз на процесс
+
+runpy.run_path(os.path.join(os.path.dirname(BENCHMARKS_DIR), "app.py"), run_name="__main__")
@@ -0,0 +1,129 @@
+"""Замеры внутри процесса приложения для нагрузочного прогона.
+
+Импортируется из benchmarks/loadtest_app.py один раз на процесс. Подменяет
+фабрику соединений sqlite3.connect, чтобы засекать каждый запрос, и собирает
+время ответов API из журнала приложения ("Ответ получен: ..."). Сводка
+отдается по HTTP на порту LOADTEST_PROBE_PORT: GET / - p50/p95/p99 по
+метрикам, POST /reset - сброс (например, после прогрева).
+"""
+import functools
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+REPLY_LOG_PREFIX = "Ответ получен"
+
+
+class Recorder:
+    """Потокобезопасный сбор замеров: метрика -> список значений в мс"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def add(self, metric: str, ms: float):
+        with self._lock:
+            self.samples[metric].append(ms)
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            return {metric: percentiles(values) for metric, values in sorted(self.samples.items())}
+
+
+def percentiles(values: List[float]) -> dict:
+    """count/mean/p50/p95/p99/max для списка замеров"""
+    if len(values) < 2:
+        value = round(values[0], 3) if values else 0.0
+        return {"count": len(values), "mean": value, "p50": value, "p95": value, "p99": value, "max": value}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"count": len(values), "mean": round(statistics.fmean(values), 3), "p50": round(cuts[49], 3),
+            "p95": round(cuts[94], 3), "p99": round(cuts[98], 3), "max": round(max(values), 3)}
+
+
+def instrument_sqlite(recorder: Recorder):
+    """Все новые соединения sqlite3 засекают execute/executemany (поверх фабрики, переданной приложением)"""
+
+    @functools.lru_cache(maxsize=None)
+    def timed_factory(base: type) -> type:
+        def execute(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return base.execute(self, *args, **kwargs)
+            finally:
+                recorder.add("db_query_ms", (time.perf_counter() - start) * 1000)
+
+        def executemany(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return base.executemany(self, *args, **kwargs)
+            finally:
+                recorder.add("db_query_ms", (time.perf_counter() - start) * 1000)
+
+        return type(f"Timed{base.__name__}", (base,), {"execute": execute, "executemany": executemany})
+
+    connect = sqlite3.connect
+
+    def timed_connect(*args, **kwargs):
+        kwargs["factory"] = timed_factory(kwargs.get("factory", sqlite3.Connection))
+        return connect(*args, **kwargs)
+
+    sqlite3.connect = timed_connect
+
+
+class ReplyTimingHandler(logging.Handler):
+    """Время ответа API из журнала приложения"""
+
+    def __init__(self, recorder: Recorder):
+        super().__init__(logging.INFO)
+        self.recorder = recorder
+
+    def emit(self, record: logging.LogRecord):
+        if isinstance(record.msg, str) and record.msg.startswith(REPLY_LOG_PREFIX):
+            first_token_s, total_s = record.args
+            self.recorder.add("api_first_token_ms", first_token_s * 1000)
+            self.recorder.add("api_wait_ms", total_s * 1000)
+
+
+def serve(recorder: Recorder, port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._reply(recorder.summary())
+
+        def do_POST(self):
+            recorder.reset()
+            self._reply({})
+
+        def _reply(self, data: dict):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="loadtest-probe", daemon=True).start()
+    return server
+
+
+recorder = Recorder()
+instrument_sqlite(recorder)
+app_logger = logging.getLogger("ferais")
+app_logger.setLevel(logging.INFO)
+app_logger.addHandler(ReplyTimingHandler(recorder))
+if os.environ.get("LOADTEST_PROBE_PORT"):
+    serve(recorder, int(os.environ["LOADTEST_PROBE_PORT"]))
@@ -0,0 +1,115 @@
+"""Генератор тестовой базы для нагрузочных замеров.
+
+Создает пользователей learner0..learnerN-1 (пароль одинаковый, см. --password),
+языки изучения и историю study_sessions за заданное число дней. Сессии пишутся
+в хронологическом порядке через DatabaseManager.add_study_sessions, поэтому
+агрегаты и серии дней заполняют те же триггеры, что и в приложении.
+
+    python benchmarks/seed_db.py --db /tmp/load.db --users 5000 --sessions 2000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import LEVELS, DatabaseManager, StudyEvent, hash_password  # noqa: E402
+
+LANGUAGES = ["english", "spanish", "french", "german", "italian", "chinese", "japanese", "korean"]
+SESSION_TYPES = [
+    # (тип, минуты, упражнения, балл, вес)
+    ("conversation", 3, 1, 0, 50),
+    ("grammar", 10, 5, 85, 15),
+    ("conversation", 15, 8, 90, 10),
+    ("vocabulary", 12, 10, 88, 15),
+    ("test", 8, 5, 0, 10),
+]
+BATCH_SIZE = 20000
+
+
+def seed_users(db: DatabaseManager, users: int, password: str, rng: random.Random) -> dict:
+    """Создает пользователей и их языки; возвращает user_id -> список языков"""
+    password_hash = hash_password(password)
+    with db.write() as conn:
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO users (id, username, email, password_hash, native_language) VALUES (?, ?, ?, ?, 'russian')",
+            [(start + i + 1, f"learner{start + i}", f"learner{start + i}@example.com", password_hash)
+             for i in range(users)]
+        )
+        languages = {start + i + 1: rng.sample(LANGUAGES, rng.choice([1, 1, 2, 3])) for i in range(users)}
+        conn.executemany(
+            "INSERT OR IGNORE INTO user_languages (user_id, target_language, level) VALUES (?, ?, ?)",
+            [(user_id, language, rng.choice(LEVELS)[0]) for user_id, langs in languages.items() for language in langs]
+        )
+    return languages
+
+
+def seed_sessions(db: DatabaseManager, languages: dict, sessions: int, days: int, rng: random.Random) -> int:
+    """Распределяет sessions сессий по дням и пользователям, вставляет пачками в хронологическом порядке"""
+    user_ids = list(languages)
+    # Активность пользователей неравномерна: немногие занимаются почти каждый день
+    activity = [rng.paretovariate(1.5) for _ in user_ids]
+    kinds = [kind[:4] for kind in SESSION_TYPES]
+    weights = [kind[4] for kind in SESSION_TYPES]
+    # Поровну на каждый из days + 1 дней (включая сегодня), остаток - последним дням
+    per_day, extra = divmod(sessions, days + 1)
+    now = datetime.now(timezone.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    written = 0
+    batch = []
+    for day in range(days, -1, -1):
+        count = per_day + (1 if day < extra else 0)
+        date = today - timedelta(days=day)
+        span = 86400 if day else max(1, int((now - today).total_seconds()))  # сегодня - без будущего
+        offsets = sorted(rng.randrange(span) for _ in range(count))
+        for user_id, offset in zip(rng.choices(user_ids, weights=activity, k=count), offsets):
+            session_type, duration, exercises, score = rng.choices(kinds, weights=weights)[0]
+            created_at = (date + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S")
+            batch.append(StudyEvent(user_id, rng.choice(languages[user_id]), session_type,
+                                    duration, exercises, score, created_at))
+        if len(batch) >= BATCH_SIZE:
+            db.add_study_sessions(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        db.add_study_sessions(batch)
+        written += len(batch)
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="путь к создаваемой базе")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=100000, help="всего строк study_sessions")
+    parser.add_argument("--days", type=int, default=365, help="глубина истории в днях")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verify", action="store_true", help="сверить агрегаты с сырыми данными")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    db = DatabaseManager(args.db)
+    try:
+        start = time.perf_counter()
+        languages = seed_users(db, args.users, args.password, rng)
+        written = seed_sessions(db, languages, args.sessions, args.days, rng)
+        elapsed = time.perf_counter() - start
+        print(f"Пользователей: {len(languages)}, сессий: {written}, {elapsed:.1f} с "
+              f"({written / max(elapsed, 1e-9):,.0f} строк/с)")
+        if args.verify:
+            mismatches = db.verify_rollups()
+            print("Агрегаты:", "OK" if not any(mismatches.values()) else mismatches)
+            return 0 if not any(mismatches.values()) else 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""Локальная заглушка DeepSeek API для нагрузочных замеров.
+
+Реализует POST /v1/chat/completions в том объеме, который использует
+LanguageTutor: обычный ответ и поток SSE (stream=true) с usage в последнем
+фрагменте. Как и DeepSeek, заглушка кэширует префиксы промпта блоками по
+64 токена и возвращает prompt_cache_hit_tokens/prompt_cache_miss_tokens.
+На запросы в режиме JSON (response_format json_object) отвечает набором
+упражнений или вердиктом проверки ответа.
+Задержка до первого токена берется из выбранного распределения,
+часть запросов завершается ошибкой 429/5xx (с Retry-After для 429).
+GET /stats возвращает счетчики запросов в JSON.
+
+    python benchmarks/stub_server.py --port 8765 --latency lognormal --latency-ms 800 --error-rate 0.02
+    DEEPSEEK_API_URL=http://127.0.0.1:8765/v1/chat/completions streamlit run app.py
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+CHAT_PATH = "/v1/chat/completions"
+PREFIX_BLOCK_CHARS = 256  # ~64 токена - единица кэша префиксов
+EXERCISE_SET = {
+    "topic": "Present Simple",
+    "explanation": "Глагол в 3-м лице единственного числа получает окончание **-s**.",
+    "questions": [
+        {"question": "She ___ (work) in a bank.", "options": [], "answers": ["works"], "explanation": "she - 3-е лицо"},
+        {"question": "Выберите форму: They ___ tea.", "options": ["drink", "drinks"], "answers": ["drink"],
+         "explanation": "they - множественное число"},
+        {"question": "Переведите: Я люблю читать.", "options": [], "answers": ["I like reading", "I love reading"],
+         "explanation": "like/love + -ing", "free_text": True},
+    ],
+}
+ANSWER_VERDICT = {"correct": True, "comment": "Ответ верный по смыслу."}
+REPLY_WORDS = ("Отлично! Давайте разберем это подробнее. Обратите внимание на порядок слов "
+               "и на время глагола. Попробуйте составить еще одно предложение.").split()
+
+
+@dataclass
+class StubConfig:
+    latency: str = "lognormal"  # fixed | uniform | lognormal - задержка до первого токена
+    latency_ms: float = 800.0  # для fixed - значение, uniform - верхняя граница, lognormal - медиана
+    latency_sigma: float = 0.5  # разброс lognormal
+    token_ms: float = 20.0  # пауза между фрагментами потока
+    tokens: int = 40  # фрагментов в ответе
+    error_rate: float = 0.0  # доля запросов, завершающихся ошибкой
+    error_statuses: Tuple[int, ...] = (429, 500, 503)
+    retry_after_s: int = 1
+
+    def first_token_delay(self, rng: random.Random) -> float:
+        if self.latency == "fixed":
+            return self.latency_ms / 1000
+        if self.latency == "uniform":
+            return rng.uniform(0, self.latency_ms) / 1000
+        return rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+
+class StubStats:
+    """Счетчики заглушки (ответы по статусам, потоковые запросы, токены промпта)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.streamed = 0
+        self.statuses = {}
+        self.prompt_tokens = 0
+        self.cache_hit_tokens = 0
+        self._prefixes = set()  # хэши уже виденных префиксов, кратных блоку
+
+    def cached_prefix_tokens(self, prompt: str) -> int:
+        """Сколько токенов с начала промпта уже встречались (целыми блоками); запоминает новые блоки"""
+        hit_blocks, prefix_hash, cached = 0, 0, True
+        with self._lock:
+            for end in range(PREFIX_BLOCK_CHARS, len(prompt) + 1, PREFIX_BLOCK_CHARS):
+                prefix_hash = hash((prefix_hash, prompt[end - PREFIX_BLOCK_CHARS:end]))
+                if cached and prefix_hash in self._prefixes:
+                    hit_blocks += 1
+                else:
+                    cached = False
+                    self._prefixes.add(prefix_hash)
+        return hit_blocks * PREFIX_BLOCK_CHARS // 4
+
+    def record(self, status: int, stream: bool, prompt_tokens: int, cache_hit_tokens: int = 0):
+        with self._lock:
+            self.requests += 1
+            self.streamed += stream
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.prompt_tokens += prompt_tokens
+            self.cache_hit_tokens += cache_hit_tokens
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "streamed": self.streamed,
+                    "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+                    "prompt_tokens": self.prompt_tokens, "cache_hit_tokens": self.cache_hit_tokens}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        self._send_json(200, {"config": asdict(self.server.config), "stats": self.server.stats.as_dict()})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path != CHAT_PATH:
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        try:
+            payload = json.loads(body)
+            messages = payload["messages"]
+        except (ValueError, KeyError):
+            self._send_json(400, {"error": {"message": "invalid request"}})
+            return
+
+        config, rng = self.server.config, random.Random()
+        stream = bool(payload.get("stream"))
+        prompt = "".join(f"{msg.get('role')}:{msg.get('content', '')}\n" for msg in messages)
+        prompt_tokens = len(prompt) // 4
+        time.sleep(config.first_token_delay(rng))
+
+        if rng.random() < config.error_rate:
+            status = rng.choice(config.error_statuses)
+            self.server.stats.record(status, stream, prompt_tokens)
+            headers = {"Retry-After": str(config.retry_after_s)} if status == 429 else {}
+            self._send_json(status, {"error": {"message": "injected failure"}}, headers)
+            return
+
+        words = [rng.choice(REPLY_WORDS) for _ in range(config.tokens)]
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            verdict = "Ответ ученика" in messages[-1].get("content", "")
+            words = [json.dumps(ANSWER_VERDICT if verdict else EXERCISE_SET, ensure_ascii=False)]
+        hit_tokens = min(self.server.stats.cached_prefix_tokens(prompt), prompt_tokens)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                 "total_tokens": prompt_tokens + len(words),
+                 "prompt_cache_hit_tokens": hit_tokens, "prompt_cache_miss_tokens": prompt_tokens - hit_tokens}
+        self.server.stats.record(200, stream, prompt_tokens, hit_tokens)
+        if stream:
+            self._send_stream(words, usage, config.token_ms / 1000)
+        else:
+            time.sleep(config.token_ms / 1000 * len(words))
+            self._send_json(200, {"choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                                               "finish_reason": "stop"}], "usage": usage})
+
+    def _send_json(self, status: int, data: dict, headers: dict = None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, words, usage: dict, pause: float):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(pause)
+            self._write_event({"choices": [{"index": 0, "delta": {"content": word + " "}}]})
+        self._write_event({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, data: dict):
+        self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StubConfig):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.stats = StubStats()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{CHAT_PATH}"
+
+
+def start_stub_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> StubServer:
+    """Запускает заглушку в фоновом потоке (port=0 - свободный порт)"""
+    server = StubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="stub-api", daemon=True).start()
+    return server
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    defaults = StubConfig()
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default=defaults.latency)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms,
+                        help="fixed - значение, uniform - верхняя граница, lognormal - медиана")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--token-ms", type=float, default=defaults.token_ms, help="пауза между фрагментами потока")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="фрагментов в ответе")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-statuses", default=",".join(map(str, defaults.error_statuses)))
+
+
+def stub_config_from_args(args) -> StubConfig:
+    return StubConfig(latency=args.latency, latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                      token_ms=args.token_ms, tokens=args.tokens, error_rate=args.error_rate,
+                      error_statuses=tuple(int(s) for s in args.error_statuses.split(",") if s))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = StubServer((args.host, args.port), stub_config_from_args(args))
+    print(f"Заглушка API: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
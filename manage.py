@@ -0,0 +1,74 @@
+"""Служебные команды обслуживания базы данных репетитора.
+
+Примеры:
+    python manage.py migrate
+    python manage.py rebuild-rollups
+    python manage.py check-rollups
+    python manage.py usage-report --days 7
+"""
+import argparse
+import sys
+
+from app import DATABASE_PATH, USAGE_REPORT_DAYS, DatabaseManager, UsageReport
+
+
+def cmd_migrate(db: DatabaseManager, args) -> int:
+    """Применяет миграции (они же выполняются при старте приложения)"""
+    print(f"Версия схемы: {db.schema_version()}")
+    return 0
+
+
+def cmd_check_rollups(db: DatabaseManager, args) -> int:
+    """Сверяет агрегаты с сырыми данными"""
+    mismatches = db.verify_rollups()
+    for table, diff in mismatches.items():
+        status = "OK" if diff == 0 else f"расхождений: {diff}"
+        print(f"{table}: {status}")
+    return 0 if not any(mismatches.values()) else 1
+
+
+def cmd_rebuild_rollups(db: DatabaseManager, args) -> int:
+    """Пересчитывает агрегаты и проверяет результат"""
+    db.rebuild_rollups()
+    print("Агрегаты пересчитаны")
+    return cmd_check_rollups(db, args)
+
+
+def cmd_usage_report(db: DatabaseManager, args) -> int:
+    """Сводки журнала использования API: расход по пользователям, рост промпта, задержки"""
+    report = UsageReport(db)
+    sections = (
+        ("Пользователи по расходу токенов", report.heaviest_users(args.days)),
+        ("Токены по номеру реплики", report.tokens_by_turn(args.days)),
+        ("Задержка по типам сессий", report.latency_by_session_type(args.days)),
+    )
+    for title, frame in sections:
+        print(f"\n{title} (за {args.days} дн.):")
+        print(frame.to_string(index=False) if not frame.empty else "  нет данных")
+    return 0
+
+
+COMMANDS = {
+    "migrate": cmd_migrate,
+    "check-rollups": cmd_check_rollups,
+    "rebuild-rollups": cmd_rebuild_rollups,
+    "usage-report": cmd_usage_report,
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=COMMANDS.keys())
+    parser.add_argument("--db", default=DATABASE_PATH, help="путь к файлу базы данных")
+    parser.add_argument("--days", type=int, default=USAGE_REPORT_DAYS, help="окно для usage-report")
+    args = parser.parse_args(argv)
+
+    db = DatabaseManager(args.db)
+    try:
+        return COMMANDS[args.command](db, args)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import DatabaseManager, StudyEvent  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "tutor.db")
+
+
+@pytest.fixture
+def db(db_path):
+    manager = DatabaseManager(db_path, pool_size=2)
+    yield manager
+    manager.close()
+
+
+def study_event(day: str, user_id: int = 1, target_language: str = "english", session_type: str = "conversation",
+                duration: int = 10, exercises: int = 2, score: int = 80) -> StudyEvent:
+    return StudyEvent(user_id, target_language, session_type, duration, exercises, score, f"{day} 12:00:00")
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from app import AdmissionController
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("условие не выполнилось вовремя")
+        time.sleep(0.005)
+
+
+class Requests:
+    """Запросы в потоках: каждый ставится в очередь строго после предыдущего"""
+
+    def __init__(self, admission: AdmissionController):
+        self.admission = admission
+        self.order = []
+        self.release = threading.Event()
+        self.threads = []
+
+    def start(self, user_id: int, hold: bool = False):
+        queued = self.admission.queue_depth
+
+        def run():
+            with self.admission.admit(user_id):
+                self.order.append(user_id)
+                if hold:
+                    self.release.wait(5)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        if hold:
+            wait_until(lambda: self.order == [user_id])
+        else:
+            wait_until(lambda: self.admission.queue_depth == queued + 1)
+
+    def finish(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join(5)
+
+
+@pytest.fixture
+def requests_in_queue():
+    admission = AdmissionController(max_concurrent=1, rate_per_s=0)
+    requests = Requests(admission)
+    requests.start(0, hold=True)  # занимает единственный слот, остальные ждут
+    yield requests
+    requests.finish()
+
+
+def test_users_are_served_round_robin(requests_in_queue):
+    for user_id in (1, 1, 1, 2, 3):
+        requests_in_queue.start(user_id)
+    requests_in_queue.finish()
+    assert requests_in_queue.order == [0, 1, 2, 3, 1, 1]
+
+
+def test_position_counts_users_not_requests(requests_in_queue):
+    admission = requests_in_queue.admission
+    for user_id in (1, 1, 1, 2):
+        requests_in_queue.start(user_id)
+    assert admission.queue_depth == 4
+    assert admission.position(1) == 1
+    assert admission.position(2) == 2
+    assert admission.position(3) is None
+
+
+def test_concurrency_limit():
+    admission = AdmissionController(max_concurrent=2, rate_per_s=0)
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def run(user_id: int):
+        with admission.admit(user_id):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=run, args=(user_id % 3,)) for user_id in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert peak[0] == 2
+    assert admission.queue_depth == 0
+
+
+def test_rate_limit_spaces_requests():
+    admission = AdmissionController(max_concurrent=10, rate_per_s=20, burst=1)
+    start = time.monotonic()
+    for _ in range(4):
+        with admission.admit(1):
+            pass
+    assert time.monotonic() - start >= 3 / 20 * 0.9  # первый из запаса, остальные по 50 мс
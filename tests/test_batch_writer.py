@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+from app import BatchWriter, SessionWriter
+from conftest import study_event
+
+
+@pytest.fixture
+def writer(db):
+    writer = SessionWriter(db, flush_interval_s=3600)  # сбрасывается только явно
+    yield writer
+    writer._pending.clear()
+    writer.close()
+
+
+def session_count(db) -> int:
+    with db.read() as conn:
+        return conn.execute("SELECT COUNT(*) FROM study_sessions").fetchone()[0]
+
+
+class FlakyWriter(BatchWriter):
+    """Пишет в список; пока locked - как занятая база"""
+
+    thread_name = "flaky-writer"
+
+    def __init__(self):
+        self.written = []
+        self.locked = False
+        super().__init__(flush_interval_s=3600, max_attempts=2)
+
+    def write_batch(self, batch):
+        if self.locked:
+            raise sqlite3.OperationalError("database is locked")
+        self.written.extend(batch)
+
+
+def test_batch_is_written_in_one_flush(db, writer):
+    for day in ("2026-10-17", "2026-10-18"):
+        writer.enqueue(study_event(day))
+    assert writer.pending_for(1)
+    assert writer.flush() == 2
+    assert session_count(db) == 2 and not writer.pending_for(1)
+
+
+def test_failing_batch_is_retried_then_split_and_bad_rows_dropped(db, writer):
+    bad = study_event("2026-10-18", duration={"minutes": 10})  # sqlite не может связать параметр
+    for event in (study_event("2026-10-16"), bad, study_event("2026-10-17")):
+        writer.enqueue(event)
+
+    for _ in range(writer.max_attempts - 1):
+        with pytest.raises(sqlite3.Error):
+            writer.flush()
+        assert len(writer.pending_for(1)) == 3 and session_count(db) == 0
+
+    assert writer.flush() == 3
+    assert session_count(db) == 2
+    assert writer.dropped == 1 and writer.pending_for(1) == []
+    assert db.verify_rollups()["user_totals"] == 0
+
+
+def test_failure_counter_resets_after_success(db, writer):
+    writer.enqueue(study_event("2026-10-18", duration={"minutes": 10}))
+    with pytest.raises(sqlite3.Error):
+        writer.flush()
+    writer._pending.clear()
+    writer.enqueue(study_event("2026-10-18"))
+    assert writer.flush() == 1
+    writer.enqueue(study_event("2026-10-18", duration={"minutes": 10}))
+    with pytest.raises(sqlite3.Error):
+        writer.flush()  # снова первая неудача, а не max_attempts-я
+    assert writer.dropped == 0
+
+
+def test_rows_are_kept_while_database_is_unavailable():
+    writer = FlakyWriter()
+    try:
+        writer.enqueue("a")
+        writer.enqueue("b")
+        writer.locked = True
+        with pytest.raises(sqlite3.OperationalError):
+            writer.flush()
+        assert writer.flush() == 0  # разбор по строкам: ни одна не отброшена
+        assert writer._pending == ["a", "b"] and writer.dropped == 0
+
+        writer.locked = False
+        assert writer.flush() == 2
+        assert writer.written == ["a", "b"] and writer._pending == []
+    finally:
+        writer.close()
+
+
+def test_batch_writer_requires_write_batch():
+    with pytest.raises(TypeError):
+        BatchWriter()
@@ -0,0 +1,70 @@
+import json
+
+from app import Exercise, check_answer_locally, normalize_answer, parse_exercises
+
+
+def test_normalize_ignores_case_punctuation_and_spaces():
+    assert normalize_answer("  Hello,   WORLD!! ") == "hello world"
+    assert normalize_answer("¿Qué tal?") == "que tal"
+
+
+def test_normalize_keeps_accents_on_request():
+    assert normalize_answer("Está", strip_accents=False) == "está"
+    assert normalize_answer("Ёлка") == "елка"
+
+
+def test_normalize_keeps_marks_outside_latin_greek_cyrillic():
+    # дакутэн отличает が от か - это разные слоги
+    assert normalize_answer("が") != normalize_answer("か")
+
+
+def test_exact_answer():
+    exercise = Exercise("¿Dónde ___ el libro?", ("está",), "estar - местоположение")
+    assert check_answer_locally(exercise, "Está.") == (True, "estar - местоположение")
+
+
+def test_answer_without_diacritics_is_accepted_with_hint():
+    exercise = Exercise("¿Dónde ___ el libro?", ("está",), "estar - местоположение")
+    correct, comment = check_answer_locally(exercise, "esta")
+    assert correct
+    assert comment.startswith("Обратите внимание на диакритику: está")
+
+
+def test_wrong_answer_shows_first_accepted():
+    exercise = Exercise("I ___ a student", ("am", "'m"))
+    assert check_answer_locally(exercise, "is") == (False, "Правильный ответ: am.")
+
+
+def test_free_text_mismatch_goes_to_tutor():
+    exercise = Exercise("Переведите: я люблю читать", ("I love reading", "I like to read"), free_text=True)
+    assert check_answer_locally(exercise, "i like to read") is not None
+    assert check_answer_locally(exercise, "Reading is my hobby") is None
+
+
+def test_parse_exercises_from_fenced_json():
+    payload = {"topic": "Ser и estar", "explanation": "Коротко о глаголах",
+               "questions": [{"question": "Yo ___ cansado", "answers": ["estoy"], "options": ["soy", "estoy"]},
+                             {"question": "Переведите", "answers": ["Soy médico"], "free_text": True}]}
+    exercises = parse_exercises("grammar", f"Вот упражнения:\n```json\n{json.dumps(payload)}\n```")
+    assert exercises.kind == "grammar" and exercises.topic == "Ser и estar"
+    assert [exercise.options for exercise in exercises.exercises] == [("soy", "estoy"), ()]
+    assert [exercise.free_text for exercise in exercises.exercises] == [False, True]
+
+
+def test_parse_exercises_skips_incomplete_items():
+    text = json.dumps({"questions": ["строка", {"question": "", "answers": ["a"]},
+                                     {"question": "Без ответов", "answers": [" ", None]},
+                                     {"question": "Q", "answers": [" a "], "explanation": None}]})
+    exercises = parse_exercises("test", text)
+    assert exercises.exercises == (Exercise("Q", ("a",)),)
+
+
+def test_options_disable_free_text():
+    text = json.dumps({"questions": [{"question": "Q", "answers": ["a"], "options": ["a", "b"], "free_text": True}]})
+    assert not parse_exercises("test", text).exercises[0].free_text
+
+
+def test_parse_exercises_rejects_other_formats():
+    assert parse_exercises("test", "Извините, не могу составить упражнения") is None
+    assert parse_exercises("test", "{не json}") is None
+    assert parse_exercises("test", json.dumps({"questions": []})) is None
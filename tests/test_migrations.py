@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+from app import DatabaseManager
+from conftest import study_event
+
+V8_MIGRATIONS = 8  # словарь интервальных повторений
+
+
+class V8DatabaseManager(DatabaseManager):
+    """База в том виде, в каком ее оставляли версии до триггера серий с сессиями задним числом"""
+
+    def migrations(self):
+        return super().migrations()[:V8_MIGRATIONS]
+
+
+def table_names(db: DatabaseManager) -> set:
+    with db.read() as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+
+
+def test_fresh_database_is_at_latest_version(db):
+    assert db.schema_version() == len(db.migrations())
+    assert {"users", "study_sessions", "user_totals", "user_streaks", "response_cache", "messages",
+            "api_usage", "vocabulary", "trg_study_sessions_streak"} <= table_names(db)
+
+
+def test_migrate_is_idempotent(db):
+    db.migrate()
+    assert db.schema_version() == len(db.migrations())
+
+
+def test_v8_database_is_at_version_8(db_path):
+    old = V8DatabaseManager(db_path, pool_size=1)
+    try:
+        assert old.schema_version() == V8_MIGRATIONS
+    finally:
+        old.close()
+
+
+def test_migrating_v8_database_repairs_rollups(db_path):
+    old = V8DatabaseManager(db_path, pool_size=1)
+    old.add_study_sessions([study_event("2026-10-15"), study_event("2026-10-16"), study_event("2026-10-18")])
+    old.add_study_sessions([study_event("2026-10-17", session_type="grammar")])  # задним числом
+    assert old.verify_rollups()["user_streaks"] > 0  # прежний триггер серию не пересчитывал
+    old.close()
+
+    db = DatabaseManager(db_path, pool_size=1)
+    try:
+        assert db.schema_version() == len(db.migrations())
+        assert all(count == 0 for count in db.verify_rollups().values())
+        db.add_study_sessions([study_event("2026-10-14")])
+        assert all(count == 0 for count in db.verify_rollups().values())
+    finally:
+        db.close()
+
+
+def test_verify_rollups_detects_drift(db):
+    db.add_study_sessions([study_event("2026-10-17"), study_event("2026-10-18", target_language="spanish")])
+    assert all(count == 0 for count in db.verify_rollups().values())
+    with db.write() as conn:
+        conn.execute("UPDATE user_totals SET total_time = total_time + 1")
+    assert db.verify_rollups()["user_totals"] == 2  # лишняя строка и недостающая
+    db.rebuild_rollups()
+    assert all(count == 0 for count in db.verify_rollups().values())
+
+
+def test_unique_user_languages(db):
+    with db.write() as conn:
+        conn.execute("INSERT INTO user_languages (user_id, target_language) VALUES (1, 'english')")
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO user_languages (user_id, target_language) VALUES (1, 'english')")
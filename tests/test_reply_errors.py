@@ -0,0 +1,99 @@
+from concurrent.futures import Future
+
+import pytest
+import requests
+
+from app import (CacheTouchWriter, ConversationContext, ConversationStore, PendingReply, ResponseCache,
+                 SessionWriter, StreamingReply)
+
+
+def chunks(*parts, error: Exception = None):
+    yield from parts
+    if error is not None:
+        raise error
+
+
+class FakeTutor:
+    """Репетитор без сети: отдает заданные куски ответа и, если нужно, обрывается ошибкой"""
+
+    def __init__(self, *parts, error: Exception = None):
+        self.parts = parts
+        self.error = error
+
+    def get_system_prompt(self, target_language, interface_language, level):
+        return "system"
+
+    def summarize(self, summary, messages, tag=None):
+        return None
+
+    def stream_message(self, message, target_language, interface_language, level, history, stream=True, tag=None):
+        return StreamingReply(chunks(*self.parts, error=self.error))
+
+
+def test_streaming_reply_keeps_error_out_of_answer():
+    reply = StreamingReply(chunks("Hola", ", amigo", error=requests.exceptions.ConnectionError("reset")))
+    assert list(reply) == ["Hola", ", amigo", "Ошибка при обращении к API: reset"]
+    assert reply.answer == "Hola, amigo"
+    assert reply.error == "Ошибка при обращении к API: reset"
+    assert reply.text == "Hola, amigo\n\nОшибка при обращении к API: reset"
+    assert reply.total_s is not None
+
+
+def test_streaming_reply_without_error():
+    reply = StreamingReply(chunks("Hola"))
+    list(reply)
+    assert reply.error is None and reply.text == reply.answer == "Hola"
+
+
+@pytest.fixture
+def services(db):
+    with db.write() as conn:
+        conn.execute("INSERT INTO users (id, username, password_hash) VALUES (1, 'ana', 'x')")
+    writer, touches = SessionWriter(db, flush_interval_s=3600), CacheTouchWriter(db, flush_interval_s=3600)
+    store, cache = ConversationStore(db), ResponseCache(db, touches, variants=1)
+    yield writer, cache, store
+    writer.close()
+    touches.close()
+
+
+def run_reply(services, tutor: FakeTutor) -> PendingReply:
+    writer, cache, store = services
+    job = PendingReply(1, "Привет", "spanish", "russian", "A1", [], cache_key="greeting")
+    job.future = Future()
+    job.run(tutor, ConversationContext(), writer, cache, store)
+    job.future.set_result(None)
+    return job
+
+
+def test_failed_request_is_not_saved(services):
+    writer, cache, store = services
+    job = run_reply(services, FakeTutor(error=requests.exceptions.Timeout("timed out")))
+    assert job.assistant_message is None
+    assert job.error == "Ошибка при обращении к API: timed out"
+    assert store.load_page(1, "spanish") == []
+    assert cache.get("greeting") is None
+
+
+def test_broken_stream_saves_only_the_answer(services):
+    writer, cache, store = services
+    job = run_reply(services, FakeTutor("¡Hola!", " ¿Qué", error=requests.exceptions.ConnectionError("reset")))
+    assert job.error == "Ошибка при обращении к API: reset"
+    assert job.text.endswith(job.error)
+    assert [msg["content"] for msg in store.load_page(1, "spanish")] == ["¡Hola! ¿Qué"]
+    assert cache.get("greeting") is None  # оборванный ответ не кэшируется
+
+
+def test_successful_reply_is_saved_and_cached(services):
+    writer, cache, store = services
+    job = run_reply(services, FakeTutor("¡Hola!"))
+    assert job.error is None
+    assert job.assistant_message["content"] == "¡Hola!"
+    assert cache.get("greeting") == "¡Hola!"
+
+
+def test_job_exception_becomes_error_state():
+    job = PendingReply(1, "Привет", "spanish", "russian", "A1", [])
+    job.future = Future()
+    job.future.set_exception(ValueError("нет связи"))
+    assert job.error == "Произошла ошибка: нет связи"
+    assert job.text == ""
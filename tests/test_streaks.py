@@ -0,0 +1,62 @@
+from app import UserStatistics
+from conftest import study_event
+
+
+def streak_row(db, user_id: int = 1):
+    with db.read() as conn:
+        return conn.execute(
+            "SELECT current_streak, longest_streak, last_study_date FROM user_streaks WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+
+def add_days(db, *days: str, user_id: int = 1):
+    for day in days:  # по одной пачке на день, как при отложенной записи
+        db.add_study_sessions([study_event(day, user_id=user_id)])
+
+
+def test_consecutive_days_extend_streak(db):
+    add_days(db, "2026-10-16", "2026-10-17", "2026-10-18")
+    assert streak_row(db) == (3, 3, "2026-10-18")
+
+
+def test_same_day_does_not_change_streak(db):
+    add_days(db, "2026-10-17", "2026-10-18", "2026-10-18")
+    assert streak_row(db) == (2, 2, "2026-10-18")
+
+
+def test_gap_starts_new_streak_and_keeps_longest(db):
+    add_days(db, "2026-10-10", "2026-10-11", "2026-10-12", "2026-10-17", "2026-10-18")
+    assert streak_row(db) == (2, 3, "2026-10-18")
+
+
+def test_backdated_session_joins_streaks(db):
+    add_days(db, "2026-10-15", "2026-10-16", "2026-10-18")
+    assert streak_row(db) == (1, 2, "2026-10-18")
+    add_days(db, "2026-10-17")
+    assert streak_row(db) == (4, 4, "2026-10-18")
+    assert db.verify_rollups()["user_streaks"] == 0
+
+
+def test_backdated_session_before_current_streak_updates_longest(db):
+    add_days(db, "2026-10-01", "2026-10-03", "2026-10-17", "2026-10-18")
+    add_days(db, "2026-10-02")
+    assert streak_row(db) == (2, 3, "2026-10-18")
+    assert db.verify_rollups()["user_streaks"] == 0
+
+
+def test_backdated_batch_out_of_order(db):
+    db.add_study_sessions([study_event(day) for day in ("2026-10-18", "2026-10-16", "2026-10-17", "2026-10-15")])
+    assert streak_row(db) == (4, 4, "2026-10-18")
+
+
+def test_backdated_session_touches_only_its_user(db):
+    add_days(db, "2026-10-17", "2026-10-18", user_id=1)
+    add_days(db, "2026-10-10", "2026-10-18", user_id=2)
+    add_days(db, "2026-10-11", user_id=2)
+    assert streak_row(db, 1) == (2, 2, "2026-10-18")
+    assert streak_row(db, 2) == (1, 2, "2026-10-18")
+
+
+def test_streak_expires_without_recent_sessions(db):
+    add_days(db, "2020-01-01", "2020-01-02")
+    assert UserStatistics(db).get_streak_state(1) == (0, "2020-01-02")